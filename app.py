@@ -1,21 +1,37 @@
 import logging
 import logging.handlers
+import functools
 import json
 import os
 import os.path
 import time
 from datetime import datetime
 import threading
-from multiprocessing import Lock, Process, Value, Queue
+from multiprocessing import Value, Queue
 from multiprocessing.managers import SharedMemoryManager
 from pathlib import Path
-import cv2
-import yaml
+from queue import Empty
 from rich.progress import Progress, TextColumn
 
+import darkcyan.encoder
+import darkcyan.inference_server
 import darkcyan.yolo_proc
+import darkcyan.zones
 import darkcyan_utils.SignalMonitor as SignalMonitor
 from darkcyan.config import Config
+from darkcyan.config_reload import ConfigWatcher, SegmentPool, diff_sources, restart_only_changes
+from darkcyan.detection_store import DetectionStore
+from darkcyan.detections import boxes
+from darkcyan.encoder import DEFAULT_OUTPUT_PORT, OutputConfig
+from darkcyan.event_ring import EventRing, events_by_frame
+from darkcyan.frame_ring import FrameRing
+from darkcyan.latency import LatencyHistograms, LatencyWindow
+from darkcyan.notify import notification_pipe, wait_for_notifications
+from darkcyan.pyramid import DEFAULT_GEOMETRY_CACHE, DEFAULT_PYRAMID, GeometryCache, pyramid_shapes
+from darkcyan.status_block import STATE_RESTARTING, StatusBlock
+from darkcyan.supervisor import SupervisedProcess
+from darkcyan.thread_plan import ENCODER, INFERENCE_SERVER, apply_thread_budget, describe_plan, plan_threads
+from darkcyan.warmup_passes import DEFAULT_WARMUP_PASSES_DIR
 
 import numpy as np
 
@@ -31,131 +47,572 @@ def logger_thread(q):
 
 class DarkCyanSourceConfig:
 
-    def __init__(self, source_name, source_path, keep_running) -> None:
+    def __init__(self, source_name, source_path, keep_running, frame_ring_slots=3, max_frame_shape=(2160, 3840, 3), motion_gate=None, capture_backend=None, capture_options=None, zones=None, tracker=None, pyramid=None) -> None:
 
         self.source_name = source_name
         self.source_path = source_path
-        self.buffer_lock = Lock()
-        self.source_fps = Value("f")
-        self.inference_fps = Value("f")        
+        self.frame_ring_slots = frame_ring_slots
+        # what the rings are sized for until the source has reported its native geometry
+        self.max_frame_shape = tuple(max_frame_shape)
+        # {level: width} of the pyramid levels published beside the full frame
+        self.pyramid = pyramid or {}
+        self.motion_gate = motion_gate
+        self.capture_backend = capture_backend
+        self.capture_options = capture_options
+        self.zones = zones
+        self.tracker = tracker
         self.keep_running = keep_running
 
+def camera_zones(app_config, source_settings):
+    return app_config.get("camera_zones", {}).get(source_settings.get("camera_zones_key", source_settings["name"]), {})
+
+def motion_gate_config(app_config, source_settings):
+    """Source's motion_gate settings, with zone names resolved to their camera_zones polygons"""
+
+    gate_config = source_settings.get("motion_gate")
+    if not gate_config:
+        return None
+    gate_config = dict(gate_config)
+    zones = gate_config.get("zones")
+    if zones:
+        source_zones = camera_zones(app_config, source_settings)
+        gate_config["zones"] = [source_zones[zone]["coords"] if isinstance(zone, str) else zone for zone in zones]
+    return gate_config
+
+def zone_config(app_config, source_settings):
+    """ZoneEngine settings for the source, every camera_zones polygon of the camera plus the optional zones section (anchor, min_overlap)"""
+
+    source_zones = camera_zones(app_config, source_settings)
+    settings = source_settings.get("zones", {})
+    if not source_zones or not settings.get("enabled", True):
+        return None
+    return {**settings, "zones": {zone: source_zones[zone]["coords"] for zone in source_zones}}
+
+def source_settings(app_config, source):
+    """DarkCyanSourceConfig arguments for the source, resolved so two configs compare equal exactly when the source needs no restart"""
+
+    settings = app_config["sources"][source]
+    return {
+        "source_name": settings["name"],
+        "source_path": settings["cv2_connection_string"],
+        "frame_ring_slots": settings.get("frame_ring_slots", 3),
+        "max_frame_shape": tuple(settings.get("max_frame_shape", (2160, 3840, 3))),
+        "motion_gate": motion_gate_config(app_config, settings),
+        "capture_backend": settings.get("capture_backend"),
+        "capture_options": settings.get("capture_options"),
+        "zones": zone_config(app_config, settings),
+        "tracker": settings.get("tracker"),
+        "pyramid": settings.get("pyramid", DEFAULT_PYRAMID),
+    }
+
+
+class SourceFleet:
+    """The running sources, started, retired and restarted one at a time as the runtime config changes.
+
+    Shared memory comes from a SegmentPool, so a source restarted with the same ring sizes gets its
+    segments back.  Retired processes are stopped without blocking the main loop, their segments go
+    back to the pool and a changed source's replacement starts once they have exited.
+    """
+
+    def __init__(self, app_config, logging_queue, smm) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.app_config = app_config
+        # what the model, server and rings were started with, changes to these need a restart
+        self.startup_config = app_config
+        # {section: value} of the restart-only changes already logged, each is reported once
+        self.reported_restart_changes = {}
+        self.logging_queue = logging_queue
+        self.pool = SegmentPool(smm)
+        self.progress = None
+
+        self.model_path = app_config.get("model_path", darkcyan.yolo_proc.DEFAULT_MODEL_PATH)
+        self.model_imgsz = tuple(app_config.get("model_imgsz", darkcyan.yolo_proc.DEFAULT_MODEL_IMGSZ))
+        # Warm-up pass counts remembered per model and input size, set to null to always run every pass
+        self.warmup_passes_dir = app_config.get("warmup_passes_dir", DEFAULT_WARMUP_PASSES_DIR)
+        # Per-source detection events, sized for a busy scene to outlast a slow main loop tick
+        self.event_ring_capacity = app_config.get("event_ring_capacity", 4096)
+        # Native frame shape each source reported, its rings are sized from it on the next start
+        self.geometry = GeometryCache(app_config.get("frame_geometry_cache", DEFAULT_GEOMETRY_CACHE))
+
+        # With the inference server enabled the source processes only capture, one process per host runs the model
+        self.server_config = app_config.get("inference_server", {})
+        self.use_inference_server = self.server_config.get("enabled", False)
+        # the server's arguments hold this list, so a restarted server gets the current sources
+        self.inference_server_channels = []
+        self.inference_server_process = None
+        self.server_control = Queue() if self.use_inference_server else None
+
+        self.encoder_process = None
+        self.outputs_signature = None
+
+        # Cores and thread pool sizes per process, so the sources don't each size their pools to the whole host
+        self.thread_config = app_config.get("thread_plan", {})
+        self.thread_plan = {}
+
+        self.video_sources = {}
+        self.retiring = {}
+        # settings of changed sources waiting for their previous processes to exit
+        self.pending = {}
+        # event source ids stay with the source key across restarts
+        self.source_ids = {}
+
+    def __repr__(self):
+        return f"SourceFleet({list(self.video_sources)} running, {list(self.retiring)} retiring, {self.pool})"
+
+    def plan(self, sources):
+        if not self.thread_config.get("enabled", True):
+            return {}
+        reserved_cores = self.thread_config.get("reserved_cores", 1)
+        try:
+            plan = plan_threads(list(sources), self.use_inference_server, reserved_cores=reserved_cores, overrides=self.thread_config.get("overrides"))
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Ignoring thread_plan overrides, {e}")
+            plan = plan_threads(list(sources), self.use_inference_server, reserved_cores=reserved_cores)
+        for line in describe_plan(plan):
+            self.logger.info(f"Thread plan {line}")
+        return plan
+
+    def initializer(self, name):
+        budget = self.thread_plan.get(name)
+        return functools.partial(apply_thread_budget, budget) if budget is not None else None
+
+    def _take(self, entry, size):
+        segment = self.pool.take(size)
+        entry["segments"].append((segment, size))
+        return segment
+
+    def _create(self, source, settings):
+        process_config = DarkCyanSourceConfig(keep_running=Value("b", True), **settings)
+        entry = {"vs": process_config, "settings": settings, "segments": []}
+        entry["source_id"] = self.source_ids.setdefault(source, len(self.source_ids))
+
+        slots = process_config.frame_ring_slots
+        entry["frame_shape"] = self.geometry.get(process_config.source_path)
+        if self.use_inference_server:
+            # the server annotates and publishes the capture frame, it builds no pyramid
+            shapes = {"full": entry["frame_shape"] or process_config.max_frame_shape}
+        else:
+            shapes = pyramid_shapes(entry["frame_shape"] or process_config.max_frame_shape, process_config.pyramid)
+        entry["levels"] = {}
+        entry["slot_bytes"] = {}
+        for level, shape in shapes.items():
+            slot_bytes = int(np.prod(shape))
+            if level != "full" and entry["frame_shape"] is None:
+                # aspect unknown until the first frame, room for anything up to square
+                slot_bytes = int(shape[1] * shape[1] * shape[2])
+            level_shared_memory = self._take(entry, FrameRing.required_size(slots, slot_bytes))
+            FrameRing.create(level_shared_memory, slots, slot_bytes)
+            entry["levels"][level] = (level_shared_memory, shape)
+            entry["slot_bytes"][level] = slot_bytes
+        infer_shared_memory = entry["levels"]["full"][0]
+        status_shared_memory = self._take(entry, StatusBlock.required_size())
+
+        entry["shm_status"] = status_shared_memory
+        entry["status"] = StatusBlock.create(status_shared_memory)
+
+        # Per-stage latency histograms, written by the worker(s) and read here without any messaging
+        latency_shared_memory = self._take(entry, LatencyHistograms.required_size())
+        entry["latency"] = LatencyWindow(LatencyHistograms.create(latency_shared_memory))
+
+        event_shared_memory = self._take(entry, EventRing.required_size(self.event_ring_capacity))
+        entry["events"] = EventRing.create(event_shared_memory, self.event_ring_capacity)
+
+        # Signalled by whoever publishes this source's frames, the main loop sleeps on these instead of polling
+        notify_reader, notify_writer = notification_pipe()
+        entry["notify"] = notify_reader
+        entry["notify_writer"] = notify_writer
+
+        if self.use_inference_server:
+            input_slot_bytes = self.model_imgsz[0] * self.model_imgsz[1] * 3
+            input_shared_memory = self._take(entry, FrameRing.required_size(3, input_slot_bytes))
+            FrameRing.create(input_shared_memory, 3, input_slot_bytes)
+            # capture frames waiting for their detections, as large as the published frames
+            capture_slot_bytes = int(np.prod(shapes["full"]))
+            capture_shared_memory = self._take(entry, FrameRing.required_size(slots, capture_slot_bytes))
+            FrameRing.create(capture_shared_memory, slots, capture_slot_bytes)
+            entry["channels"] = {
+                "source_key": source,
+                "source_name": process_config.source_name,
+                "input_shared_memory": input_shared_memory,
+                "capture_shared_memory": capture_shared_memory,
+                "infer_shared_memory": infer_shared_memory,
+                "status_shared_memory": status_shared_memory,
+                "latency_shared_memory": latency_shared_memory,
+                "notify_connection": notify_writer,
+                "event_shared_memory": event_shared_memory,
+                "source_id": entry["source_id"],
+                "zone_config": process_config.zones,
+                "tracker_config": process_config.tracker,
+            }
+            process = SupervisedProcess(
+                process_config.source_name,
+                darkcyan.yolo_proc.run_capture,
+                process_config.keep_running,
+                args=[
+                    self.logging_queue,
+                    source,
+                    process_config.source_name,
+                    process_config.source_path,
+                    input_shared_memory,
+                    capture_shared_memory,
+                    status_shared_memory,
+                    process_config.keep_running,
+                    self.model_imgsz,
+                    process_config.motion_gate,
+                    process_config.capture_backend,
+                    process_config.capture_options,
+                    latency_shared_memory,
+                ],
+                initializer=self.initializer(source),
+            )
+        else:
+            process = SupervisedProcess(
+                process_config.source_name,
+                darkcyan.yolo_proc.run,
+                process_config.keep_running,
+                args=[
+                    self.logging_queue,
+                    source,
+                    process_config.source_name,
+                    process_config.source_path,
+                    infer_shared_memory,
+                    status_shared_memory,
+                    event_shared_memory,
+                    process_config.keep_running,
+                    self.model_path,
+                    process_config.motion_gate,
+                    process_config.capture_backend,
+                    process_config.capture_options,
+                ],
+                kwargs={
+                    "latency_shared_memory": latency_shared_memory,
+                    "warmup_passes_dir": self.warmup_passes_dir,
+                    "notify_connection": notify_writer,
+                    "source_id": entry["source_id"],
+                    "zone_config": process_config.zones,
+                    "tracker_config": process_config.tracker,
+                    "pyramid_shared_memory": {level: shm for level, (shm, _) in entry["levels"].items() if level != "full"},
+                    "pyramid_widths": process_config.pyramid,
+                },
+                initializer=self.initializer(source),
+            )
+        process.on_restart = functools.partial(entry["status"].set_state, STATE_RESTARTING)
+        entry["process"] = process
+        return entry
+
+    def add(self, source, settings):
+        entry = self._create(source, settings)
+        self.video_sources[source] = entry
+        if self.progress is not None:
+            entry["task"] = self.progress.add_task(f"[blue]{entry['vs'].source_name}", start=False)
+        if "channels" in entry:
+            self.inference_server_channels.append(entry["channels"])
+            if self.inference_server_process is not None:
+                self.server_control.put(("add", entry["channels"]))
+        self.logger.info(f"Starting Process {entry['vs'].source_name}")
+        entry["process"].start()
+        self.logger.info(f"Started Process {entry['vs'].source_name}")
+
+    def retire(self, source):
+        entry = self.video_sources.pop(source)
+        self.logger.info(f"Retiring {entry['vs'].source_name}")
+        if "channels" in entry:
+            self.inference_server_channels.remove(entry["channels"])
+            self.server_control.put(("remove", source))
+        if "task" in entry:
+            self.progress.remove_task(entry["task"])
+        entry["process"].request_stop()
+        self.retiring[source] = entry
+
+    def _release(self, entry):
+        for segment, size in entry["segments"]:
+            self.pool.give(segment, size)
+        entry["notify"].close()
+        entry["notify_writer"].close()
+
+    def start(self, progress):
+        self.progress = progress
+        self.thread_plan = self.plan(self.app_config["sources"])
+        for source in self.app_config["sources"]:
+            self.add(source, source_settings(self.app_config, source))
+            self.logger.info(f"Loaded source: {source} with connection string {self.app_config['sources'][source]['cv2_connection_string']}")
+
+        if self.use_inference_server:
+            # The server holds the model, capture processes restart around it without it ever reloading
+            server_keep_running = Value("b", True)
+            self.inference_server_process = SupervisedProcess(
+                "inference-server",
+                darkcyan.inference_server.run,
+                server_keep_running,
+                args=[
+                    self.logging_queue,
+                    self.inference_server_channels,
+                    server_keep_running,
+                    self.model_path,
+                    self.model_imgsz,
+                    # unset: 8 for a PyTorch model, 1 for exports with a fixed batch
+                    self.server_config.get("max_batch"),
+                    self.server_config.get("max_wait_ms", 20),
+                    self.warmup_passes_dir,
+                    self.server_control,
+                ],
+                initializer=self.initializer(INFERENCE_SERVER),
+            )
+            self.logger.info(f"Starting inference server for {len(self.inference_server_channels)} sources")
+            self.inference_server_process.start()
+
+        self.refresh_outputs()
+
+    def apply(self, app_config):
+        """Brings the running sources in line with a reloaded config, only added, removed and changed sources are touched"""
+
+        try:
+            new_settings = {source: source_settings(app_config, source) for source in app_config["sources"]}
+        except (KeyError, TypeError) as e:
+            self.logger.error(f"Ignoring config reload, a source is missing {e}")
+            return
+        pending_restart = restart_only_changes(self.startup_config, app_config)
+        for section in pending_restart:
+            if section not in self.reported_restart_changes or self.reported_restart_changes[section] != app_config.get(section):
+                self.logger.info(f"Config section {section} changed, it only takes effect after a restart")
+                self.reported_restart_changes[section] = app_config.get(section)
+        # a section changed back to what is running needs nothing, a later change to it is reported again
+        self.reported_restart_changes = {section: value for section, value in self.reported_restart_changes.items() if section in pending_restart}
+
+        running = {source: entry["settings"] for source, entry in self.video_sources.items()}
+        running.update(self.pending)
+        added, removed, changed = diff_sources(running, new_settings)
+        if added or removed:
+            # started sources get their share of the new plan, running ones keep theirs until they restart
+            self.thread_plan = self.plan(new_settings)
+        for source in removed:
+            self.pending.pop(source, None)
+            if source in self.video_sources:
+                self.retire(source)
+        for source in changed + added:
+            if source in self.video_sources:
+                self.retire(source)
+            if source in self.retiring:
+                # its segments are reused once the old processes have let go of them
+                self.pending[source] = new_settings[source]
+            else:
+                self.add(source, new_settings[source])
+        self.app_config = app_config
+        self.logger.info(f"Config reloaded, {len(added)} sources added, {len(removed)} removed, {len(changed)} changed, {len(new_settings) - len(added) - len(changed)} untouched")
+        self.refresh_outputs()
+
+    def fits(self, entry, frame_shape):
+        """Whether every ring of a source has room for frame_shape frames and their pyramid levels"""
+
+        shapes = pyramid_shapes(frame_shape, entry["vs"].pyramid)
+        return all(int(np.prod(shapes[level])) <= slot_bytes for level, slot_bytes in entry["slot_bytes"].items())
+
+    def negotiate_geometry(self, source):
+        """Re-creates a source whose rings are too small for the frame shape it reported"""
+
+        entry = self.video_sources[source]
+        reported = entry["status"].frame_shape()
+        if reported is None or reported == entry["frame_shape"]:
+            return
+        process_config = entry["vs"]
+        if self.geometry.get(process_config.source_path) != reported:
+            self.geometry.put(process_config.source_path, reported)
+        if self.fits(entry, reported):
+            # oversized rings only cost memory, re-creating would cost a cold model load, the next start sizes them exactly
+            entry["frame_shape"] = reported
+            return
+        self.logger.info(f"{process_config.source_name} frames are {reported}, its rings were sized for {entry['frame_shape'] or process_config.max_frame_shape}, re-creating them")
+        self.retire(source)
+        self.pending[source] = entry["settings"]
+
+    def poll(self, now):
+        for source in list(self.video_sources):
+            self.negotiate_geometry(source)
+
+        # Restart any worker that has exited, each after its own backoff, the rest carry on untouched
+        for source in self.video_sources:
+            self.video_sources[source]["process"].poll(now)
+        if self.inference_server_process is not None:
+            self.inference_server_process.poll(now)
+        if self.encoder_process is not None:
+            self.encoder_process.poll(now)
+
+        for source in list(self.retiring):
+            process = self.retiring[source]["process"]
+            # the server drops a source between batches, a second's grace before its rings can be handed out again
+            if not process.reap(now) or now - process.stop_requested_at < 1:
+                continue
+            self._release(self.retiring.pop(source))
+            self.logger.info(f"Retired {process.name}, {self.pool}")
+            if source in self.pending:
+                self.add(source, self.pending.pop(source))
+        self.refresh_outputs()
+
+    def outputs(self):
+        output_configs = self.app_config.get("outputs")
+        if output_configs is None:
+            # what app.py always streamed, the 'front' camera on port 5400
+            output_configs = {source: {} for source in self.video_sources if self.video_sources[source]["vs"].source_name == "front"}
+        # ports follow the config order, a source that is not running (yet) keeps its port free
+        outputs = []
+        for i, (source, settings) in enumerate(output_configs.items()):
+            if source not in self.video_sources:
+                continue
+            output = OutputConfig(source, None, **{"port": DEFAULT_OUTPUT_PORT + i, **(settings or {})})
+            # the narrowest pyramid level still as wide as the stream, so the encoder scales down as little as possible
+            levels = list(self.video_sources[source]["levels"].values())
+            output.infer_shared_memory = next((shm for shm, shape in reversed(levels) if shape[1] >= output.size[0]), levels[0][0])
+            outputs.append(output)
+        return outputs
+
+    def refresh_outputs(self):
+        """(Re)starts the encoder when the set of outputs or the rings they read from changed"""
+
+        outputs = self.outputs()
+        signature = [(output.source_key, output.infer_shared_memory.name, output.host, output.port, output.fps, output.size, output.encoder, output.bitrate_kbps) for output in outputs]
+        if signature == self.outputs_signature:
+            return
+        self.outputs_signature = signature
+        if self.encoder_process is not None:
+            self.encoder_process.stop()
+            self.encoder_process = None
+        if outputs:
+            # Annotated frames are streamed by their own process, paced to each output's fps
+            encoder_keep_running = Value("b", True)
+            self.encoder_process = SupervisedProcess("encoder", darkcyan.encoder.run, encoder_keep_running, args=[self.logging_queue, outputs, encoder_keep_running], initializer=self.initializer(ENCODER))
+            self.logger.info(f"Starting encoder for {outputs}")
+            self.encoder_process.start()
+
+    def event_sources(self):
+        """(source, entry) of every source whose event ring may hold events, retiring ones included"""
+
+        return list(self.retiring.items()) + list(self.video_sources.items())
+
+    def notify_readers(self):
+        return [entry["notify"] for _, entry in self.event_sources()]
+
+    def stop(self):
+        supervised = [entry["process"] for _, entry in self.event_sources()]
+        if self.inference_server_process is not None:
+            supervised.append(self.inference_server_process)
+        if self.encoder_process is not None:
+            supervised.append(self.encoder_process)
+        for process in supervised:
+            process.request_stop()
+        for process in supervised:
+            process.join()
+
+
 def run(logging_queue):
 
     logger = logging.getLogger(__name__)
 
-    with open(        
-        Config.get_value("runtime_config_file"), "r"
-    ) as f:
-        app_config = yaml.load(f, Loader=yaml.FullLoader)
-        logger.info(f"Loaded config file: {Config.get_value('config_file')}")
-
+    # The sources are reloaded whenever the file changes, see SourceFleet.apply
+    config_file = Config.get_value("runtime_config_file")
+    config_watcher = ConfigWatcher(config_file)
+    app_config = config_watcher.load()
+    logger.info(f"Loaded config file: {Config.get_value('config_file')}")
+    reload_config = app_config.get("config_reload", {})
+    watch_config = reload_config.get("enabled", True)
+    config_watcher.interval_s = reload_config.get("interval_s", 2)
 
-    video_sources = {}
     keep_running = Value("b", True)
 
-    for source in app_config["sources"]:
-
-        vsc = DarkCyanSourceConfig(
-            app_config["sources"][source]["name"],
-            app_config["sources"][source]["cv2_connection_string"],
-            keep_running,
-        )
-        video_sources[source] = {"vs": vsc}
-        logger.info(f"Loaded source: {source} with connection string {app_config['sources'][source]['cv2_connection_string']}")
-    
     signal_monitor = SignalMonitor.SignalMonitor()
 
     smm = SharedMemoryManager()    
     smm.start()
 
-    results_queue = Queue(5)
-    
-    for source in video_sources:
-        process_config = video_sources[source]["vs"]
-        infer_shared_memory = smm.SharedMemory(size=1280 * 960 * 3)
-        status_shared_memory = smm.SharedMemory(size=100)
-
-        status = f"Initialising {process_config.source_name}..."
-
-        status_shared_memory.buf[: len(status)] = status.encode("utf-8")
-        status_shared_memory.buf[99] = len(status)
+    # Every detection event is appended to the on-disk store, query it with python -m darkcyan.detection_store
+    store_config = app_config.get("detection_store", {})
+    detection_store = None
+    if store_config.get("enabled", True):
+        store_path = store_config.get("path", (Path(Config.get_value("darkcyan_data_home")) / "detections").as_posix())
+        detection_store = DetectionStore(store_path, writable=True)
+        logger.info(f"Recording detections to {detection_store}")
 
-        video_sources[source]["ishm"] = infer_shared_memory
-        video_sources[source]["shm_status"] = status_shared_memory
+    # The terminal only needs redrawing a couple of times a second, frames are forwarded as they are published
+    ui_refresh_hz = app_config.get("ui_refresh_hz", 2)
 
-        process = Process(
-            name = process_config.source_name,
-            target=darkcyan.yolo_proc.run,
-            args=[
-                logging_queue,
-                source,
-                process_config.source_name,
-                process_config.source_path,
-                process_config.buffer_lock,
-                process_config.source_fps,
-                process_config.inference_fps,
-                infer_shared_memory,
-                status_shared_memory,
-                results_queue,
-                process_config.keep_running,
-            ],
-        )
-        video_sources[source]["process"] = process
+    fleet = SourceFleet(app_config, logging_queue, smm)
 
     start_time = time.time()
     run_for = 60 * 60
 
-    progress = Progress(TextColumn("[progress.descriptions]{task.description}"))
+    progress = Progress(TextColumn("[progress.descriptions]{task.description}"), refresh_per_second=ui_refresh_hz)
 
     with progress:
 
+        fleet.start(progress)
 
-        for source in video_sources:
-
-            process = video_sources[source]["process"]
-            video_sources[source]["task"] = progress.add_task(
-                f"[blue]{video_sources[source]['vs'].source_name}", start=False
-            )
-            logger.info(f"Starting Process {video_sources[source]['vs'].source_name}")
-            process.start()
-            logger.info(f"Started Process {video_sources[source]['vs'].source_name}")
-
-        fourcc_fmt = cv2.VideoWriter_fourcc(*'X265')
-        out_send = cv2.VideoWriter('appsrc is-live=true do-timestamp=true ! queue ! \
-                                videoconvert ! queue ! vtenc_h265 realtime=true bitrate=2048 ! h265parse ! \
-                                rtph265pay config-interval=1 pt=96 name=pay0 ! application/x-rtp,media=video,encoding-name=H265 ! queue ! \
-                                udpsink host=127.0.0.1 port=5400 sync=false',
-                                fourcc=fourcc_fmt, apiPreference=cv2.CAP_GSTREAMER, fps=25, frameSize = (800,600), isColor=True)
+        next_ui_refresh = 0
+        next_supervisor_poll = 0
         while (
             ((time.time() - start_time) < run_for)
             and not signal_monitor.exit_now
             and keep_running.value
         ):
 
-            for source in video_sources:
-                vsc = video_sources[source]["vs"]
-                str_len = video_sources[source]["shm_status"].buf[99]
-                update_txt = f"[green] Camera [green]{vsc.source_name}. [green] Status [green]{bytes(video_sources[source]['shm_status'].buf[:str_len]).decode('utf-8')  }.  " \
-                    f"[blue] Source FPS: [blue] {vsc.source_fps.value:.2f}, [blue] Infer FPS: [blue] {vsc.inference_fps.value:.2f}"
-                progress.update(video_sources[source]["task"], description=update_txt)
-                if(vsc.source_name=='front'):
-                    # assuming you know shape & dtype in advance
-                    frame_shape = (600, 800, 3)  
-                    frame_dtype = np.uint8
-
-                    # create numpy view into shared memory
-                    frame_arr = np.ndarray(frame_shape, dtype=frame_dtype, buffer=video_sources[source]["ishm"].buf)                    
-                    out_send.write(frame_arr)
-            if(not results_queue.empty()):
-                source_name, final_result_categories, final_result_boxes = results_queue.get(block=False)
-                log.info(f"Result: {source_name}, {final_result_categories}, {final_result_boxes}")
-                
-            else:
-                time.sleep(1/50)
+            now = time.time()
+            if now >= next_supervisor_poll:
+                if watch_config:
+                    new_config = config_watcher.poll(now)
+                    if new_config is not None:
+                        logger.info(f"{config_file} changed, applying it to the running sources")
+                        fleet.apply(new_config)
+                fleet.poll(now)
+                next_supervisor_poll = now + 1
+
+            video_sources = fleet.video_sources
+            if now >= next_ui_refresh:
+                for source in video_sources:
+                    vsc = video_sources[source]["vs"]
+                    status_block = video_sources[source]["status"]
+                    status = status_block.read()
+                    # None when the worker was mid-update on every retry, the line just waits for the next refresh
+                    if status is not None:
+                        if "class_names" not in video_sources[source] and status["class_count"]:
+                            video_sources[source]["class_names"] = status_block.class_names(status)
+                        update_txt = f"[green] Camera [green]{vsc.source_name}. [green] Status [green]{status_block.describe(status, video_sources[source].get('class_names'))}.  " \
+                            f"[blue] Source FPS: [blue] {status['source_fps']:.2f}, [blue] Infer FPS: [blue] {status['inference_fps']:.2f} ({status['inference_ms']:.0f}ms)"
+                        if video_sources[source]["events"].overflow:
+                            update_txt += f", [red] Events lost: [red] {video_sources[source]['events'].overflow}"
+                        if status["first_detection_s"]:
+                            update_txt += f", [blue] First detection: [blue] {status['first_detection_s']:.1f}s"
+                        latency = video_sources[source]["latency"].summary(now)
+                        for stage in ("predict", "end_to_end"):
+                            if stage in latency:
+                                update_txt += f", [blue] {stage} p50/p95/p99: [blue] {latency[stage]['p50_ms']:.0f}/{latency[stage]['p95_ms']:.0f}/{latency[stage]['p99_ms']:.0f}ms"
+                        progress.update(video_sources[source]["task"], description=update_txt)
+                next_ui_refresh = now + 1 / ui_refresh_hz
+
+            # Sleep until a worker publishes something, or the next refresh / supervisor poll is due
+            timeout = max(0, min(next_ui_refresh, next_supervisor_poll) - time.time())
+            wait_for_notifications(fleet.notify_readers(), timeout)
+
+            # Events are published just before the notification, so whatever woke us is in the rings by now
+            for source, entry in fleet.event_sources():
+                events = entry["events"].read()
+                if not len(events):
+                    continue
+                class_names = entry.get("class_names") or entry["status"].class_names()
+                source_zones = entry["vs"].zones
+                zone_names = list(source_zones["zones"]) if source_zones else []
+                if detection_store is not None:
+                    detection_store.append(source, events, class_names, zone_names)
+                for _, frame_id, frame_events in events_by_frame(events):
+                    final_result_categories = [class_names[cls] if cls < len(class_names) else str(cls) for cls in frame_events["cls"].tolist()]
+                    final_result_boxes = boxes(frame_events).tolist()
+                    if zone_names:
+                        final_result_zones = [darkcyan.zones.zone_names(zone_names, bits) for bits in frame_events["zones"].tolist()]
+                        log.info(f"Result: {source}, {final_result_categories}, {final_result_boxes}, {final_result_zones}")
+                    else:
+                        log.info(f"Result: {source}, {final_result_categories}, {final_result_boxes}")
 
         keep_running.value = False
-        time.sleep(2)
+        fleet.stop()
+        if detection_store is not None:
+            detection_store.close()
         smm.shutdown()
 
 
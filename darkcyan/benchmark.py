@@ -0,0 +1,165 @@
+"""Replay a recorded video through darkcyan.yolo_proc.run and report per-stage timings.
+
+    python -m darkcyan.benchmark recording.mp4 --json report.json --csv frames.csv
+    python -m darkcyan.benchmark recording.mp4 --rate 25 --drop-frames
+
+By default the replay is unpaced and every frame is processed, which measures the pipeline's maximum
+throughput.  --rate simulates a live camera at that fps, add --drop-frames to let the capture skip
+frames the way it would for a real camera when inference falls behind.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import logging.handlers
+import queue
+from multiprocessing import Value
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+
+from darkcyan import yolo_proc
+from darkcyan.frame_ring import FrameRing
+from darkcyan.stage_timing import STAGES, FrameTimingRecorder
+from darkcyan.status_block import StatusBlock
+
+
+def probe_frame_bytes(video_path):
+    stream = cv2.VideoCapture(video_path)
+    width = int(stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    stream.release()
+    if not width or not height:
+        raise ValueError(f"Unable to read the frame size of {video_path}")
+    return width * height * 3
+
+
+def run_benchmark(
+    video_path,
+    rate=0,
+    drop_frames=False,
+    model_path=yolo_proc.DEFAULT_MODEL_PATH,
+    motion_gate=None,
+):
+    """Run the full single-source pipeline over video_path, returns the FrameTimingRecorder."""
+
+    logging_queue = queue.Queue()
+    console = logging.StreamHandler()
+    console.setFormatter(
+        logging.Formatter("%(asctime)s %(name)-18s %(levelname)-8s %(message)s")
+    )
+    listener = logging.handlers.QueueListener(logging_queue, console)
+    listener.start()
+
+    slot_bytes = probe_frame_bytes(video_path)
+    infer_shared_memory = SharedMemory(
+        create=True, size=FrameRing.required_size(3, slot_bytes)
+    )
+    status_shared_memory = SharedMemory(create=True, size=StatusBlock.required_size())
+    FrameRing.create(infer_shared_memory, 3, slot_bytes)
+    StatusBlock.create(status_shared_memory)
+
+    recorder = FrameTimingRecorder()
+    try:
+        yolo_proc.run(
+            logging_queue,
+            "benchmark",
+            "benchmark",
+            video_path,
+            infer_shared_memory,
+            status_shared_memory,
+            None,
+            Value("b", True),
+            model_path,
+            motion_gate,
+            "replay",
+            {"rate": rate},
+            stage_recorder=recorder,
+            drop_frames=drop_frames,
+            max_capture_restarts=0,
+        )
+    finally:
+        listener.stop()
+        for shared_memory in (infer_shared_memory, status_shared_memory):
+            shared_memory.unlink()
+            try:
+                shared_memory.close()
+            except BufferError:
+                # a daemon thread from the run may still hold a view, the mapping goes with the process
+                pass
+    return recorder
+
+
+def write_csv(recorder, csv_path):
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["frame_id", *[f"{stage}_ms" for stage in STAGES]])
+        for frame_id, stages in recorder.by_frame().items():
+            writer.writerow(
+                [
+                    frame_id,
+                    *[
+                        f"{stages[stage] * 1e3:.3f}" if stage in stages else ""
+                        for stage in STAGES
+                    ],
+                ]
+            )
+
+
+def print_summary(summary):
+    print(
+        f"{summary['frames_read']} frames read, {summary['frames_inferred']} inferred, {summary['frames_published']} published in {summary['elapsed_s']:.1f}s"
+    )
+    print(
+        f"read {summary['read_fps']:.2f} fps, inference {summary['inference_fps']:.2f} fps, published {summary['published_fps']:.2f} fps"
+    )
+    print(
+        f"{'stage':<12} {'count':>7} {'mean':>8} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)"
+    )
+    for stage, stats in summary["stages"].items():
+        print(
+            f"{stage:<12} {stats['count']:>7} {stats['mean_ms']:>8.2f} {stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} "
+            f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DarkCyan yolo_proc replay benchmark")
+    parser.add_argument("video", help="Recorded video to replay")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Simulated source fps, 0 (default) replays unpaced",
+    )
+    parser.add_argument(
+        "--drop-frames",
+        action="store_true",
+        help="Let the capture skip frames when inference is behind, as for a live camera",
+    )
+    parser.add_argument(
+        "--model", default=yolo_proc.DEFAULT_MODEL_PATH, help="Detection model to load"
+    )
+    parser.add_argument("--json", help="Write the summary report to this file")
+    parser.add_argument("--csv", help="Write per-frame stage timings to this file")
+    args = parser.parse_args()
+
+    recorder = run_benchmark(
+        args.video, rate=args.rate, drop_frames=args.drop_frames, model_path=args.model
+    )
+    summary = recorder.summary()
+    summary["video"] = args.video
+    summary["rate"] = args.rate
+    summary["drop_frames"] = args.drop_frames
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4)
+    if args.csv:
+        write_csv(recorder, args.csv)
+
+
+if __name__ == "__main__":
+    main()
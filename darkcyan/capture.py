@@ -0,0 +1,197 @@
+import logging
+import time
+from sys import platform
+
+import cv2
+
+
+class CaptureBackend:
+    """Frame source used by DarkCyanVideoSource.
+
+    grab() advances the stream by one frame as cheaply as the backend allows, retrieve() turns the
+    last grabbed frame into a BGR ndarray.  Frames that are going to be dropped anyway only need a
+    grab(), so the colour conversion (and for some backends the decode) is never paid for them.
+    """
+
+    name = "base"
+
+    def __init__(self, source_path):
+        self.source_path = source_path
+        self.logger = logging.getLogger(__name__)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.source_path})"
+
+    def open(self):
+        raise NotImplementedError
+
+    def grab(self):
+        raise NotImplementedError
+
+    def retrieve(self):
+        raise NotImplementedError
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        pass
+
+    @property
+    def fps(self):
+        return 0.0
+
+
+class OpenCVCapture(CaptureBackend):
+    """cv2.VideoCapture, GStreamer on Linux and macOS as before, the platform default elsewhere."""
+
+    name = "opencv"
+
+    def __init__(self, source_path, api_preference=None):
+        super().__init__(source_path)
+        if api_preference is None:
+            api_preference = (
+                cv2.CAP_GSTREAMER
+                if platform in ("linux", "linux2", "darwin")
+                else cv2.CAP_ANY
+            )
+        self.api_preference = api_preference
+        self.stream = None
+
+    def open(self):
+        self.stream = cv2.VideoCapture(self.source_path, self.api_preference)
+        return self.stream.isOpened()
+
+    def grab(self):
+        return self.stream.grab()
+
+    def retrieve(self):
+        return self.stream.retrieve()
+
+    def read(self):
+        return self.stream.read()
+
+    def release(self):
+        if self.stream is not None:
+            self.stream.release()
+
+    @property
+    def fps(self):
+        return self.stream.get(cv2.CAP_PROP_FPS) if self.stream is not None else 0.0
+
+
+class PyAVCapture(CaptureBackend):
+    """FFmpeg through PyAV.  Decoding happens in grab() (later frames depend on it), the BGR conversion in retrieve()."""
+
+    name = "pyav"
+
+    def __init__(self, source_path, options=None, thread_count=2):
+        super().__init__(source_path)
+        self.options = options or {}
+        self.thread_count = thread_count
+        self.container = None
+        self.frame = None
+
+    def open(self):
+        import av
+
+        try:
+            self.container = av.open(self.source_path, options=self.options)
+        except Exception as e:
+            self.logger.error(f"PyAV unable to open {self.source_path}: {e}")
+            return False
+        self.video_stream = self.container.streams.video[0]
+        self.video_stream.thread_type = "AUTO"
+        self.video_stream.codec_context.thread_count = self.thread_count
+        self.frames = self.container.decode(video=0)
+        return True
+
+    def grab(self):
+        try:
+            self.frame = next(self.frames)
+        except Exception:
+            self.frame = None
+            return False
+        return True
+
+    def retrieve(self):
+        if self.frame is None:
+            return False, None
+        return True, self.frame.to_ndarray(format="bgr24")
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+
+    @property
+    def fps(self):
+        if self.container is None or not self.video_stream.average_rate:
+            return 0.0
+        return float(self.video_stream.average_rate)
+
+
+class FileReplayCapture(OpenCVCapture):
+    """Replays a recorded file.
+
+    rate=None paces at the file's own fps, rate=0 runs unpaced as fast as frames can be read and any
+    other value simulates a live source at that fps.  Frames are never skipped by the pacing, a
+    consumer that falls behind sees the same grab() skipping a live camera would.
+    """
+
+    name = "replay"
+
+    def __init__(self, source_path, rate=None, loop=False):
+        super().__init__(source_path, api_preference=cv2.CAP_ANY)
+        self.rate = rate
+        self.loop = loop
+        self.next_frame_time = None
+
+    def open(self):
+        if not super().open():
+            return False
+        if self.rate is None:
+            self.rate = super().fps or 25.0
+        self.next_frame_time = time.time()
+        return True
+
+    def grab(self):
+        if self.rate:
+            self.next_frame_time += 1.0 / self.rate
+            delay = self.next_frame_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        grabbed = self.stream.grab()
+        if not grabbed and self.loop:
+            self.stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            grabbed = self.stream.grab()
+        return grabbed
+
+    def read(self):
+        # not OpenCVCapture.read, that would bypass the pacing in grab()
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    @property
+    def fps(self):
+        return float(self.rate) if self.rate else super().fps
+
+
+CAPTURE_BACKENDS = {
+    OpenCVCapture.name: OpenCVCapture,
+    PyAVCapture.name: PyAVCapture,
+    FileReplayCapture.name: FileReplayCapture,
+}
+
+
+def create_capture(source_path, backend=None, options=None):
+    """Build the named capture backend, defaulting to the OpenCV/GStreamer capture used historically."""
+
+    backend = backend or OpenCVCapture.name
+    if backend not in CAPTURE_BACKENDS:
+        raise ValueError(
+            f"Unknown capture backend {backend}, expected one of {list(CAPTURE_BACKENDS)}"
+        )
+    return CAPTURE_BACKENDS[backend](source_path, **(options or {}))
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+from collections import defaultdict
+
+import yaml
+
+# Top level runtime config sections applied while running, everything else needs a restart.
+# zones only holds the colours zones are drawn in, read whenever they are drawn
+RELOADABLE_SECTIONS = ("sources", "camera_zones", "zones", "outputs", "config_reload")
+
+
+class ConfigWatcher:
+    """Polls the runtime config file and hands back the parsed config whenever its content changes.
+
+    Changes are detected by hashing the file, so an editor touching or rewriting it unchanged does
+    nothing.  A file that fails to parse is logged and skipped, the running config stays in effect
+    until the file is fixed.
+    """
+
+    def __init__(self, path, interval_s=2.0):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.interval_s = interval_s
+        self.digest = None
+        self.next_check = 0.0
+
+    def _read(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        return hashlib.sha1(data).hexdigest(), data
+
+    def load(self):
+        self.digest, data = self._read()
+        return yaml.load(data, Loader=yaml.FullLoader)
+
+    def poll(self, now):
+        """The new config if the file changed since the last load/poll, otherwise None"""
+
+        if now < self.next_check:
+            return None
+        self.next_check = now + self.interval_s
+        try:
+            digest, data = self._read()
+        except OSError as e:
+            self.logger.info(f"Unable to read {self.path}: {e}")
+            return None
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        try:
+            config = yaml.load(data, Loader=yaml.FullLoader)
+        except yaml.YAMLError as e:
+            self.logger.error(f"Ignoring change to {self.path}, it does not parse: {e}")
+            return None
+        if not isinstance(config, dict) or not isinstance(config.get("sources"), dict):
+            self.logger.error(f"Ignoring change to {self.path}, it has no sources")
+            return None
+        return config
+
+
+def diff_sources(old, new):
+    """(added, removed, changed) source keys between two {source: settings} maps"""
+
+    added = [source for source in new if source not in old]
+    removed = [source for source in old if source not in new]
+    changed = [source for source in new if source in old and new[source] != old[source]]
+    return added, removed, changed
+
+
+def restart_only_changes(old, new):
+    """Top level sections that changed but are only read at startup"""
+
+    keys = (set(old) | set(new)) - set(RELOADABLE_SECTIONS)
+    return sorted(key for key in keys if old.get(key) != new.get(key))
+
+
+class SegmentPool:
+    """Shared memory of retired sources kept for the next source that needs a segment of the same size.
+
+    A SharedMemoryManager only releases its segments at shutdown, so without the pool every
+    re-created source would leak its rings until the app exits.
+    """
+
+    def __init__(self, smm):
+        self.smm = smm
+        self.free = defaultdict(list)
+        self.reused = 0
+        self.allocated = 0
+
+    def __repr__(self):
+        return f"SegmentPool({sum(len(segments) for segments in self.free.values())} free, {self.reused} reused, {self.allocated} allocated)"
+
+    def take(self, size):
+        if self.free[size]:
+            self.reused += 1
+            return self.free[size].pop()
+        self.allocated += 1
+        return self.smm.SharedMemory(size=size)
+
+    def give(self, segment, size):
+        """size is what the segment was taken with, the OS may have rounded segment.size up"""
+
+        self.free[size].append(segment)
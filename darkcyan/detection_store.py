@@ -0,0 +1,375 @@
+"""Append-only columnar store of detection events.
+
+    python -m darkcyan.detection_store ~/developer/darkcyan_data/detections --source front --cls person --start "2024-05-01 02:00" --end "2024-05-01 03:00"
+
+The store is a directory of segments, each a directory of memory-mapped .npy columns (timestamp,
+source, cls, conf, x1, y1, x2, y2, frame_id, zones, track_id) preallocated to the segment capacity, plus a row count
+and a time index.  The time index keeps the min and max timestamp of every block_rows rows, so a
+query only touches the blocks that can hold matching rows, whatever the size of the store.  Source
+and class names are stored once in catalog.json and as small integer ids in the columns.
+"""
+
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+COLUMNS = {
+    "timestamp": np.float64,
+    "source": np.uint16,
+    "cls": np.uint16,
+    "conf": np.float32,
+    "x1": np.int32,
+    "y1": np.int32,
+    "x2": np.int32,
+    "y2": np.int32,
+    "frame_id": np.uint64,
+    "zones": np.uint32,
+    "track_id": np.uint32,
+}
+
+RESULT_DTYPE = np.dtype([(name, dtype) for name, dtype in COLUMNS.items()])
+
+SEGMENT_CAPACITY = 1 << 20
+BLOCK_ROWS = 4096
+SEGMENT_SPAN_S = 24 * 60 * 60
+
+
+class Segment:
+    """Up to capacity rows, filled in place, readers see rows up to the stored count"""
+
+    def __init__(self, path, writable=False):
+        self.path = Path(path)
+        mode = "r+" if writable else "r"
+        with open(self.path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.start = meta["start"]
+        self.capacity = meta["capacity"]
+        self.block_rows = meta["block_rows"]
+        self.columns = {
+            name: np.load(self.path / f"{name}.npy", mmap_mode=mode) for name in COLUMNS
+        }
+        self.count_column = np.load(self.path / "count.npy", mmap_mode=mode)
+        self.block_min = np.load(self.path / "block_min.npy", mmap_mode=mode)
+        self.block_max = np.load(self.path / "block_max.npy", mmap_mode=mode)
+
+    def __repr__(self):
+        return f"Segment({self.path.name}, {self.count}/{self.capacity} rows)"
+
+    @staticmethod
+    def create(path, start, capacity=SEGMENT_CAPACITY, block_rows=BLOCK_ROWS):
+        path = Path(path)
+        os.makedirs(path)
+        for name, dtype in COLUMNS.items():
+            # the files are sparse until written
+            np.lib.format.open_memmap(
+                path / f"{name}.npy", mode="w+", dtype=dtype, shape=(capacity,)
+            ).flush()
+        blocks = -(-capacity // block_rows)
+        np.save(path / "count.npy", np.zeros(1, dtype=np.uint64))
+        np.save(path / "block_min.npy", np.full(blocks, np.inf))
+        np.save(path / "block_max.npy", np.full(blocks, -np.inf))
+        # meta.json last, a segment without it is an incomplete create and is ignored
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {"start": start, "capacity": capacity, "block_rows": block_rows}, f
+            )
+        return Segment(path, writable=True)
+
+    @property
+    def count(self):
+        return int(self.count_column[0])
+
+    @property
+    def free(self):
+        return self.capacity - self.count
+
+    def time_range(self):
+        used = -(-self.count // self.block_rows)
+        if not used:
+            return None
+        return float(self.block_min[:used].min()), float(self.block_max[:used].max())
+
+    def append(self, rows):
+        """rows is a RESULT_DTYPE array, returns how many fitted"""
+
+        start = self.count
+        n = min(len(rows), self.free)
+        if not n:
+            return 0
+        end = start + n
+        for name in COLUMNS:
+            self.columns[name][start:end] = rows[name][:n]
+
+        timestamps = rows["timestamp"][:n]
+        for block in range(start // self.block_rows, (end - 1) // self.block_rows + 1):
+            lo = max(block * self.block_rows, start) - start
+            hi = min((block + 1) * self.block_rows, end) - start
+            self.block_min[block] = min(self.block_min[block], timestamps[lo:hi].min())
+            self.block_max[block] = max(self.block_max[block], timestamps[lo:hi].max())
+
+        # rows become visible to readers once the count moves past them
+        self.count_column[0] = end
+        return n
+
+    def query(self, start, end, source=None, cls=None, min_conf=None, zone_bit=None):
+        count = self.count
+        used = -(-count // self.block_rows)
+        blocks = np.flatnonzero(
+            (self.block_max[:used] >= start) & (self.block_min[:used] <= end)
+        )
+        if not len(blocks):
+            return np.zeros(0, dtype=RESULT_DTYPE)
+
+        results = []
+        # consecutive matching blocks are read as one range
+        runs = np.split(blocks, np.flatnonzero(np.diff(blocks) != 1) + 1)
+        for run in runs:
+            lo = int(run[0]) * self.block_rows
+            hi = min((int(run[-1]) + 1) * self.block_rows, count)
+            timestamps = self.columns["timestamp"][lo:hi]
+            mask = (timestamps >= start) & (timestamps <= end)
+            if source is not None:
+                mask &= self.columns["source"][lo:hi] == source
+            if cls is not None:
+                mask &= self.columns["cls"][lo:hi] == cls
+            if min_conf is not None:
+                mask &= self.columns["conf"][lo:hi] >= min_conf
+            if zone_bit is not None:
+                mask &= (self.columns["zones"][lo:hi] & np.uint32(1 << zone_bit)) != 0
+            index = np.flatnonzero(mask) + lo
+            if not len(index):
+                continue
+            rows = np.empty(len(index), dtype=RESULT_DTYPE)
+            for name in COLUMNS:
+                rows[name] = self.columns[name][index]
+            results.append(rows)
+        if not results:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+        return np.concatenate(results)
+
+    def flush(self):
+        for column in (
+            *self.columns.values(),
+            self.count_column,
+            self.block_min,
+            self.block_max,
+        ):
+            if isinstance(column, np.memmap) and column.mode != "r":
+                column.flush()
+
+
+class DetectionStore:
+    """A directory of segments plus the source / class name catalog.
+
+    One writer (the app) appends, a new segment is started when the current one is full or spans
+    more than segment_span_s.  Any number of readers can open the same directory and query.
+    """
+
+    def __init__(
+        self,
+        path,
+        writable=False,
+        segment_capacity=SEGMENT_CAPACITY,
+        block_rows=BLOCK_ROWS,
+        segment_span_s=SEGMENT_SPAN_S,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.writable = writable
+        self.segment_capacity = segment_capacity
+        self.block_rows = block_rows
+        self.segment_span_s = segment_span_s
+        if writable:
+            os.makedirs(self.path, exist_ok=True)
+
+        # zones: per source the zone names its zones column bits stand for
+        self.catalog = {"sources": [], "classes": [], "zones": {}}
+        if (self.path / "catalog.json").exists():
+            with open(self.path / "catalog.json", "r", encoding="utf-8") as f:
+                self.catalog = {"zones": {}, **json.load(f)}
+        self.source_ids = {name: i for i, name in enumerate(self.catalog["sources"])}
+        self.class_ids = {name: i for i, name in enumerate(self.catalog["classes"])}
+
+        self.segment_paths = sorted(
+            p for p in self.path.glob("segment-*") if (p / "meta.json").exists()
+        )
+        self.current = (
+            Segment(self.segment_paths[-1], writable=True)
+            if writable and self.segment_paths
+            else None
+        )
+        # read-only segments already opened by query()
+        self.segments = {}
+
+    def __repr__(self):
+        return f"DetectionStore({self.path}, {len(self.segment_paths)} segments)"
+
+    def _save_catalog(self):
+        tmp_path = self.path / "catalog.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.catalog, f, indent=4)
+        os.replace(tmp_path, self.path / "catalog.json")
+
+    def _id(self, ids, kind, name):
+        if name not in ids:
+            ids[name] = len(self.catalog[kind])
+            self.catalog[kind].append(name)
+            self._save_catalog()
+        return ids[name]
+
+    def _segment_for(self, timestamp):
+        current = self.current
+        if (
+            current is None
+            or not current.free
+            or timestamp - current.start >= self.segment_span_s
+        ):
+            if current is not None:
+                current.flush()
+            path = (
+                self.path
+                / f"segment-{datetime.fromtimestamp(timestamp).strftime('%Y%m%d-%H%M%S')}-{len(self.segment_paths):06d}"
+            )
+            self.current = Segment.create(
+                path, timestamp, self.segment_capacity, self.block_rows
+            )
+            self.segment_paths.append(path)
+        return self.current
+
+    def append(self, source_name, events, class_names, zone_names=None):
+        """events is an EventRing batch, class_names the model's names its cls ids index, zone_names the source's zones"""
+
+        if not len(events):
+            return
+        source = self._id(self.source_ids, "sources", source_name)
+        if zone_names and self.catalog["zones"].get(source_name) != list(zone_names):
+            if self.catalog["zones"].get(source_name):
+                self.logger.info(
+                    f"Zones of {source_name} changed to {zone_names}, zone bits recorded earlier keep their old meaning"
+                )
+            self.catalog["zones"][source_name] = list(zone_names)
+            self._save_catalog()
+        class_map = np.array(
+            [self._id(self.class_ids, "classes", name) for name in class_names] or [0],
+            dtype=np.uint16,
+        )
+
+        rows = np.empty(len(events), dtype=RESULT_DTYPE)
+        rows["source"] = source
+        rows["cls"] = class_map[np.clip(events["cls"], 0, len(class_map) - 1)]
+        for name in (
+            "timestamp",
+            "conf",
+            "x1",
+            "y1",
+            "x2",
+            "y2",
+            "frame_id",
+            "zones",
+            "track_id",
+        ):
+            rows[name] = events[name]
+
+        while len(rows):
+            written = self._segment_for(float(rows["timestamp"][0])).append(rows)
+            rows = rows[written:]
+
+    def query(self, start, end, source=None, cls=None, min_conf=None, zone=None):
+        """Rows with start <= timestamp <= end, source, cls and zone by name (a zone needs its source)"""
+
+        source_id = self.source_ids.get(source, -1) if source is not None else None
+        class_id = self.class_ids.get(cls, -1) if cls is not None else None
+        zone_bit = None
+        if zone is not None:
+            source_zones = self.catalog["zones"].get(source, [])
+            zone_bit = source_zones.index(zone) if zone in source_zones else -1
+        if source_id == -1 or class_id == -1 or zone_bit == -1:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+
+        if not self.writable:
+            # the writer may have started segments since we opened
+            self.segment_paths = sorted(
+                p for p in self.path.glob("segment-*") if (p / "meta.json").exists()
+            )
+
+        results = []
+        for path in self.segment_paths:
+            segment = self._segment(path)
+            time_range = segment.time_range()
+            if time_range is None or time_range[1] < start or time_range[0] > end:
+                continue
+            rows = segment.query(start, end, source_id, class_id, min_conf, zone_bit)
+            if len(rows):
+                results.append(rows)
+        if not results:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+        rows = np.concatenate(results)
+        return rows[np.argsort(rows["timestamp"], kind="stable")]
+
+    def _segment(self, path):
+        if self.current is not None and path == self.current.path:
+            return self.current
+        if path not in self.segments:
+            self.segments[path] = Segment(path)
+        return self.segments[path]
+
+    def source_name(self, source_id):
+        return self.catalog["sources"][source_id]
+
+    def class_name(self, class_id):
+        return self.catalog["classes"][class_id]
+
+    def flush(self):
+        if self.current is not None:
+            self.current.flush()
+
+    def close(self):
+        self.flush()
+        self.current = None
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the DarkCyan detection store")
+    parser.add_argument("store", help="Detection store directory")
+    parser.add_argument(
+        "--start", required=True, help="ISO date/time or unix timestamp"
+    )
+    parser.add_argument("--end", required=True, help="ISO date/time or unix timestamp")
+    parser.add_argument("--source", help="Source name, e.g. front")
+    parser.add_argument("--cls", help="Class name, e.g. person")
+    parser.add_argument("--min-conf", type=float, help="Minimum confidence")
+    parser.add_argument("--zone", help="Zone name, needs --source")
+    args = parser.parse_args()
+
+    store = DetectionStore(args.store)
+    rows = store.query(
+        parse_time(args.start),
+        parse_time(args.end),
+        args.source,
+        args.cls,
+        args.min_conf,
+        args.zone,
+    )
+    for row in rows:
+        print(
+            f"{datetime.fromtimestamp(row['timestamp']).isoformat(timespec='milliseconds')} {store.source_name(row['source'])} "
+            f"{store.class_name(row['cls'])} {row['conf']:.2f} [{row['x1']}, {row['y1']}, {row['x2']}, {row['y2']}]"
+            + (f" track {row['track_id']}" if row["track_id"] else "")
+        )
+    print(f"{len(rows)} detections")
+
+
+if __name__ == "__main__":
+    main()
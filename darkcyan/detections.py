@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+from darkcyan.preprocess import unletterbox_boxes
+
+# Compact per-frame detection record, boxes are in original frame pixels
+DETECTION_DTYPE = np.dtype(
+    [
+        ("x1", np.int32),
+        ("y1", np.int32),
+        ("x2", np.int32),
+        ("y2", np.int32),
+        ("conf", np.float32),
+        ("cls", np.int32),
+    ]
+)
+
+EMPTY_DETECTIONS = np.zeros(0, dtype=DETECTION_DTYPE)
+
+
+def class_name_lookup(names, size=None):
+    """Build an array indexed by class id, so a whole frame's categories are one fancy index."""
+
+    if not names:
+        names = {}
+    elif not isinstance(names, dict):
+        names = dict(enumerate(names))
+    if size is None:
+        size = max(names.keys(), default=-1) + 1
+    lookup = np.array([f"class{i}" for i in range(size)], dtype=object)
+    for cls_int, name in names.items():
+        if cls_int < size:
+            lookup[cls_int] = name
+    return lookup
+
+
+def detections_from_result(result, letterbox=None):
+    """Project every box of an ultralytics result in one operation and return a DETECTION_DTYPE array.
+
+    letterbox is the LetterboxMeta the model input was produced with, None leaves boxes in model pixels.
+    """
+
+    boxes = result.boxes
+    if boxes is None or not boxes.data.nelement():
+        return EMPTY_DETECTIONS
+
+    # One device -> host transfer for xyxy, conf and cls together
+    data = boxes.data.cpu().numpy()
+    return detections_from_array(data[:, :4], data[:, 4], data[:, 5], letterbox)
+
+
+def detections_from_array(xyxy, conf, cls, letterbox=None):
+    detections = np.empty(len(xyxy), dtype=DETECTION_DTYPE)
+    if letterbox is not None:
+        xyxy = unletterbox_boxes(xyxy, letterbox)
+    scaled = xyxy.astype(np.int32)
+    detections["x1"] = scaled[:, 0]
+    detections["y1"] = scaled[:, 1]
+    detections["x2"] = scaled[:, 2]
+    detections["y2"] = scaled[:, 3]
+    detections["conf"] = conf
+    detections["cls"] = cls
+    return detections
+
+
+def concat_detections(detection_arrays):
+    detection_arrays = list(detection_arrays)
+    if not detection_arrays:
+        return EMPTY_DETECTIONS
+    if len(detection_arrays) == 1:
+        return detection_arrays[0]
+    return np.concatenate(detection_arrays)
+
+
+def boxes(detections):
+    """(N, 4) int32 array of the xyxy columns."""
+    return np.stack(
+        [detections["x1"], detections["y1"], detections["x2"], detections["y2"]], axis=1
+    )
+
+
+def categories(detections, name_lookup):
+    cls = detections["cls"]
+    if len(cls) and cls.max() >= len(name_lookup):
+        return [
+            name_lookup[c] if c < len(name_lookup) else f"class{c}"
+            for c in cls.tolist()
+        ]
+    return name_lookup[cls].tolist()
+
+
+def draw_detections(frame, detections, colour=(0, 255, 0), thickness=1):
+    # cv2 has no batched rectangle call, but .tolist() hands it plain ints without per-box tensor work
+    for x1, y1, x2, y2 in boxes(detections).tolist():
+        cv2.rectangle(frame, (x1, y1), (x2, y2), colour, thickness)
+    return frame
@@ -0,0 +1,184 @@
+import logging
+import logging.handlers
+import time
+import traceback
+from sys import platform
+from threading import Thread
+
+import cv2
+import numpy as np
+
+from darkcyan.frame_ring import FrameRing
+from darkcyan.preprocess import LetterboxResizer
+
+# GStreamer encode + RTP payload stages, appsrc/videoconvert in front and udpsink behind are common to all
+ENCODERS = {
+    # macOS hardware encoder, what app.py always used
+    "vtenc_h265": "vtenc_h265 realtime=true bitrate={bitrate_kbps} ! h265parse ! rtph265pay config-interval=1 pt=96 ! application/x-rtp,media=video,encoding-name=H265",
+    # software encoders for the Linux hosts, tuned so a frame leaves the encoder as soon as it is in
+    "x264": "x264enc tune=zerolatency speed-preset=ultrafast bitrate={bitrate_kbps} key-int-max={gop} ! video/x-h264,profile=baseline ! h264parse ! rtph264pay config-interval=1 pt=96 ! application/x-rtp,media=video,encoding-name=H264",
+    "x265": "x265enc tune=zerolatency speed-preset=ultrafast bitrate={bitrate_kbps} key-int-max={gop} ! h265parse ! rtph265pay config-interval=1 pt=96 ! application/x-rtp,media=video,encoding-name=H265",
+}
+
+DEFAULT_OUTPUT_PORT = 5400
+
+
+def default_encoder():
+    return "vtenc_h265" if platform == "darwin" else "x264"
+
+
+def encoder_pipeline(encoder, host, port, fps, bitrate_kbps=2048):
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown encoder {encoder}, expected one of {list(ENCODERS)}")
+    encode = ENCODERS[encoder].format(
+        bitrate_kbps=bitrate_kbps, gop=max(int(round(fps)), 1)
+    )
+    return f"appsrc is-live=true do-timestamp=true ! queue ! videoconvert ! queue ! {encode} ! queue ! udpsink host={host} port={port} sync=false"
+
+
+class OutputConfig:
+    """One RTP output of one source's annotated frames"""
+
+    def __init__(
+        self,
+        source_key,
+        infer_shared_memory,
+        host="127.0.0.1",
+        port=DEFAULT_OUTPUT_PORT,
+        fps=25,
+        size=(800, 600),
+        encoder=None,
+        bitrate_kbps=2048,
+    ) -> None:
+        self.source_key = source_key
+        self.infer_shared_memory = infer_shared_memory
+        self.host = host
+        self.port = port
+        self.fps = fps
+        # (width, height) as cv2 has it
+        self.size = tuple(size)
+        self.encoder = encoder or default_encoder()
+        self.bitrate_kbps = bitrate_kbps
+
+    def __repr__(self):
+        return f"OutputConfig({self.source_key} -> {self.encoder} {self.size[0]}x{self.size[1]}@{self.fps} rtp://{self.host}:{self.port})"
+
+
+class OutputStream:
+    """Paces one source's frame ring out to its encoder at a fixed fps.
+
+    Every tick the latest published frame is sent.  Frames published between ticks are dropped and a
+    tick with nothing new repeats the previous frame, so the stream keeps a steady rate whatever the
+    inference rate is.  Frames of another aspect than the output are letterboxed into it with black
+    bars, the encoder caps are fixed when the pipeline opens.
+    """
+
+    def __init__(self, output, keep_running, stats_interval_s=60):
+        self.logger = logging.getLogger(__name__)
+        self.output = output
+        self.keep_running = keep_running
+        self.stats_interval_s = stats_interval_s
+        self.frame_ring = FrameRing(output.infer_shared_memory)
+        self.frame = np.zeros((output.size[1], output.size[0], 3), dtype=np.uint8)
+        # one buffer is enough, the writer has encoded (or copied) a frame before the next tick
+        self.resizer = LetterboxResizer(
+            (output.size[1], output.size[0]), pool_size=1, pad_value=0
+        )
+        self.last_frame_id = 0
+        self.writer = None
+        self.stopped = False
+
+        self.sent = 0
+        self.duplicated = 0
+        self.dropped = 0
+
+    def open(self):
+        pipeline = encoder_pipeline(
+            self.output.encoder,
+            self.output.host,
+            self.output.port,
+            self.output.fps,
+            self.output.bitrate_kbps,
+        )
+        self.writer = cv2.VideoWriter(
+            pipeline,
+            0,
+            apiPreference=cv2.CAP_GSTREAMER,
+            fps=self.output.fps,
+            frameSize=self.output.size,
+            isColor=True,
+        )
+        if not self.writer.isOpened():
+            self.logger.error(f"Unable to open {self.output}: {pipeline}")
+            return False
+        self.logger.info(f"Streaming {self.output}")
+        return True
+
+    def tick(self):
+        latest = self.frame_ring.read_latest(self.last_frame_id)
+        if latest is not None:
+            if self.last_frame_id:
+                self.dropped += max(latest.frame_id - self.last_frame_id - 1, 0)
+            self.last_frame_id = latest.frame_id
+            if latest.frame.shape[:2] == self.frame.shape[:2]:
+                self.frame[:] = latest.frame
+            else:
+                self.frame[:] = self.resizer(latest.frame)[0]
+        elif self.last_frame_id:
+            self.duplicated += 1
+        else:
+            # nothing published yet
+            return
+        self.writer.write(self.frame)
+        self.sent += 1
+
+    def stream(self):
+        if not self.open():
+            self.stopped = True
+            return
+        period = 1.0 / self.output.fps
+        next_tick = time.time()
+        next_stats = next_tick + self.stats_interval_s
+        try:
+            while self.keep_running.value and not self.stopped:
+                self.tick()
+                next_tick += period
+                now = time.time()
+                if next_tick < now - period:
+                    # an encode stalled for more than a frame, skip the missed ticks rather than bursting to catch up
+                    next_tick = now
+                elif next_tick > now:
+                    time.sleep(next_tick - now)
+                if now >= next_stats:
+                    self.logger.info(
+                        f"{self.output.source_key} output: {self.sent} frames sent, {self.duplicated} repeated, {self.dropped} dropped"
+                    )
+                    next_stats = now + self.stats_interval_s
+        except:
+            traceback.print_exc()
+        self.writer.release()
+        self.stopped = True
+
+    def start(self):
+        t = Thread(target=self.stream, args=())
+        t.daemon = True
+        t.start()
+        return self
+
+
+def run(logging_queue, outputs, keep_running):
+    """Encoder process, one pacing thread per output so a slow encode only delays its own stream"""
+
+    qh = logging.handlers.QueueHandler(logging_queue)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(qh)
+
+    streams = [OutputStream(output, keep_running).start() for output in outputs]
+    try:
+        while keep_running.value and not all(stream.stopped for stream in streams):
+            time.sleep(1)
+    except:
+        traceback.print_exc()
+    keep_running.value = False
+    time.sleep(1)
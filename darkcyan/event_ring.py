@@ -0,0 +1,167 @@
+import time
+
+import numpy as np
+
+# Detection events of one source, single producer (the worker publishing its detections) and single
+# consumer (the app).  Layout:
+#
+#   [ header ][ record 0 ][ record 1 ] ... [ record capacity - 1 ]
+#
+# write_index and read_index only ever grow, a record lives at index % capacity.  The producer fills
+# records and then advances write_index, the consumer copies records and then advances read_index,
+# so neither ever waits for the other.  When the consumer falls a whole ring behind new events are
+# not written and counted in overflow instead, events already in the ring are never overwritten.
+
+EVENT_RING_MAGIC = 0x44434552  # "DCER"
+
+EVENT_RING_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", np.uint32),
+        ("capacity", np.uint32),
+        ("write_index", np.uint64),
+        ("read_index", np.uint64),
+        ("overflow", np.uint64),
+    ],
+    align=True,
+)
+
+EVENT_DTYPE = np.dtype(
+    [
+        ("source", np.uint16),
+        ("frame_id", np.uint64),
+        ("timestamp", np.float64),
+        ("x1", np.int32),
+        ("y1", np.int32),
+        ("x2", np.int32),
+        ("y2", np.int32),
+        ("conf", np.float32),
+        ("cls", np.int32),
+        # bit i set when the detection is in the source's i'th zone, see darkcyan.zones
+        ("zones", np.uint32),
+        # persistent object id from darkcyan.tracker, 0 when the source is not tracked
+        ("track_id", np.uint32),
+    ],
+    align=True,
+)
+
+EMPTY_EVENTS = np.zeros(0, dtype=EVENT_DTYPE)
+
+
+class EventRing:
+    """Fixed size detection records in shared memory, published and read in batches without pickling"""
+
+    def __init__(self, shared_memory, capacity=None):
+        self.shared_memory = shared_memory
+        self.header = np.ndarray(
+            (), dtype=EVENT_RING_HEADER_DTYPE, buffer=shared_memory.buf
+        )
+
+        if capacity is not None:
+            if EventRing.required_size(capacity) > shared_memory.size:
+                raise ValueError(
+                    f"Shared memory of {shared_memory.size} bytes is too small for {capacity} events"
+                )
+            self.header["capacity"] = capacity
+            self.header["write_index"] = 0
+            self.header["read_index"] = 0
+            self.header["overflow"] = 0
+            self.header["magic"] = EVENT_RING_MAGIC
+        elif self.header["magic"] != EVENT_RING_MAGIC:
+            raise ValueError("Shared memory does not contain an initialised event ring")
+
+        self.capacity = int(self.header["capacity"])
+        self.records = np.ndarray(
+            (self.capacity,),
+            dtype=EVENT_DTYPE,
+            buffer=shared_memory.buf,
+            offset=EVENT_RING_HEADER_DTYPE.itemsize,
+        )
+
+    def __repr__(self):
+        return f"EventRing({self.capacity} events, {self.pending} pending, {self.overflow} overflowed)"
+
+    @staticmethod
+    def required_size(capacity):
+        return EVENT_RING_HEADER_DTYPE.itemsize + capacity * EVENT_DTYPE.itemsize
+
+    @staticmethod
+    def create(shared_memory, capacity):
+        return EventRing(shared_memory, capacity)
+
+    @property
+    def pending(self):
+        return int(self.header["write_index"]) - int(self.header["read_index"])
+
+    @property
+    def overflow(self):
+        return int(self.header["overflow"])
+
+    def _copy_in(self, start, events):
+        first = start % self.capacity
+        n = min(len(events), self.capacity - first)
+        self.records[first : first + n] = events[:n]
+        if n < len(events):
+            self.records[: len(events) - n] = events[n:]
+
+    def publish(self, source, frame_id, detections, timestamp=None, zones=None):
+        """Producer side, one record per detection (a DETECTION_DTYPE or TRACK_DTYPE array) with its zone bits.  Returns how many were written"""
+
+        if not len(detections):
+            return 0
+        write_index = int(self.header["write_index"])
+        free = self.capacity - (write_index - int(self.header["read_index"]))
+        if free < len(detections):
+            self.header["overflow"] += len(detections) - free
+            detections = detections[:free]
+            if zones is not None:
+                zones = zones[:free]
+            if not len(detections):
+                return 0
+
+        events = np.empty(len(detections), dtype=EVENT_DTYPE)
+        events["source"] = source
+        events["frame_id"] = frame_id
+        events["timestamp"] = time.time() if timestamp is None else timestamp
+        for field in ("x1", "y1", "x2", "y2", "conf", "cls"):
+            events[field] = detections[field]
+        events["zones"] = 0 if zones is None else zones
+        events["track_id"] = (
+            detections["track_id"] if "track_id" in detections.dtype.names else 0
+        )
+        self._copy_in(write_index, events)
+        # publish only once the records are complete
+        self.header["write_index"] = write_index + len(events)
+        return len(events)
+
+    def read(self, max_events=None):
+        """Consumer side, copies out and releases up to max_events (all pending by default) in publish order"""
+
+        read_index = int(self.header["read_index"])
+        count = int(self.header["write_index"]) - read_index
+        if max_events is not None:
+            count = min(count, max_events)
+        if count <= 0:
+            return EMPTY_EVENTS
+        first = read_index % self.capacity
+        n = min(count, self.capacity - first)
+        if n == count:
+            events = self.records[first : first + n].copy()
+        else:
+            events = np.concatenate([self.records[first:], self.records[: count - n]])
+        self.header["read_index"] = read_index + count
+        return events
+
+
+def events_by_frame(events):
+    """Splits a read() batch into (source, frame_id, events) groups, one per published frame"""
+
+    if not len(events):
+        return []
+    keys = np.stack(
+        [events["source"].astype(np.int64), events["frame_id"].astype(np.int64)], axis=1
+    )
+    boundaries = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+    return [
+        (int(group["source"][0]), int(group["frame_id"][0]), group)
+        for group in np.split(events, boundaries)
+    ]
@@ -0,0 +1,195 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Layout of the shared memory segment:
+#
+#   [ ring header ][ slot header 0 ][ slot header 1 ] ... [ slot data 0 ][ slot data 1 ] ...
+#
+# Each slot is protected by a sequence lock.  The writer bumps the slot sequence to an
+# odd value before touching the slot and back to an even value once the frame and its
+# header are complete.  Readers copy the slot out and only accept it if the sequence
+# was even and unchanged across the copy, so they never see a half written frame and
+# the writer never has to wait for a reader.
+
+RING_MAGIC = 0x44435246  # "DCRF"
+MAX_DIMS = 3
+MAX_DTYPE_LEN = 8
+META_LEN = 8
+
+RING_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", np.uint32),
+        ("slot_count", np.uint32),
+        ("slot_bytes", np.uint64),
+        ("latest_frame_id", np.uint64),
+    ],
+    align=True,
+)
+
+SLOT_HEADER_DTYPE = np.dtype(
+    [
+        ("seq", np.uint64),
+        ("frame_id", np.uint64),
+        ("timestamp", np.float64),
+        ("nbytes", np.uint64),
+        ("shape", np.uint32, MAX_DIMS),
+        ("ndim", np.uint32),
+        ("dtype", f"S{MAX_DTYPE_LEN}"),
+        # free for the writer to describe the frame, e.g. resize ratios back to the capture frame
+        ("meta", np.float64, META_LEN),
+    ],
+    align=True,
+)
+
+RingFrame = namedtuple("RingFrame", ["frame", "frame_id", "timestamp", "meta"])
+
+
+class FrameRing:
+    """N-slot frame ring in shared memory.
+
+    Single writer, any number of readers.  ``write`` never blocks; ``read_latest``
+    returns a consistent copy of the most recently completed frame.
+    """
+
+    def __init__(self, shared_memory, slot_count=None, slot_bytes=None):
+        self.shared_memory = shared_memory
+        buf = shared_memory.buf
+
+        self.header = np.ndarray((), dtype=RING_HEADER_DTYPE, buffer=buf, offset=0)
+
+        if slot_count is not None:
+            # Creating side, lay out the ring
+            if FrameRing.required_size(slot_count, slot_bytes) > shared_memory.size:
+                raise ValueError(
+                    f"Shared memory of {shared_memory.size} bytes is too small for {slot_count} slots of {slot_bytes} bytes"
+                )
+            self.header["slot_count"] = slot_count
+            self.header["slot_bytes"] = slot_bytes
+            self.header["latest_frame_id"] = 0
+            self.header["magic"] = RING_MAGIC
+        elif self.header["magic"] != RING_MAGIC:
+            raise ValueError("Shared memory does not contain an initialised frame ring")
+
+        self.slot_count = int(self.header["slot_count"])
+        self.slot_bytes = int(self.header["slot_bytes"])
+
+        self.slots = np.ndarray(
+            (self.slot_count,),
+            dtype=SLOT_HEADER_DTYPE,
+            buffer=buf,
+            offset=RING_HEADER_DTYPE.itemsize,
+        )
+        if slot_count is not None:
+            self.slots[:] = np.zeros((), dtype=SLOT_HEADER_DTYPE)
+
+        data_offset = FrameRing._data_offset(self.slot_count)
+        self.data = np.ndarray(
+            (self.slot_count, self.slot_bytes),
+            dtype=np.uint8,
+            buffer=buf,
+            offset=data_offset,
+        )
+
+    @staticmethod
+    def _data_offset(slot_count):
+        offset = RING_HEADER_DTYPE.itemsize + slot_count * SLOT_HEADER_DTYPE.itemsize
+        # keep the frame data 64 byte aligned
+        return (offset + 63) & ~63
+
+    @staticmethod
+    def required_size(slot_count, slot_bytes):
+        return FrameRing._data_offset(slot_count) + slot_count * slot_bytes
+
+    @staticmethod
+    def create(shared_memory, slot_count, slot_bytes):
+        return FrameRing(shared_memory, slot_count=slot_count, slot_bytes=slot_bytes)
+
+    def __repr__(self):
+        return f"FrameRing({self.slot_count} slots x {self.slot_bytes} bytes, latest {self.latest_frame_id})"
+
+    @property
+    def latest_frame_id(self):
+        return int(self.header["latest_frame_id"])
+
+    def write(self, frame, timestamp=None, meta=None):
+        """Publish a frame into the next slot.  Returns the new frame id, or None if the frame does not fit."""
+
+        if frame.nbytes > self.slot_bytes or frame.ndim > MAX_DIMS:
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+
+        frame_id = self.latest_frame_id + 1
+        index = frame_id % self.slot_count
+        slot = self.slots[index]
+
+        slot["seq"] += 1  # odd, write in progress
+        slot["frame_id"] = frame_id
+        slot["timestamp"] = timestamp
+        slot["nbytes"] = frame.nbytes
+        slot["ndim"] = frame.ndim
+        slot["shape"][: frame.ndim] = frame.shape
+        slot["dtype"] = frame.dtype.str.encode("ascii")
+        slot["meta"][:] = 0
+        if meta is not None:
+            slot["meta"][: len(meta)] = meta
+        dst = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.data[index])
+        np.copyto(dst, frame, casting="no")
+        slot["seq"] += 1  # even, slot is consistent again
+
+        self.header["latest_frame_id"] = frame_id
+        return frame_id
+
+    def read(self, frame_id, out=None):
+        """Copy out a specific frame.  Returns a RingFrame, or None if it was overwritten or is being written."""
+
+        if frame_id <= 0:
+            return None
+        index = frame_id % self.slot_count
+        slot = self.slots[index]
+
+        seq_before = int(slot["seq"])
+        if seq_before & 1 or int(slot["frame_id"]) != frame_id:
+            return None
+
+        # a header torn by a concurrent write can hold any shape or dtype, treat one that
+        # doesn't decode or doesn't fit the slot as a torn read rather than raising
+        try:
+            ndim = int(slot["ndim"])
+            if ndim > MAX_DIMS:
+                return None
+            shape = tuple(int(s) for s in slot["shape"][:ndim])
+            dtype = np.dtype(slot["dtype"].decode("ascii"))
+            if int(np.prod(shape, dtype=np.uint64)) * dtype.itemsize > self.slot_bytes:
+                return None
+            timestamp = float(slot["timestamp"])
+            meta = slot["meta"].copy()
+            src = np.ndarray(shape, dtype=dtype, buffer=self.data[index])
+        except (TypeError, ValueError, UnicodeDecodeError):
+            return None
+
+        if out is None or out.shape != shape or out.dtype != dtype:
+            out = np.empty(shape, dtype=dtype)
+        np.copyto(out, src)
+
+        if int(slot["seq"]) != seq_before:
+            # the writer lapped us while we were copying
+            return None
+        return RingFrame(out, frame_id, timestamp, meta)
+
+    def read_latest(self, last_frame_id=0, out=None, retries=3):
+        """Copy out the newest frame.
+
+        Returns a RingFrame, or None if there is nothing newer than last_frame_id.
+        """
+
+        for _ in range(retries):
+            frame_id = self.latest_frame_id
+            if frame_id <= last_frame_id:
+                return None
+            result = self.read(frame_id, out=out)
+            if result is not None:
+                return result
+        return None
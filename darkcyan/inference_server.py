@@ -0,0 +1,391 @@
+import logging
+import logging.handlers
+import time
+import traceback
+from pathlib import Path
+from queue import Empty
+
+from darkcyan.detections import (
+    EMPTY_DETECTIONS,
+    class_name_lookup,
+    detections_from_array,
+    draw_detections,
+)
+from darkcyan.event_ring import EventRing
+from darkcyan.frame_ring import FrameRing
+from darkcyan.latency import LatencyHistograms
+from darkcyan.notify import create_notifier
+from darkcyan.preprocess import LetterboxMeta
+from darkcyan.stage_timing import StageRecorder, StageTimer
+from darkcyan.status_block import STATE_RESTARTING, STATE_STOPPED, StatusBlock
+from darkcyan.tracker import Tracker
+from darkcyan.warmup_passes import DEFAULT_WARMUP_PASSES_DIR, WarmupPasses
+from darkcyan.yolo_proc import (
+    DEFAULT_MODEL_IMGSZ,
+    DEFAULT_MODEL_PATH,
+    inference_device,
+    load_model,
+)
+from darkcyan.zones import ZoneEngine
+from darkcyan_utils.FPS import FPS
+
+
+class InferenceSource:
+    """Channels for one camera served by the inference server."""
+
+    def __init__(
+        self,
+        source_key,
+        source_name,
+        input_shared_memory,
+        capture_shared_memory,
+        infer_shared_memory,
+        status_shared_memory,
+        event_shared_memory=None,
+        latency_shared_memory=None,
+        notify_connection=None,
+        source_id=0,
+        zone_config=None,
+        tracker_config=None,
+    ):
+        self.source_key = source_key
+        self.source_name = source_name
+        self.input_ring = FrameRing(input_shared_memory)
+        # the capture frames the letterboxed inputs were made from, annotated and published once detected
+        self.capture_ring = FrameRing(capture_shared_memory)
+        self.capture_buffer = None
+        self.output_ring = FrameRing(infer_shared_memory)
+        self.status_block = StatusBlock(status_shared_memory)
+        self.last_frame_id = 0
+        self.fps = FPS()
+        # time-to-first-detection is measured from when the server took the source on, or its capture restarted
+        self.started_at = time.time()
+        self.first_detection_s = None
+        self.event_ring = (
+            EventRing(event_shared_memory) if event_shared_memory is not None else None
+        )
+        self.source_id = source_id
+        self.notifier = create_notifier(notify_connection)
+        self.zone_engine = ZoneEngine.from_config(zone_config)
+        # the server detects every frame it is given, detect_interval only applies to the per-source workers
+        self.tracker = Tracker.from_config(tracker_config)
+        # the tracker's second association pass needs the low confidence detections, as in the workers
+        self.conf = (
+            min(0.4, self.tracker.low_thresh) if self.tracker is not None else 0.4
+        )
+        # the capture process records read/resize into the same histograms, the server the stages after it
+        self.stage_recorder = (
+            LatencyHistograms(latency_shared_memory)
+            if latency_shared_memory is not None
+            else StageRecorder()
+        )
+
+    def __repr__(self):
+        return f"InferenceSource object: {self.source_name}"
+
+    def check_restart(self):
+        # marked restarting by the supervisor or the capture's own backoff, until the new capture
+        # marks itself initialising, so the clock starts over with the last poll before that
+        if self.status_block.state() == STATE_RESTARTING:
+            self.started_at = time.time()
+            if self.first_detection_s is not None:
+                self.first_detection_s = None
+                self.status_block.set_first_detection(0)
+
+
+class DarkCyanInferenceServer:
+    """One model per host, serving every capture process through dynamic batches.
+
+    Frames are collected from each source's input ring (latest frame only, at most one per source
+    per batch).  A batch is dispatched when it holds max_batch frames, or max_wait_ms after its first
+    frame arrived, whichever is sooner.  max_batch defaults to 8 for PyTorch models and 1 for exports,
+    which are usually built for a fixed batch of one.
+    """
+
+    def __init__(
+        self,
+        sources,
+        keep_running,
+        model_path=DEFAULT_MODEL_PATH,
+        imgsz=DEFAULT_MODEL_IMGSZ,
+        max_batch=None,
+        max_wait_ms=20,
+        poll_interval=0.001,
+        warmup_passes=None,
+        control_queue=None,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+
+        self.sources = sources
+        self.keep_running = keep_running
+        if max_batch is None:
+            max_batch = 8 if Path(model_path).suffix == ".pt" else 1
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.poll_interval = poll_interval
+        self.imgsz = imgsz
+        self.stopped = False
+        self._next_source = 0
+        # ("add", channels) / ("remove", source_key) from the app when the sources config is reloaded
+        self.control_queue = control_queue
+
+        self.device = inference_device(self.logger)
+        self.model = load_model(
+            self.logger, model_path, imgsz, self.device, warmup_passes
+        )
+        if self.model is None:
+            self.stopped = True
+        else:
+            self.class_names = class_name_lookup(self.model.names)
+            for source in self.sources:
+                source.status_block.set_class_names(self.model.names)
+
+    def add_source(self, source):
+        # a restarted server gets the current channels in its arguments and may replay adds it already has
+        self.remove_source(source.source_key)
+        source.status_block.set_class_names(self.model.names)
+        source.fps.start()
+        self.sources.append(source)
+        self.logger.info(f"Inference server now serving {source.source_name}")
+
+    def remove_source(self, source_key):
+        for source in self.sources:
+            if source.source_key == source_key:
+                self.sources.remove(source)
+                self.logger.info(
+                    f"Inference server stopped serving {source.source_name}"
+                )
+                return
+
+    def apply_control(self):
+        while True:
+            try:
+                command, payload = self.control_queue.get_nowait()
+            except Empty:
+                return
+            if command == "add":
+                self.add_source(InferenceSource(**payload))
+            elif command == "remove":
+                self.remove_source(payload)
+
+    def _poll_sources(self, batch, taken):
+        # Rotate the starting point so a full batch doesn't always favour the first sources
+        source_count = len(self.sources)
+        for i in range(source_count):
+            source = self.sources[(self._next_source + i) % source_count]
+            if source.source_key in taken:
+                continue
+            source.check_restart()
+            ring_frame = source.input_ring.read_latest(source.last_frame_id)
+            if ring_frame is None:
+                continue
+            source.last_frame_id = ring_frame.frame_id
+            # copied out now, while the capture ring still holds it, the server annotates and publishes it after predict
+            capture_frame = source.capture_ring.read(
+                int(ring_frame.meta[len(LetterboxMeta._fields)]),
+                out=source.capture_buffer,
+            )
+            if capture_frame is not None:
+                source.capture_buffer = capture_frame.frame
+            # capture to pickup, the server's equivalent of the capture queue
+            source.stage_recorder.record(
+                ring_frame.frame_id, "queue_wait", time.time() - ring_frame.timestamp
+            )
+            taken.add(source.source_key)
+            batch.append((source, ring_frame, capture_frame))
+            if len(batch) >= self.max_batch:
+                break
+        self._next_source = (self._next_source + 1) % max(source_count, 1)
+
+    def collect_batch(self):
+        batch = []
+        taken = set()
+        deadline = None
+        # an idle server still comes back regularly to pick up source changes
+        idle_deadline = time.time() + 0.1
+        while not self.stopped and self.keep_running.value:
+            self._poll_sources(batch, taken)
+            if len(batch) >= self.max_batch or (
+                batch and len(taken) == len(self.sources)
+            ):
+                break
+            if batch:
+                if deadline is None:
+                    deadline = time.time() + self.max_wait
+                elif time.time() >= deadline:
+                    break
+            elif time.time() >= idle_deadline:
+                break
+            time.sleep(self.poll_interval)
+        return batch
+
+    def _predict(self, frames, conf):
+        """One result per frame, falling back to frame by frame for good if the model won't batch"""
+
+        options = {
+            "imgsz": self.imgsz,
+            "device": self.device,
+            "conf": conf,
+            "iou": 0.45,
+            "verbose": False,
+        }
+        if len(frames) > 1:
+            try:
+                results = self.model.predict(source=frames, **options)
+                if len(results) == len(frames):
+                    return results
+                self.logger.error(
+                    f"Model returned {len(results)} results for a batch of {len(frames)}, predicting frame by frame from now on"
+                )
+            except Exception as e:
+                self.logger.error(
+                    f"Model failed on a batch of {len(frames)}, predicting frame by frame from now on: {e}"
+                )
+            self.max_batch = 1
+        return [self.model.predict(source=frame, **options)[0] for frame in frames]
+
+    def _route(self, source, ring_frame, capture_frame, result, predict_s):
+        source.stage_recorder.record(ring_frame.frame_id, "predict", predict_s)
+        timer = StageTimer(source.stage_recorder, ring_frame.frame_id)
+        letterbox = LetterboxMeta(*ring_frame.meta[: len(LetterboxMeta._fields)])
+        data = result.boxes.data.cpu().numpy() if result.boxes is not None else None
+
+        if data is not None and len(data):
+            # boxes in capture frame pixels, as the per-source workers report and draw them
+            detections = detections_from_array(
+                data[:, :4], data[:, 4], data[:, 5], letterbox
+            )
+            # the batch ran at the lowest conf of its sources, this source only keeps what it asked for
+            detections = detections[detections["conf"] >= source.conf]
+        else:
+            detections = EMPTY_DETECTIONS
+
+        events = detections
+        if source.tracker is not None:
+            source.tracker.predict(ring_frame.frame_id)
+            detections = source.tracker.update(detections)
+            # each object is published once, when its track is confirmed
+            events = source.tracker.new_tracks
+        timer.mark("postprocess")
+
+        if capture_frame is not None and len(detections):
+            draw_detections(capture_frame.frame, detections)
+            timer.mark("draw")
+
+        if source.first_detection_s is None:
+            source.first_detection_s = time.time() - source.started_at
+            source.status_block.set_first_detection(source.first_detection_s)
+            self.logger.info(
+                f"{source.source_name} time to first detection: {source.first_detection_s:.2f}s"
+            )
+
+        source.fps.update()
+        source.status_block.publish(
+            ring_frame.frame_id, detections["cls"], source.fps.fps(), predict_s * 1e3
+        )
+        if capture_frame is not None:
+            source.output_ring.write(capture_frame.frame, ring_frame.timestamp)
+            timer.mark("shm_write")
+        else:
+            # lapped by the capture process before the pickup, the detections still count
+            self.logger.debug(
+                f"{source.source_name} capture frame of input {ring_frame.frame_id} was overwritten, not published"
+            )
+        source.stage_recorder.record(
+            ring_frame.frame_id, "end_to_end", time.time() - ring_frame.timestamp
+        )
+
+        if source.event_ring is not None:
+            zones = (
+                source.zone_engine.classify(
+                    events, int(letterbox.orig_w), int(letterbox.orig_h)
+                )
+                if source.zone_engine is not None
+                else None
+            )
+            source.event_ring.publish(
+                source.source_id,
+                ring_frame.frame_id,
+                events,
+                ring_frame.timestamp,
+                zones,
+            )
+        source.notifier.notify()
+
+    def serve(self):
+        for source in self.sources:
+            source.fps.start()
+
+        batch_sizes = 0
+        batches = 0
+        while not self.stopped and self.keep_running.value:
+            if self.control_queue is not None:
+                self.apply_control()
+            batch = self.collect_batch()
+            if not batch:
+                continue
+            try:
+                frames = [ring_frame.frame for _, ring_frame, _ in batch]
+                predict_start = time.perf_counter()
+                results = self._predict(
+                    frames, min(source.conf for source, _, _ in batch)
+                )
+                # every frame in the batch waited for the whole batch
+                predict_s = time.perf_counter() - predict_start
+                for (source, ring_frame, capture_frame), result in zip(
+                    batch, results, strict=True
+                ):
+                    self._route(source, ring_frame, capture_frame, result, predict_s)
+            except:
+                # a bad batch is skipped, stopping would restart the server and reload the model for every source
+                self.logger.error(f"Inference server skipped a batch of {len(batch)}")
+                traceback.print_exc()
+            batches += 1
+            batch_sizes += len(batch)
+
+        for source in self.sources:
+            source.fps.stop()
+            source.status_block.set_state(STATE_STOPPED)
+        if batches:
+            self.logger.info(
+                f"Inference server served {batches} batches, mean batch size {batch_sizes / batches:.2f}"
+            )
+
+
+def run(
+    logging_queue,
+    source_channels,
+    keep_running,
+    model_path=DEFAULT_MODEL_PATH,
+    imgsz=DEFAULT_MODEL_IMGSZ,
+    max_batch=None,
+    max_wait_ms=20,
+    warmup_passes_dir=DEFAULT_WARMUP_PASSES_DIR,
+    control_queue=None,
+):
+    qh = logging.handlers.QueueHandler(logging_queue)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(qh)
+
+    sources = [InferenceSource(**channels) for channels in source_channels]
+    warmup_passes = WarmupPasses(warmup_passes_dir) if warmup_passes_dir else None
+    server = DarkCyanInferenceServer(
+        sources,
+        keep_running,
+        model_path,
+        imgsz,
+        max_batch,
+        max_wait_ms,
+        warmup_passes=warmup_passes,
+        control_queue=control_queue,
+    )
+    logger.info(
+        f"Starting inference server for {[source.source_name for source in sources]}, max batch {server.max_batch}, max wait {max_wait_ms}ms"
+    )
+    try:
+        server.serve()
+    except:
+        traceback.print_exc()
+    keep_running.value = False
@@ -0,0 +1,177 @@
+import numpy as np
+
+from darkcyan.stage_timing import STAGES, StageRecorder
+
+# Log-linear latency buckets in microseconds, HDR histogram style: values below 2**SUB_BUCKET_BITS
+# get a bucket each, above that every power of two is split into 2**SUB_BUCKET_BITS linear buckets,
+# so any recorded value is within 1/2**SUB_BUCKET_BITS (12.5%) of its bucket bounds.  The top
+# bucket catches everything from ~2 minutes up.
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 27  # 2**27 us ~ 134 s
+BUCKET_COUNT = SUB_BUCKETS + (MAX_EXPONENT - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+
+HISTOGRAM_MAGIC = 0x44434C48  # "DCLH"
+
+HEADER_DTYPE = np.dtype(
+    [("magic", np.uint32), ("stage_count", np.uint32), ("bucket_count", np.uint32)],
+    align=True,
+)
+STAGE_DTYPE = np.dtype(
+    [
+        ("count", np.uint64),
+        ("sum_us", np.uint64),
+        ("max_us", np.uint64),
+        ("buckets", np.uint64, BUCKET_COUNT),
+    ],
+    align=True,
+)
+
+
+def bucket_index(us):
+    if us < SUB_BUCKETS:
+        return int(us)
+    exponent = int(us).bit_length() - 1
+    if exponent > MAX_EXPONENT:
+        return BUCKET_COUNT - 1
+    sub_bucket = (int(us) >> (exponent - SUB_BUCKET_BITS)) & (SUB_BUCKETS - 1)
+    return SUB_BUCKETS + (exponent - SUB_BUCKET_BITS) * SUB_BUCKETS + sub_bucket
+
+
+def _bucket_bounds():
+    lower = np.arange(BUCKET_COUNT, dtype=np.float64)
+    upper = lower + 1
+    index = np.arange(SUB_BUCKETS, BUCKET_COUNT)
+    exponent = (index - SUB_BUCKETS) // SUB_BUCKETS + SUB_BUCKET_BITS
+    sub_bucket = (index - SUB_BUCKETS) % SUB_BUCKETS
+    lower[SUB_BUCKETS:] = (SUB_BUCKETS + sub_bucket) * 2.0 ** (
+        exponent - SUB_BUCKET_BITS
+    )
+    upper[SUB_BUCKETS:] = (SUB_BUCKETS + sub_bucket + 1) * 2.0 ** (
+        exponent - SUB_BUCKET_BITS
+    )
+    return lower, upper
+
+
+BUCKET_LOWER_US, BUCKET_UPPER_US = _bucket_bounds()
+
+
+def percentiles_from_buckets(buckets, percentiles=(50, 95, 99), max_us=None):
+    """Percentiles in ms from a bucket count array, reported as the upper bound of the bucket they fall in."""
+
+    total = buckets.sum()
+    if not total:
+        return [0.0 for _ in percentiles]
+    cumulative = np.cumsum(buckets)
+    ranks = np.ceil(np.asarray(percentiles, dtype=np.float64) / 100 * total)
+    indices = np.searchsorted(cumulative, np.maximum(ranks, 1))
+    values = BUCKET_UPPER_US[np.minimum(indices, BUCKET_COUNT - 1)]
+    if max_us:
+        values = np.minimum(values, max_us)
+    return (values / 1e3).tolist()
+
+
+class LatencyHistograms(StageRecorder):
+    """Per-stage latency histograms kept in shared memory.
+
+    Each stage has exactly one writing thread in the source process, readers (the supervisor, an
+    HTTP endpoint) just copy the counters.  A read racing a write can be off by the one sample in
+    flight, which doesn't matter for percentiles.
+    """
+
+    def __init__(self, shared_memory, create=False, stages=STAGES):
+        self.shared_memory = shared_memory
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shared_memory.buf)
+        if create:
+            self.header["stage_count"] = len(stages)
+            self.header["bucket_count"] = BUCKET_COUNT
+            self.header["magic"] = HISTOGRAM_MAGIC
+        elif self.header["magic"] != HISTOGRAM_MAGIC:
+            raise ValueError(
+                "Shared memory does not contain initialised latency histograms"
+            )
+
+        self.stages = tuple(stages)
+        self.stage_index = {stage: i for i, stage in enumerate(self.stages)}
+        self.histograms = np.ndarray(
+            (len(self.stages),),
+            dtype=STAGE_DTYPE,
+            buffer=shared_memory.buf,
+            offset=HEADER_DTYPE.itemsize,
+        )
+        if create:
+            self.histograms[:] = np.zeros((), dtype=STAGE_DTYPE)
+
+        # views straight onto the shared counters so record() doesn't go through the structured dtype
+        self.counts = self.histograms["count"]
+        self.sums = self.histograms["sum_us"]
+        self.maxima = self.histograms["max_us"]
+        self.buckets = self.histograms["buckets"]
+
+    @staticmethod
+    def required_size(stages=STAGES):
+        return HEADER_DTYPE.itemsize + len(stages) * STAGE_DTYPE.itemsize
+
+    @staticmethod
+    def create(shared_memory, stages=STAGES):
+        return LatencyHistograms(shared_memory, create=True, stages=stages)
+
+    def record(self, frame_id, stage, seconds):
+        index = self.stage_index.get(stage)
+        if index is None:
+            return
+        us = max(int(seconds * 1e6), 0)
+        self.buckets[index, bucket_index(us)] += 1
+        self.sums[index] += us
+        if us > self.maxima[index]:
+            self.maxima[index] = us
+        self.counts[index] += 1
+
+    def copy(self):
+        return self.histograms.copy()
+
+    def summary(self, histograms=None, percentiles=(50, 95, 99)):
+        """{stage: {count, mean_ms, p50_ms, ..., max_ms}} from a copy() (or the live counters)."""
+
+        if histograms is None:
+            histograms = self.copy()
+        summary = {}
+        for stage, histogram in zip(self.stages, histograms):
+            count = int(histogram["buckets"].sum())
+            if not count:
+                continue
+            values = percentiles_from_buckets(
+                histogram["buckets"], percentiles, int(histogram["max_us"])
+            )
+            summary[stage] = {
+                "count": count,
+                "mean_ms": int(histogram["sum_us"]) / count / 1e3,
+                **{f"p{p}_ms": v for p, v in zip(percentiles, values)},
+                "max_ms": int(histogram["max_us"]) / 1e3,
+            }
+        return summary
+
+
+class LatencyWindow:
+    """Percentiles over a recent window instead of since start, by diffing against a snapshot taken every window_s."""
+
+    def __init__(self, histograms, window_s=10.0):
+        self.histograms = histograms
+        self.window_s = window_s
+        self.base = histograms.copy()
+        self.previous = self.base
+        self.base_time = None
+
+    def summary(self, now):
+        if self.base_time is None:
+            self.base_time = now
+        current = self.histograms.copy()
+        window = current.copy()
+        # counts since the window before last, so the window never drops to a handful of samples
+        window["buckets"] -= self.previous["buckets"]
+        window["sum_us"] -= self.previous["sum_us"]
+        if now - self.base_time >= self.window_s:
+            self.previous = self.base
+            self.base = current
+            self.base_time = now
+        return self.histograms.summary(window)
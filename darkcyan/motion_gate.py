@@ -0,0 +1,118 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Decides whether a frame is worth running the detector on.
+
+    Frames are reduced to a tiny grayscale thumbnail and compared against a slowly adapting
+    background.  Inference is requested when enough thumbnail pixels (optionally only inside the
+    configured zones) have changed, for hold_s seconds after that, and at least every keep_alive_s
+    seconds regardless, so a static scene still gets a periodic fresh detection.
+    """
+
+    def __init__(
+        self,
+        thumb_width=64,
+        threshold=25,
+        min_changed_fraction=0.002,
+        keep_alive_s=30.0,
+        hold_s=2.0,
+        background_alpha=0.05,
+        zones=None,
+    ):
+        self.thumb_width = thumb_width
+        self.threshold = threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.keep_alive_s = keep_alive_s
+        self.hold_s = hold_s
+        self.background_alpha = background_alpha
+        # normalised polygons, [[x, y], ...] in 0..1 of the capture frame
+        self.zones = zones or []
+
+        self.background = None
+        self._source_size = None
+        self.thumb_size = None
+        self.zone_mask = None
+        self.zone_pixels = 0
+        self.last_inference = 0.0
+        self.last_motion = 0.0
+
+        self.frames = 0
+        self.skipped = 0
+
+    @staticmethod
+    def from_config(config):
+        if not config or not config.get("enabled", True):
+            return None
+        options = {key: value for key, value in config.items() if key != "enabled"}
+        return MotionGate(**options)
+
+    def __repr__(self):
+        return f"MotionGate(changed > {self.min_changed_fraction:.2%}, keep alive {self.keep_alive_s}s, {len(self.zones)} zones)"
+
+    def _configure(self, width, height):
+        thumb_height = max(1, round(height * self.thumb_width / width))
+        self.thumb_size = (self.thumb_width, thumb_height)
+        self.background = None
+
+        if self.zones:
+            self.zone_mask = np.zeros((thumb_height, self.thumb_width), dtype=np.uint8)
+            scale = np.array([self.thumb_width, thumb_height], dtype=np.float32)
+            polygons = [
+                np.round(np.asarray(zone, dtype=np.float32) * scale).astype(np.int32)
+                for zone in self.zones
+            ]
+            cv2.fillPoly(self.zone_mask, polygons, 255)
+            self.zone_pixels = int(np.count_nonzero(self.zone_mask))
+        else:
+            self.zone_mask = None
+            self.zone_pixels = thumb_height * self.thumb_width
+
+    def thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        if self._source_size != (width, height):
+            self._source_size = (width, height)
+            self._configure(width, height)
+        thumb = cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        return thumb
+
+    def motion_fraction(self, frame):
+        thumb = self.thumbnail(frame)
+        if self.background is None:
+            self.background = thumb.astype(np.float32)
+            return 1.0
+
+        diff = cv2.absdiff(thumb, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(thumb, self.background, self.background_alpha)
+
+        changed = diff > self.threshold
+        if self.zone_mask is not None:
+            changed &= self.zone_mask > 0
+        return np.count_nonzero(changed) / max(self.zone_pixels, 1)
+
+    def should_infer(self, frame, now=None):
+        """frame is the capture image (or a letterbox-free view of it), returns True to run the model."""
+
+        if now is None:
+            now = time.time()
+        self.frames += 1
+
+        if self.motion_fraction(frame) >= self.min_changed_fraction:
+            self.last_motion = now
+
+        if (now - self.last_motion) <= self.hold_s or (
+            now - self.last_inference
+        ) >= self.keep_alive_s:
+            self.last_inference = now
+            return True
+
+        self.skipped += 1
+        return False
+
+    def skipped_ratio(self):
+        return self.skipped / self.frames if self.frames else 0.0
@@ -0,0 +1,63 @@
+import os
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
+
+
+class Notifier:
+    """Writer end of a wake-up pipe, signalled whenever a worker has something new for the supervisor.
+
+    Wake-ups are a single byte written without blocking, if the pipe is already full the supervisor
+    has plenty of wake-ups pending and the byte is simply dropped.  The connection is a
+    multiprocessing Connection so it can be handed to spawned processes as well as forked ones.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.fd = None
+
+    def notify(self):
+        if self.fd is None:
+            # made non-blocking lazily, in the process that writes
+            self.fd = self.connection.fileno()
+            os.set_blocking(self.fd, False)
+        try:
+            os.write(self.fd, b"\x01")
+        except BlockingIOError:
+            pass
+        except OSError:
+            # the supervisor has gone, nobody is waiting for the wake-up
+            pass
+
+
+class NullNotifier:
+    def notify(self):
+        pass
+
+
+def create_notifier(connection):
+    return Notifier(connection) if connection is not None else NullNotifier()
+
+
+def notification_pipe():
+    """(reader, writer) Connections, the writer goes to the worker, the reader to wait_for_notifications"""
+
+    return Pipe(duplex=False)
+
+
+def drain(reader):
+    fd = reader.fileno()
+    os.set_blocking(fd, False)
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def wait_for_notifications(readers, timeout):
+    """Blocks until at least one reader has been signalled or timeout passes, returns and drains the signalled readers"""
+
+    ready = wait(readers, timeout)
+    for reader in ready:
+        drain(reader)
+    return ready
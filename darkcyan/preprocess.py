@@ -0,0 +1,93 @@
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# How a capture frame was placed into the model input, carried with the frame so boxes can be
+# projected back exactly:  capture_xy = (model_xy - pad) / scale
+LetterboxMeta = namedtuple(
+    "LetterboxMeta", ["scale", "pad_x", "pad_y", "orig_w", "orig_h"]
+)
+
+LETTERBOX_PAD_VALUE = 114  # same grey ultralytics pads with
+
+
+class LetterboxResizer:
+    """Aspect preserving resize into a rotating pool of preallocated model-sized buffers.
+
+    The pool must be larger than the number of frames that can be alive downstream at once (queued +
+    being inferred + being written), a buffer is handed out again after pool_size further frames.
+    """
+
+    def __init__(
+        self,
+        imgsz,
+        pool_size=8,
+        interpolation=cv2.INTER_AREA,
+        pad_value=LETTERBOX_PAD_VALUE,
+    ):
+        self.height, self.width = imgsz
+        self.interpolation = interpolation
+        self.pad_value = pad_value
+        self.pool = [
+            np.full((self.height, self.width, 3), pad_value, dtype=np.uint8)
+            for _ in range(pool_size)
+        ]
+        self.next_buffer = 0
+        self.source_size = None
+        self.meta = None
+
+    def _configure(self, orig_w, orig_h):
+        scale = min(self.width / orig_w, self.height / orig_h)
+        new_w = min(self.width, int(round(orig_w * scale)))
+        new_h = min(self.height, int(round(orig_h * scale)))
+        pad_x = (self.width - new_w) // 2
+        pad_y = (self.height - new_h) // 2
+
+        self.source_size = (orig_w, orig_h)
+        self.meta = LetterboxMeta(scale, pad_x, pad_y, orig_w, orig_h)
+        self.new_size = (new_w, new_h)
+        # the padding is only painted once per geometry, resizes only ever touch the image area
+        for buffer in self.pool:
+            buffer[:] = self.pad_value
+
+    def __call__(self, frame):
+        orig_h, orig_w = frame.shape[:2]
+        if self.source_size != (orig_w, orig_h):
+            self._configure(orig_w, orig_h)
+
+        buffer = self.pool[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % len(self.pool)
+
+        new_w, new_h = self.new_size
+        meta = self.meta
+        roi = buffer[meta.pad_y : meta.pad_y + new_h, meta.pad_x : meta.pad_x + new_w]
+        resized = cv2.resize(
+            frame, (new_w, new_h), dst=roi, interpolation=self.interpolation
+        )
+        if not np.shares_memory(resized, roi):
+            # older OpenCV builds won't write into a strided ROI, fall back to a copy
+            roi[:] = resized
+        return buffer, meta
+
+
+def unletterbox_boxes(xyxy, meta):
+    """Project (N, 4) model-space boxes back into capture frame pixels, in place."""
+
+    xs = xyxy[:, 0::2]
+    ys = xyxy[:, 1::2]
+    xs -= meta.pad_x
+    ys -= meta.pad_y
+    xyxy /= meta.scale
+    np.clip(xs, 0, meta.orig_w - 1, out=xs)
+    np.clip(ys, 0, meta.orig_h - 1, out=ys)
+    return xyxy
+
+
+def image_area(buffer, meta):
+    """View of the letterboxed buffer without its padding."""
+
+    new_w = min(buffer.shape[1], int(round(meta.orig_w * meta.scale)))
+    new_h = min(buffer.shape[0], int(round(meta.orig_h * meta.scale)))
+    pad_x, pad_y = int(meta.pad_x), int(meta.pad_y)
+    return buffer[pad_y : pad_y + new_h, pad_x : pad_x + new_w]
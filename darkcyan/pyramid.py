@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from darkcyan.constants import DEFAULT_CONFIG_DIR
+from darkcyan.detections import draw_detections
+
+# Levels besides the full resolution frame, by width: display for streaming, thumb for dashboards
+DEFAULT_PYRAMID = {"display": 800, "thumb": 160}
+
+DEFAULT_GEOMETRY_CACHE = DEFAULT_CONFIG_DIR / "frame_geometry.json"
+
+
+def level_shape(frame_shape, width):
+    """Aspect preserving shape of a level width pixels wide, never larger than the frame, even sized for the encoders"""
+
+    height, frame_width = frame_shape[:2]
+    if width >= frame_width:
+        return tuple(frame_shape)
+    level_height = max(2, int(round(height * width / frame_width)) & ~1)
+    return (level_height, width) + tuple(frame_shape[2:])
+
+
+def pyramid_shapes(frame_shape, widths):
+    """{level: shape}, "full" first and then the levels from widest to narrowest"""
+
+    shapes = {"full": tuple(frame_shape)}
+    for level, width in sorted(widths.items(), key=lambda item: -item[1]):
+        shapes[level] = level_shape(frame_shape, width)
+    return shapes
+
+
+class PyramidBuilder:
+    """Builds a frame's smaller levels once on the capture thread, each from the next larger level.
+
+    Like LetterboxResizer the levels go into a rotating pool of buffers that must outlast every frame
+    alive downstream.
+    """
+
+    def __init__(self, widths, pool_size=8, interpolation=cv2.INTER_AREA):
+        self.widths = dict(widths)
+        self.pool_size = pool_size
+        self.interpolation = interpolation
+        self.frame_shape = None
+        self.shapes = None
+        self.pool = None
+        self.next_buffer = 0
+
+    def _configure(self, frame_shape):
+        self.frame_shape = frame_shape
+        self.shapes = pyramid_shapes(frame_shape, self.widths)
+        self.pool = [
+            {
+                level: np.empty(shape, dtype=np.uint8)
+                for level, shape in self.shapes.items()
+                if level != "full"
+            }
+            for _ in range(self.pool_size)
+        ]
+
+    def __call__(self, frame):
+        """{level: image} for every level but "full", which is the frame itself"""
+
+        if frame.shape != self.frame_shape:
+            self._configure(frame.shape)
+        buffers = self.pool[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % self.pool_size
+
+        levels = {}
+        previous = frame
+        for level, buffer in buffers.items():
+            if buffer.shape == previous.shape:
+                # a level as wide as the frame (a small source) is the frame
+                levels[level] = previous
+                continue
+            cv2.resize(
+                previous,
+                (buffer.shape[1], buffer.shape[0]),
+                dst=buffer,
+                interpolation=self.interpolation,
+            )
+            levels[level] = buffer
+            previous = buffer
+        return levels
+
+
+def draw_levels(levels, detections, frame_shape):
+    """Draws full frame detections onto each level, boxes scaled to the level"""
+
+    frame_height, frame_width = frame_shape[:2]
+    for image in levels.values():
+        height, width = image.shape[:2]
+        if (height, width) == (frame_height, frame_width):
+            continue
+        scaled = detections.copy()
+        for field, scale in (
+            ("x1", width / frame_width),
+            ("x2", width / frame_width),
+            ("y1", height / frame_height),
+            ("y2", height / frame_height),
+        ):
+            scaled[field] = detections[field] * scale
+        draw_detections(image, scaled)
+
+
+class GeometryCache:
+    """Native frame shape per source path, so rings can be sized for a source before its first frame"""
+
+    def __init__(self, path=DEFAULT_GEOMETRY_CACHE):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.shapes = {}
+        try:
+            with open(self.path, "r") as f:
+                self.shapes = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.info(
+                f"Ignoring unreadable frame geometry cache {self.path}: {e}"
+            )
+
+    def get(self, source_path):
+        shape = self.shapes.get(str(source_path))
+        return tuple(shape) if shape else None
+
+    def put(self, source_path, shape):
+        self.shapes[str(source_path)] = list(shape)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.shapes, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.info(f"Unable to save frame geometry cache {self.path}: {e}")
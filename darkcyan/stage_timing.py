@@ -0,0 +1,127 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Pipeline stages timed per frame by yolo_proc, in pipeline order
+STAGES = (
+    "read",
+    "resize",
+    "queue_wait",
+    "predict",
+    "postprocess",
+    "draw",
+    "shm_write",
+    "end_to_end",
+)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class StageRecorder:
+    """Receives the duration of each pipeline stage for each frame.  The base recorder discards them."""
+
+    def record(self, frame_id, stage, seconds):
+        pass
+
+
+class CompositeRecorder(StageRecorder):
+    def __init__(self, recorders):
+        self.recorders = [recorder for recorder in recorders if recorder is not None]
+
+    def record(self, frame_id, stage, seconds):
+        for recorder in self.recorders:
+            recorder.record(frame_id, stage, seconds)
+
+
+def combine_recorders(*recorders):
+    recorders = [recorder for recorder in recorders if recorder is not None]
+    if not recorders:
+        return StageRecorder()
+    if len(recorders) == 1:
+        return recorders[0]
+    return CompositeRecorder(recorders)
+
+
+class StageTimer:
+    """Times consecutive stages of one frame, each mark() closes the stage that started at the previous one."""
+
+    def __init__(self, recorder, frame_id, start=None):
+        self.recorder = recorder
+        self.frame_id = frame_id
+        self.last = time.perf_counter() if start is None else start
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.recorder.record(self.frame_id, stage, now - self.last)
+        self.last = now
+        return now
+
+    def skip(self):
+        # start the next stage now without recording the time since the last mark
+        self.last = time.perf_counter()
+
+
+class FrameTimingRecorder(StageRecorder):
+    """Keeps every sample, for benchmarks.  list.append is atomic so the capture and inference threads can share it."""
+
+    def __init__(self):
+        self.samples = []
+        # the clock runs from the first frame to the last one, not over model load, warm-up and shutdown
+        self.started = None
+        self.last_recorded = None
+
+    def record(self, frame_id, stage, seconds):
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now - seconds
+        self.samples.append((frame_id, stage, seconds))
+        self.last_recorded = now
+
+    def by_frame(self):
+        frames = defaultdict(dict)
+        for frame_id, stage, seconds in self.samples:
+            frames[frame_id][stage] = seconds
+        return dict(sorted(frames.items()))
+
+    def by_stage(self):
+        stages = defaultdict(list)
+        for _, stage, seconds in self.samples:
+            stages[stage].append(seconds)
+        return {stage: np.array(stages[stage]) for stage in STAGES if stage in stages}
+
+    def summary(self):
+        if self.started is None:
+            elapsed = 0.0
+        else:
+            elapsed = self.last_recorded - self.started
+        stages = {}
+        for stage, seconds in self.by_stage().items():
+            ms = seconds * 1e3
+            stages[stage] = {
+                "count": int(len(ms)),
+                "mean_ms": float(ms.mean()),
+                **{
+                    f"p{p}_ms": float(v)
+                    for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))
+                },
+                "max_ms": float(ms.max()),
+            }
+
+        def throughput(stage):
+            return (
+                stages[stage]["count"] / elapsed
+                if stage in stages and elapsed > 0
+                else 0.0
+            )
+
+        return {
+            "elapsed_s": elapsed,
+            "frames_read": stages.get("read", {}).get("count", 0),
+            "frames_inferred": stages.get("predict", {}).get("count", 0),
+            "frames_published": stages.get("shm_write", {}).get("count", 0),
+            "read_fps": throughput("read"),
+            "inference_fps": throughput("predict"),
+            "published_fps": throughput("shm_write"),
+            "stages": stages,
+        }
@@ -0,0 +1,169 @@
+import time
+
+import numpy as np
+
+# Fixed binary status for one source, replacing the old 100 byte status string.
+#
+# The inference side publishes a snapshot (frame id, per-class counts, inference fps and latency)
+# under a sequence lock the same way FrameRing protects its slots: seq goes odd while the snapshot
+# is written and even once it is complete, readers retry until they copy an even, unchanged seq.
+# source_fps has its own writer (the capture thread, possibly in another process) so it sits outside
+# the seqlock, a single aligned float store is all it needs.  frame_shape is
+# written once per capture start, height last, so a non-zero height means the shape is complete.
+
+STATUS_MAGIC = 0x44435354  # "DCST"
+MAX_CLASSES = 128
+CLASS_NAME_LEN = 24
+
+STATE_INITIALISING = 0
+STATE_RUNNING = 1
+STATE_STOPPED = 2
+STATE_RESTARTING = 3
+STATE_NAMES = {
+    STATE_INITIALISING: "initialising",
+    STATE_RUNNING: "running",
+    STATE_STOPPED: "stopped",
+    STATE_RESTARTING: "restarting",
+}
+
+STATUS_DTYPE = np.dtype(
+    [
+        ("magic", np.uint32),
+        ("state", np.uint32),
+        ("source_fps", np.float32),
+        ("class_count", np.uint32),
+        # seconds from the source starting to its first inference, 0 until then
+        ("first_detection_s", np.float32),
+        # native capture geometry (height, width, channels), written by the capture on its first frame
+        ("frame_shape", np.uint32, 3),
+        ("seq", np.uint64),
+        ("frame_id", np.uint64),
+        ("timestamp", np.float64),
+        ("inference_fps", np.float32),
+        ("inference_ms", np.float32),
+        ("detection_count", np.uint32),
+        ("counts", np.uint16, MAX_CLASSES),
+        # written once by whoever loads the model, before the first snapshot
+        ("class_names", f"S{CLASS_NAME_LEN}", MAX_CLASSES),
+    ],
+    align=True,
+)
+
+
+class StatusBlock:
+    """One source's status in shared memory, a single snapshot writer and any number of readers."""
+
+    def __init__(self, shared_memory, create=False):
+        self.shared_memory = shared_memory
+        if shared_memory.size < STATUS_DTYPE.itemsize:
+            raise ValueError(
+                f"Shared memory of {shared_memory.size} bytes is too small for a {STATUS_DTYPE.itemsize} byte status block"
+            )
+        self.status = np.ndarray((), dtype=STATUS_DTYPE, buffer=shared_memory.buf)
+        if create:
+            self.status[()] = np.zeros((), dtype=STATUS_DTYPE)
+            self.status["magic"] = STATUS_MAGIC
+        elif self.status["magic"] != STATUS_MAGIC:
+            raise ValueError(
+                "Shared memory does not contain an initialised status block"
+            )
+        # the counts are bincounted straight into this view
+        self.counts = self.status["counts"]
+
+    @staticmethod
+    def required_size():
+        return STATUS_DTYPE.itemsize
+
+    @staticmethod
+    def create(shared_memory):
+        return StatusBlock(shared_memory, create=True)
+
+    def set_class_names(self, names):
+        """names as model.names, a {class id: name} dict or a list"""
+
+        if isinstance(names, dict):
+            names = [names.get(i, str(i)) for i in range(max(names, default=-1) + 1)]
+        names = list(names)[:MAX_CLASSES]
+        # cut on a character boundary, a multibyte character split in half would not decode
+        self.status["class_names"][: len(names)] = [
+            str(name)
+            .encode("utf-8")[:CLASS_NAME_LEN]
+            .decode("utf-8", "ignore")
+            .encode("utf-8")
+            for name in names
+        ]
+        self.status["class_count"] = len(names)
+
+    def set_source_fps(self, fps):
+        self.status["source_fps"] = fps
+
+    def set_frame_shape(self, shape):
+        shape = tuple(shape) + (1,) if len(shape) == 2 else tuple(shape[:3])
+        self.status["frame_shape"][1:] = shape[1:]
+        # height last, readers take a zero height as not reported yet
+        self.status["frame_shape"][0] = shape[0]
+
+    def frame_shape(self):
+        """The capture's native frame shape, None until its first frame"""
+
+        shape = tuple(int(s) for s in self.status["frame_shape"])
+        return shape if shape[0] else None
+
+    def set_first_detection(self, seconds):
+        self.status["first_detection_s"] = seconds
+
+    def set_state(self, state):
+        self.status["state"] = state
+
+    def state(self):
+        return int(self.status["state"])
+
+    def publish(self, frame_id, cls, inference_fps, inference_ms, timestamp=None):
+        """cls is the detections' class id column, counted per class into the snapshot"""
+
+        seq = int(self.status["seq"])
+        self.status["seq"] = seq + 1
+        counts = np.bincount(
+            cls[(cls >= 0) & (cls < MAX_CLASSES)], minlength=MAX_CLASSES
+        )
+        self.counts[:] = np.minimum(counts, np.iinfo(np.uint16).max)
+        self.status["detection_count"] = len(cls)
+        self.status["frame_id"] = frame_id
+        self.status["timestamp"] = time.time() if timestamp is None else timestamp
+        self.status["inference_fps"] = inference_fps
+        self.status["inference_ms"] = inference_ms
+        self.status["state"] = STATE_RUNNING
+        self.status["seq"] = seq + 2
+
+    def read(self, retries=3):
+        """Consistent copy of the status, or None if the writer kept it busy for every retry"""
+
+        for _ in range(retries):
+            seq = int(self.status["seq"])
+            if seq & 1:
+                continue
+            snapshot = self.status.copy()
+            if int(self.status["seq"]) == seq:
+                return snapshot
+        return None
+
+    def class_names(self, snapshot=None):
+        status = self.status if snapshot is None else snapshot
+        return [
+            name.decode("utf-8", "ignore")
+            for name in status["class_names"][: int(status["class_count"])]
+        ]
+
+    def describe(self, snapshot, class_names=None):
+        """Human readable 'can see' line for a snapshot from read()"""
+
+        if int(snapshot["state"]) != STATE_RUNNING:
+            return STATE_NAMES.get(int(snapshot["state"]), "unknown")
+        if class_names is None:
+            class_names = self.class_names(snapshot)
+        seen = [
+            f"{class_names[i] if i < len(class_names) else i} x{count}"
+            for i, count in enumerate(snapshot["counts"].tolist())
+            if count
+        ]
+        return f"can see {', '.join(seen)}" if seen else "can see nothing"
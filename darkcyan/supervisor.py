@@ -0,0 +1,155 @@
+import logging
+import time
+from multiprocessing import Process
+
+
+class Backoff:
+    """Exponential restart delay, starting over once a restarted child has stayed up for reset_after_s"""
+
+    def __init__(self, initial_s=1.0, max_s=60.0, reset_after_s=60.0):
+        self.initial_s = initial_s
+        self.max_s = max_s
+        self.reset_after_s = reset_after_s
+        self.attempts = 0
+
+    def failed(self, started_at, now=None):
+        """Delay before the next restart of something that started at started_at and has now failed"""
+
+        if now is None:
+            now = time.time()
+        if now - started_at >= self.reset_after_s:
+            self.attempts = 0
+        delay = min(self.initial_s * 2**self.attempts, self.max_s)
+        self.attempts += 1
+        return delay
+
+
+def wait_unless_stopped(keep_running, seconds, interval=0.2):
+    """Sleep for seconds, returns False early if keep_running is cleared meanwhile"""
+
+    deadline = time.time() + seconds
+    while keep_running.value:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return True
+        time.sleep(min(interval, remaining))
+    return False
+
+
+def _run_initialized(initializer, target, args, kwargs):
+    initializer()
+    target(*args, **kwargs)
+
+
+class SupervisedProcess:
+    """A worker process restarted with exponential backoff whenever it exits while still wanted.
+
+    keep_running is the worker's own Value, the caller also passes it in the worker's arguments, so a
+    worker giving up only clears its own flag and never the whole app's.  on_restart is called once
+    the exit is noticed, e.g. to mark the source's status as restarting.  initializer runs in the
+    child before target, e.g. to apply its thread budget.
+    """
+
+    def __init__(
+        self,
+        name,
+        target,
+        keep_running,
+        args=(),
+        kwargs=None,
+        backoff=None,
+        on_restart=None,
+        initializer=None,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.target = target
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+        self.keep_running = keep_running
+        self.backoff = backoff or Backoff()
+        self.on_restart = on_restart
+        self.initializer = initializer
+        self.process = None
+        self.started_at = None
+        self.restart_at = None
+        self.restarts = 0
+        self.stopping = False
+        self.stop_requested_at = None
+
+    def __repr__(self):
+        return f"SupervisedProcess({self.name}, restarts={self.restarts})"
+
+    def start(self):
+        self.keep_running.value = True
+        if self.initializer is not None:
+            self.process = Process(
+                name=self.name,
+                target=_run_initialized,
+                args=(self.initializer, self.target, self.args, self.kwargs),
+            )
+        else:
+            self.process = Process(
+                name=self.name, target=self.target, args=self.args, kwargs=self.kwargs
+            )
+        self.process.start()
+        self.started_at = time.time()
+        self.restart_at = None
+        return self
+
+    def poll(self, now=None):
+        """Call regularly, restarts the process once its backoff delay has passed.  Returns True while it is running"""
+
+        if self.stopping or self.process is None:
+            return False
+        if self.process.is_alive():
+            return True
+        if now is None:
+            now = time.time()
+        if self.restart_at is None:
+            self.process.join(timeout=0)
+            delay = self.backoff.failed(self.started_at, now)
+            self.restart_at = now + delay
+            self.logger.info(
+                f"{self.name} exited with code {self.process.exitcode}, restarting in {delay:.1f}s"
+            )
+            if self.on_restart is not None:
+                self.on_restart()
+        if now >= self.restart_at:
+            self.restarts += 1
+            self.logger.info(f"Restarting {self.name} (restart {self.restarts})")
+            self.start()
+            return True
+        return False
+
+    def request_stop(self):
+        self.stopping = True
+        self.stop_requested_at = time.time()
+        self.keep_running.value = False
+
+    def reap(self, now=None, timeout=5):
+        """Non-blocking join for a stopping process, terminates it once timeout has passed since request_stop.  True once it has exited"""
+
+        if self.process is None or not self.process.is_alive():
+            return True
+        if now is None:
+            now = time.time()
+        if now - self.stop_requested_at >= timeout:
+            self.logger.info(f"{self.name} did not stop within {timeout}s, terminating")
+            self.process.terminate()
+        return False
+
+    def join(self, timeout=5):
+        """Waits for a stopping process, terminating it if it hasn't exited within timeout"""
+
+        if self.process is not None and self.process.is_alive():
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.logger.info(
+                    f"{self.name} did not stop within {timeout}s, terminating"
+                )
+                self.process.terminate()
+
+    def stop(self, timeout=5):
+        self.request_stop()
+        self.join(timeout)
@@ -0,0 +1,98 @@
+import os
+from collections import namedtuple
+
+import cv2
+import torch
+
+# What one process may use: the cores it is pinned to (None leaves affinity alone, e.g. on macOS)
+# and the sizes of the OpenCV and PyTorch thread pools it runs with
+ThreadBudget = namedtuple(
+    "ThreadBudget", ["cores", "cv2_threads", "torch_threads", "torch_interop_threads"]
+)
+
+INFERENCE_SERVER = "inference-server"
+ENCODER = "encoder"
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cores, count):
+    """count contiguous, near equal blocks of cores, processes share cores round robin when there are more processes than cores"""
+
+    if count <= 0:
+        return []
+    if count > len(cores):
+        return [[cores[i % len(cores)]] for i in range(count)]
+    size, extra = divmod(len(cores), count)
+    blocks = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        blocks.append(cores[start:end])
+        start = end
+    return blocks
+
+
+def plan_threads(
+    sources, use_inference_server=False, cores=None, reserved_cores=1, overrides=None
+):
+    """{process name: ThreadBudget} for every source key, the inference server (when used) and the encoder.
+
+    reserved_cores are left to the app's main loop and the encoder.  Without the inference server
+    each source process gets its own block of the remaining cores and runs PyTorch on all of them.
+    With it the capture processes only decode and letterbox, so they share at most half the cores
+    one each and the server gets the rest.  OpenCV always gets a single thread, its per-frame work
+    is small resizes and drawing that a pool sized to the whole machine only slows down.
+    overrides replace fields of any process's budget, e.g. {"front": {"cores": [2, 3], "torch_threads": 2}}.
+    """
+
+    if cores is None:
+        cores = available_cores()
+    reserved = cores[:reserved_cores] if len(cores) > reserved_cores else []
+    work = cores[len(reserved) :]
+
+    plan = {}
+    if use_inference_server:
+        capture_count = min(len(sources), max(1, len(work) // 2))
+        capture_cores = work[:capture_count]
+        server_cores = work[capture_count:] or work
+        for i, source in enumerate(sources):
+            plan[source] = ThreadBudget([capture_cores[i % capture_count]], 1, 1, 1)
+        plan[INFERENCE_SERVER] = ThreadBudget(server_cores, 1, len(server_cores), 1)
+    else:
+        for source, block in zip(sources, split_cores(work, len(sources))):
+            plan[source] = ThreadBudget(block, 1, len(block), 1)
+    plan[ENCODER] = ThreadBudget(reserved or cores, 1, 1, 1)
+
+    for name, override in (overrides or {}).items():
+        if name in plan:
+            plan[name] = plan[name]._replace(**override)
+    return plan
+
+
+def describe_plan(plan):
+    return [
+        f"{name}: cores {budget.cores}, {budget.torch_threads} torch / {budget.cv2_threads} cv2 threads"
+        for name, budget in plan.items()
+    ]
+
+
+def apply_thread_budget(budget):
+    """Runs first thing in the child process, before any pool has been sized or thread started"""
+
+    if budget.cores and hasattr(os, "sched_setaffinity"):
+        # an override naming cores this host (or cgroup) doesn't have leaves those out rather than failing
+        cores = set(budget.cores) & os.sched_getaffinity(0)
+        if cores:
+            os.sched_setaffinity(0, cores)
+    cv2.setNumThreads(budget.cv2_threads)
+    torch.set_num_threads(budget.torch_threads)
+    try:
+        torch.set_num_interop_threads(budget.torch_interop_threads)
+    except RuntimeError:
+        # only settable once and before any inter-op work, a restarted child forked after that keeps the old size
+        pass
@@ -0,0 +1,289 @@
+import lap
+import numpy as np
+
+from darkcyan.detections import DETECTION_DTYPE
+
+# A tracked object as the tracker reports it, a detection plus its persistent id
+TRACK_DTYPE = np.dtype(DETECTION_DTYPE.descr + [("track_id", np.uint32)])
+
+EMPTY_TRACKS = np.zeros(0, dtype=TRACK_DTYPE)
+
+
+def box_iou(a, b):
+    """(N, M) IoU of two (N, 4) and (M, 4) xyxy float arrays"""
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def match(cost, cost_limit):
+    """Linear assignment of a (N, M) cost matrix, (rows, cols) of the pairs cheaper than cost_limit"""
+
+    if not cost.size:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    _, x, _ = lap.lapjv(cost, extend_cost=True, cost_limit=cost_limit)
+    rows = np.flatnonzero(x >= 0)
+    return rows, x[rows]
+
+
+def _xyxy(cxcywh):
+    half = cxcywh[:, 2:4] / 2
+    return np.concatenate([cxcywh[:, :2] - half, cxcywh[:, :2] + half], axis=1)
+
+
+def _cxcywh(detections):
+    x1 = detections["x1"].astype(np.float64)
+    y1 = detections["y1"].astype(np.float64)
+    x2 = detections["x2"].astype(np.float64)
+    y2 = detections["y2"].astype(np.float64)
+    return np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1)
+
+
+class KalmanBoxFilter:
+    """Constant velocity Kalman filter over (cx, cy, w, h), run on every track at once.
+
+    States are (N, 8) means with (N, 8, 8) covariances, time steps are in frames.  Noise scales with
+    the box size, as in SORT and ByteTrack.
+    """
+
+    def __init__(self, std_position=1.0 / 20, std_velocity=1.0 / 160):
+        self.std_position = std_position
+        self.std_velocity = std_velocity
+
+    def initiate(self, measurements):
+        mean = np.concatenate([measurements, np.zeros_like(measurements)], axis=1)
+        wh = np.tile(measurements[:, 2:4], 2)
+        std = np.concatenate(
+            [2 * self.std_position * wh, 10 * self.std_velocity * wh], axis=1
+        )
+        covariance = np.zeros((len(measurements), 8, 8))
+        covariance[:, np.arange(8), np.arange(8)] = std**2
+        return mean, covariance
+
+    def predict(self, mean, covariance, steps):
+        """Advance every track steps frames, steps is a scalar or one per track"""
+
+        steps = np.broadcast_to(np.asarray(steps, dtype=np.float64), (len(mean),))
+        transition = np.tile(np.eye(8), (len(mean), 1, 1))
+        transition[:, np.arange(4), np.arange(4) + 4] = steps[:, None]
+        wh = np.tile(mean[:, 2:4], 2)
+        noise = np.zeros_like(covariance)
+        noise[:, np.arange(8), np.arange(8)] = (
+            np.concatenate(
+                [(self.std_position * wh) ** 2, (self.std_velocity * wh) ** 2], axis=1
+            )
+            * steps[:, None]
+        )
+        mean = (transition @ mean[:, :, None])[:, :, 0]
+        covariance = transition @ covariance @ transition.transpose(0, 2, 1) + noise
+        return mean, covariance
+
+    def update(self, mean, covariance, measurements):
+        wh = np.tile(mean[:, 2:4], 2)
+        innovation_cov = covariance[:, :4, :4].copy()
+        innovation_cov[:, np.arange(4), np.arange(4)] += (self.std_position * wh) ** 2
+        gain = covariance[:, :, :4] @ np.linalg.inv(innovation_cov)
+        mean = mean + (gain @ (measurements - mean[:, :4])[:, :, None])[:, :, 0]
+        covariance = covariance - gain @ innovation_cov @ gain.transpose(0, 2, 1)
+        return mean, covariance
+
+
+class Tracker:
+    """ByteTrack style multi-object tracker, persistent ids for the detections of one source.
+
+    Call predict(frame_id) for every frame and update(detections) after it on frames the detector
+    ran on.  Confident detections are matched to the predicted tracks first, the leftover tracks then
+    get a second chance against the low confidence detections, both by IoU with lapx's linear
+    assignment.  Unmatched confident detections start tentative tracks, which are confirmed by a
+    match on the next detected frame.  Tracks are kept for max_age frames without a match so objects
+    that are briefly occluded keep their id.
+
+    Track state lives in flat numpy arrays so a frame costs a handful of batched operations whatever
+    the number of objects.
+    """
+
+    def __init__(
+        self,
+        high_thresh=0.5,
+        low_thresh=0.1,
+        new_track_thresh=0.6,
+        match_iou=0.2,
+        low_match_iou=0.5,
+        max_age=30,
+        class_aware=True,
+    ):
+        self.high_thresh = high_thresh
+        self.low_thresh = low_thresh
+        self.new_track_thresh = new_track_thresh
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        self.max_age = max_age
+        self.class_aware = class_aware
+        self.kalman = KalmanBoxFilter()
+
+        self.frame_id = None
+        self.next_id = 1
+        self.mean = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 8, 8))
+        self.track = np.zeros(0, dtype=TRACK_DTYPE)
+        self.confirmed = np.zeros(0, dtype=bool)
+        # frames since the last match, and whether the last detected frame matched
+        self.since_update = np.zeros(0, dtype=np.int64)
+        self.matched = np.zeros(0, dtype=bool)
+
+        self.new_tracks = EMPTY_TRACKS
+        self.tracks_started = 0
+        self.tracks_confirmed = 0
+
+    def __repr__(self):
+        return f"Tracker(conf >= {self.high_thresh}/{self.low_thresh}, new >= {self.new_track_thresh}, max age {self.max_age} frames, {len(self.track)} tracks)"
+
+    @staticmethod
+    def from_config(config):
+        if not config or not config.get("enabled", True):
+            return None
+        options = {
+            key: value
+            for key, value in config.items()
+            if key not in ("enabled", "detect_interval")
+        }
+        return Tracker(**options)
+
+    def _keep(self, keep):
+        self.mean = self.mean[keep]
+        self.covariance = self.covariance[keep]
+        self.track = self.track[keep]
+        self.confirmed = self.confirmed[keep]
+        self.since_update = self.since_update[keep]
+        self.matched = self.matched[keep]
+
+    def _boxes(self):
+        return _xyxy(self.mean[:, :4])
+
+    def _sync_boxes(self):
+        xyxy = np.round(self._boxes()).astype(np.int32)
+        self.track["x1"] = xyxy[:, 0]
+        self.track["y1"] = xyxy[:, 1]
+        self.track["x2"] = xyxy[:, 2]
+        self.track["y2"] = xyxy[:, 3]
+
+    def _associate(self, tracks, detections, min_iou):
+        """(track indices, detection indices) of the matched pairs"""
+
+        if not len(tracks) or not len(detections):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        iou = box_iou(self._boxes()[tracks], _xyxy(_cxcywh(detections)))
+        if self.class_aware:
+            iou[self.track["cls"][tracks][:, None] != detections["cls"][None, :]] = 0
+        rows, cols = match(1 - iou, 1 - min_iou)
+        return tracks[rows], cols
+
+    def predict(self, frame_id):
+        """Moves every track to frame_id, returns the confirmed tracks still being seen at their predicted boxes"""
+
+        steps = 1 if self.frame_id is None else max(frame_id - self.frame_id, 1)
+        self.frame_id = frame_id
+        if len(self.track):
+            self.mean, self.covariance = self.kalman.predict(
+                self.mean, self.covariance, steps
+            )
+            # boxes can not shrink below a pixel however the size velocity goes
+            self.mean[:, 2:4] = np.maximum(self.mean[:, 2:4], 1)
+            self.since_update += steps
+            self._keep(self.since_update <= self.max_age)
+            self._sync_boxes()
+        self.new_tracks = EMPTY_TRACKS
+        return self.tracks()
+
+    def update(self, detections):
+        """Matches a detected frame's detections (after predict for that frame), returns the confirmed tracks they matched"""
+
+        detections = detections[detections["conf"] >= self.low_thresh]
+        high = detections["conf"] >= self.high_thresh
+        high_index = np.flatnonzero(high)
+        low_index = np.flatnonzero(~high)
+
+        tracks = np.arange(len(self.track))
+        first_tracks, first_cols = self._associate(
+            tracks, detections[high_index], self.match_iou
+        )
+        matched_tracks = [first_tracks]
+        matched_detections = [high_index[first_cols]]
+
+        # only tracks that were seen on the last detected frame get the low confidence detections
+        left = np.setdiff1d(tracks[self.matched & self.confirmed], first_tracks)
+        second_tracks, second_cols = self._associate(
+            left, detections[low_index], self.low_match_iou
+        )
+        matched_tracks.append(second_tracks)
+        matched_detections.append(low_index[second_cols])
+
+        matched_tracks = np.concatenate(matched_tracks)
+        matched_detections = np.concatenate(matched_detections)
+        if len(matched_tracks):
+            matched = detections[matched_detections]
+            (
+                self.mean[matched_tracks],
+                self.covariance[matched_tracks],
+            ) = self.kalman.update(
+                self.mean[matched_tracks],
+                self.covariance[matched_tracks],
+                _cxcywh(matched),
+            )
+            self.track["conf"][matched_tracks] = matched["conf"]
+            self.since_update[matched_tracks] = 0
+
+        newly_confirmed = np.zeros(len(self.track), dtype=bool)
+        newly_confirmed[matched_tracks] = ~self.confirmed[matched_tracks]
+        self.matched[:] = False
+        self.matched[matched_tracks] = True
+        self.confirmed[matched_tracks] = True
+        # a tentative track that misses its second detected frame was noise
+        keep = self.confirmed.copy()
+        self._keep(keep)
+        self._sync_boxes()
+        self.new_tracks = self.track[newly_confirmed[keep]]
+        self.tracks_confirmed += len(self.new_tracks)
+
+        unmatched = np.setdiff1d(high_index, matched_detections)
+        self._start(
+            detections[
+                unmatched[detections["conf"][unmatched] >= self.new_track_thresh]
+            ]
+        )
+        return self.tracks()
+
+    def _start(self, detections):
+        if not len(detections):
+            return
+        mean, covariance = self.kalman.initiate(_cxcywh(detections))
+        track = np.zeros(len(detections), dtype=TRACK_DTYPE)
+        for field in DETECTION_DTYPE.names:
+            track[field] = detections[field]
+        track["track_id"] = np.arange(self.next_id, self.next_id + len(detections))
+        self.next_id += len(detections)
+        self.tracks_started += len(detections)
+
+        self.mean = np.concatenate([self.mean, mean])
+        self.covariance = np.concatenate([self.covariance, covariance])
+        self.track = np.concatenate([self.track, track])
+        self.confirmed = np.concatenate(
+            [self.confirmed, np.zeros(len(detections), dtype=bool)]
+        )
+        self.since_update = np.concatenate(
+            [self.since_update, np.zeros(len(detections), dtype=np.int64)]
+        )
+        self.matched = np.concatenate(
+            [self.matched, np.ones(len(detections), dtype=bool)]
+        )
+
+    def tracks(self):
+        """Confirmed tracks matched on the last detected frame, as a TRACK_DTYPE array"""
+
+        return self.track[self.confirmed & self.matched]
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from darkcyan.constants import DEFAULT_CONFIG_DIR
+
+DEFAULT_WARMUP_PASSES_DIR = DEFAULT_CONFIG_DIR / "warmup_passes"
+MAX_WARMUP_PASSES = 3
+# a pass this close to the last one is considered steady state
+STEADY_STATE_RATIO = 1.5
+
+
+def warmup_key(model_path, imgsz, device):
+    """Identifies a warm-up by model file (path, size and mtime), input size, device and ultralytics version"""
+
+    try:
+        import ultralytics
+
+        version = ultralytics.__version__
+    except Exception:
+        version = "unknown"
+    path = Path(model_path).resolve()
+    try:
+        stat = path.stat()
+        # .mlpackage and saved-model exports are directories, their mtime changes when they are replaced
+        file_id = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        file_id = (0, 0)
+    key = json.dumps([path.as_posix(), *file_id, list(imgsz), str(device), version])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def passes_to_steady_state(timings_ms):
+    """Warm-up passes needed before a prediction ran at the speed of the last pass, at least the first one"""
+
+    if not timings_ms:
+        return MAX_WARMUP_PASSES
+    steady = timings_ms[-1]
+    for i, timing in enumerate(timings_ms):
+        if timing <= steady * STEADY_STATE_RATIO:
+            return max(i, 1)
+    return len(timings_ms)
+
+
+class WarmupPasses:
+    """Remembers, per model file and input size, how many warm-up passes a previous start needed.
+
+    This is not a cache of the compiled model.  The backends keep their compiled state in process
+    (CoreML compiles the package, torch picks its kernels), so the first and most expensive pass
+    runs on every start.  Only the extra serial passes after it are saved once a start has shown
+    they aren't needed.
+    """
+
+    def __init__(self, record_dir=DEFAULT_WARMUP_PASSES_DIR):
+        self.record_dir = Path(record_dir)
+        self.logger = logging.getLogger(__name__)
+
+    def _path(self, key):
+        return self.record_dir / f"{key}.json"
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, record):
+        try:
+            os.makedirs(self.record_dir, exist_ok=True)
+            # several source processes can warm the same model at once, each replaces the file atomically
+            tmp_path = self._path(key).with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, indent=4)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            self.logger.info(
+                f"Unable to write warm-up pass counts to {self.record_dir}: {e}"
+            )
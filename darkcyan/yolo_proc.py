@@ -1,6 +1,6 @@
 import logging,logging.handlers
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import traceback
 import ast
 from threading import Thread
@@ -13,6 +13,21 @@ from sys import platform
 import time
 
 from darkcyan_utils.FPS import FPS
+from darkcyan.frame_ring import FrameRing
+from darkcyan.event_ring import EventRing
+from darkcyan.capture import create_capture
+from darkcyan.preprocess import LetterboxResizer, image_area
+from darkcyan.pyramid import PyramidBuilder, draw_levels
+from darkcyan.motion_gate import MotionGate
+from darkcyan.tracker import Tracker
+from darkcyan.zones import ZoneEngine
+from darkcyan.stage_timing import StageRecorder, StageTimer, combine_recorders
+from darkcyan.latency import LatencyHistograms
+from darkcyan.status_block import STATE_INITIALISING, STATE_RESTARTING, STATE_STOPPED, StatusBlock
+from darkcyan.supervisor import Backoff, wait_unless_stopped
+from darkcyan.notify import NullNotifier, create_notifier
+from darkcyan.warmup_passes import DEFAULT_WARMUP_PASSES_DIR, MAX_WARMUP_PASSES, WarmupPasses, passes_to_steady_state, warmup_key
+from darkcyan.detections import EMPTY_DETECTIONS, class_name_lookup, concat_detections, detections_from_result, draw_detections
 
 import darkcyan_utils.SignalMonitor as SignalMonitor
 
@@ -28,6 +43,12 @@ import contextlib
 
 from ultralytics import YOLO
 
+DEFAULT_MODEL_PATH = '/Users/chris/developer/darkcyan_data/engines/det/yolov11_5.0_large-det.mlpackage'
+DEFAULT_MODEL_IMGSZ = (640, 480)
+
+# What the capture thread hands the inference thread.  queued_at is a perf_counter() stamp for the queue wait timing
+CapturedFrame = namedtuple("CapturedFrame", ["original", "resized", "capture_ts", "letterbox", "frame_id", "queued_at", "levels"])
+
 
 class Profile(contextlib.ContextDecorator):
     def __init__(self, t=0.0):
@@ -48,22 +69,38 @@ class Profile(contextlib.ContextDecorator):
         
 class DarkCyanVideoSource:
 
-    def __init__(self, logging_queue, source_name, source_path, source_fps, output_image_queue, model_imgsz, keep_running):
+    def __init__(self, logging_queue, source_name, source_path, status_block, output_image_queue, model_imgsz, keep_running, capture_backend=None, capture_options=None, skip_when_queued=2, stage_recorder=None, drop_frames=True, pyramid_widths=None):
         
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
                 
         self.source_name = source_name
         self.source_path = source_path        
-       
+        self.capture_backend = capture_backend
+        self.capture_options = capture_options
+        # Once this many frames are waiting for the inference thread we only grab(), never decode
+        self.skip_when_queued = skip_when_queued
+        self.skipped_frames = 0
+        self.stream = None
+        # drop_frames=False makes the capture wait for the inference thread instead, replays use it to process every frame
+        self.drop_frames = drop_frames
+        self.stage_recorder = stage_recorder or StageRecorder()
+        self.frame_id = 0
+
         self.output_image_queue = output_image_queue
         self.model_imgsz = model_imgsz
+        # Enough buffers to cover everything queued plus the frame being inferred and the one being written
+        self.resizer = LetterboxResizer(model_imgsz, pool_size=output_image_queue.maxsize + 3)
+        # display / thumbnail levels built once here, None when nothing reads them
+        self.pyramid = PyramidBuilder(pyramid_widths, pool_size=output_image_queue.maxsize + 3) if pyramid_widths else None
 
-        self.source_fps = source_fps
+        # StatusBlock the source fps is reported in, may be None
+        self.status_block = status_block
         self.fps = FPS()
 
         self.keep_running = keep_running
         self.stopped = False
+        self.started_at = None
 
         self.logger.debug('DarkCyanVideoStream created')
         
@@ -74,17 +111,12 @@ class DarkCyanVideoSource:
 
         self.logger.info(f"Starting {self.source_name} FVS Capture")
         
-        if platform == "linux" or platform == "linux2":
-            self.stream = cv2.VideoCapture(self.source_path, cv2.CAP_GSTREAMER)
-            self.logger.info(f"Initialised {self.source_name} FVS Capture on Linux using Gstreamer")
-
-        elif platform == "darwin":
-
-            self.stream = cv2.VideoCapture(self.source_path, cv2.CAP_GSTREAMER)
-            self.logger.info(f"Initialised {self.source_name} FVS Capture on MacOS using Gstreamer")
-        else:
-            self.logger.info(f"Initialised {self.source_name} FVS Capture on {platform}")
-            self.stream = cv2.VideoCapture(self.source_path)
+        self.stream = create_capture(self.source_path, self.capture_backend, self.capture_options)
+        if(not self.stream.open()):
+            self.logger.info(f"{self.source_name} unable to open {self.stream} on {platform}")
+            self.stop()
+            return
+        self.logger.info(f"Initialised {self.source_name} FVS Capture on {platform} using {self.stream}")
 
         # check the first frame
         (grabbed, frame) = self.stream.read()
@@ -94,15 +126,19 @@ class DarkCyanVideoSource:
             self.stop()
             return
 
-        self.logger.info(f"{self.source_name} first frame size: {frame.shape}")
-        frame = cv2.resize(frame, (self.model_imgsz[1],self.model_imgsz[0]), interpolation = cv2.INTER_AREA)
+        self.logger.info(f"{self.source_name} first frame size: {frame.shape}, letterboxed into {self.model_imgsz} as {self.resizer(frame)[1]}")
+        if(self.status_block is not None):
+            # the supervisor sizes this source's frame rings from it
+            self.status_block.set_frame_shape(frame.shape)
 
         self.fps.start()
         failure_count = 0
         while not self.stopped and self.keep_running.value and failure_count < 25:
             frame_reader_pf = Profile()
+            read_start = time.perf_counter()
             with frame_reader_pf:
-                (grabbed, original_frame) = self.stream.read()
+                grabbed = self.stream.grab()
+            capture_ts = time.time()
             
             if(frame_reader_pf.t>1):
                 self.logger.info(f"Frame reader for {self.source_name} took {frame_reader_pf.t} seconds, more than expected.  We will continue")
@@ -112,34 +148,62 @@ class DarkCyanVideoSource:
                 failure_count += 1
                 continue
             failure_count = 0
+            self.frame_id += 1
             self.fps.update()
-            self.source_fps.value = self.fps.fps()
+            if(self.status_block is not None):
+                self.status_block.set_source_fps(self.fps.fps())
+
+            if(self.drop_frames and self.output_image_queue.qsize() >= self.skip_when_queued):
+                # The inference thread is behind, this frame would only be dropped later so don't decode it
+                self.skipped_frames += 1
+                continue
+
+            (retrieved, original_frame) = self.stream.retrieve()
+            if not retrieved:
+                failure_count += 1
+                continue
+            timer = StageTimer(self.stage_recorder, self.frame_id, start=read_start)
+            timer.mark("read")
             try:
                 # We do the resizing / prep in this thread to improve performace on the inference thread (it's more computationally expensive)
-                resized_frame = cv2.resize(original_frame, (self.model_imgsz[1],self.model_imgsz[0]), interpolation = cv2.INTER_AREA)                
-                            
+                resized_frame, letterbox = self.resizer(original_frame)
+                levels = self.pyramid(original_frame) if self.pyramid is not None else None
+
             except:
                 traceback.print_exc()
                 continue
-            
+            queued_at = timer.mark("resize")
+
+            captured_frame = CapturedFrame(original_frame, resized_frame, capture_ts, letterbox, self.frame_id, queued_at, levels)
+            if(not self.drop_frames):
+                while not self.stopped and self.keep_running.value:
+                    try:
+                        self.output_image_queue.put(captured_frame, timeout=1)
+                        break
+                    except Full:
+                        continue
+                continue
+
             # Check if the queue is full, if so take the oldest item and add this
             if(self.output_image_queue.full()):
                 try:
                     self.output_image_queue.get_nowait()
+                    self.output_image_queue.task_done()
                 except Empty:
                     self.logger.info(f"Unexpected non-fatal race condition for {self.source_name}, we took long enough to clear a space that the infer thread got there")
 
-            q_pf = Profile()
-            
-            self.output_image_queue.put((original_frame, resized_frame))
+            self.output_image_queue.put(captured_frame)
                     
     
         self.fps.stop()  
+        # the capture has ended, let run() know
+        self.stopped = True
 
-        self.logger.info(f'{self.source_name} FVS ended (failure count: {failure_count})  Stream read approx. FPS: {self.fps.fps():.2f}')     
+        self.logger.info(f'{self.source_name} FVS ended (failure count: {failure_count})  Stream read approx. FPS: {self.fps.fps():.2f}, {self.skipped_frames} frames grabbed but not decoded')     
 
     def start(self):
         # start a thread to read frames from the file video stream
+        self.started_at = time.time()
         t = Thread(target=self.update, args=())
         t.daemon = True
         t.start()
@@ -150,60 +214,144 @@ class DarkCyanVideoSource:
         self.logger.info(f'{self.source_name} FVS stop called')         
         self.stopped = True    
         time.sleep(1)    
-        self.stream.release()
+        if(self.stream is not None):
+            self.stream.release()
         cv2.destroyAllWindows()
 
+    def restart(self):
+        # reopen the source on a new thread, the frame ids and resize buffers carry on from the last run
+        self.stopped = False
+        return self.start()
+
+
+def restart_capture(logger, image_stream, backoff, keep_running, status_block=None):
+    """Restarts a capture that has ended once its backoff delay has passed, False if keep_running was cleared meanwhile"""
+
+    delay = backoff.failed(image_stream.started_at)
+    logger.info(f"{image_stream.source_name} capture ended, restarting in {delay:.1f}s")
+    if(status_block is not None):
+        status_block.set_state(STATE_RESTARTING)
+    image_stream.stop()
+    if not wait_unless_stopped(keep_running, delay):
+        return False
+    image_stream.restart()
+    if(status_block is not None):
+        status_block.set_state(STATE_INITIALISING)
+    return True
+
+def inference_device(logger):
+    if(platform=="darwin"):
+        logger.info('Enabling MPS support for macOS')
+        return 'mps'
+    return '0'
+
+
+def load_model(logger, model_path=DEFAULT_MODEL_PATH, imgsz=DEFAULT_MODEL_IMGSZ, device=None, warmup_passes=None):
+    """Load the detection model and run the warm-up passes, returns None if the model can't run
+
+    The first pass, where the backend compiles the model, always runs.  With WarmupPasses the extra
+    passes are cut to what the last start needed to reach steady state.
+    """
+
+    model = YOLO(model_path, task='detect', verbose=False)
+
+    key = warmup_key(model_path, imgsz, device) if warmup_passes is not None else None
+    remembered = warmup_passes.get(key) if warmup_passes is not None else None
+    passes = remembered["passes"] if remembered else MAX_WARMUP_PASSES
+
+    logger.debug(f'Warming yolo detection engine for image size: {imgsz}, {passes} passes{" (remembered)" if remembered else ""}')
+    detection_engine_pf = Profile()
+
+    test_img = np.random.randint(low=0, high=255, size=(imgsz[0], imgsz[1], 3), dtype='uint8')
+    with detection_engine_pf:
+        try:
+            list(model.predict(source=test_img, imgsz=imgsz, device=device, conf=0.4, stream=True, verbose=False))
+        except:
+            logger.debug (f"Failed first warmup :{detection_engine_pf.dt * 1E3:.1f}ms")
+            traceback.print_exc()
+            return None
+    logger.debug (f"*First* warmup completed in :{detection_engine_pf.dt * 1E3:.1f}ms")
+    timings_ms = [detection_engine_pf.dt * 1E3]
+
+    for i in range(1, passes):
+        with detection_engine_pf:
+            model.predict(source=test_img, device=device, conf=0.4, iou=0.45, verbose=False)
+        logger.debug (f"Warmup {i + 1} completed in :{detection_engine_pf.dt * 1E3:.1f}ms")
+        timings_ms.append(detection_engine_pf.dt * 1E3)
+
+    if warmup_passes is not None and not remembered:
+        warmup_passes.put(key, {"model_path": str(model_path), "imgsz": list(imgsz), "device": str(device), "timings_ms": timings_ms, "passes": passes_to_steady_state(timings_ms)})
+
+    return model
+
+
+def gate_image(captured_frame):
+    # the smallest pyramid level is nearly the motion gate's thumbnail already, without one the model input less its padding
+    if(captured_frame.levels):
+        return min(captured_frame.levels.values(), key=lambda level: level.shape[1])
+    return image_area(captured_frame.resized, captured_frame.letterbox)
+
+
 class DarkCyanObjectDetection(object):
 
-    def __init__(self, logging_queue, source_key, source_name, inference_fps, image_source_queue, infer_shared_memory, buffer_lock, status_shared_memory, results_queue, keep_running) -> None:
+    def __init__(self, logging_queue, source_key, source_name, image_source_queue, frame_ring, status_block, event_ring, keep_running, model_path=DEFAULT_MODEL_PATH, imgsz=DEFAULT_MODEL_IMGSZ, motion_gate=None, stage_recorder=None, warmup_passes=None, started_at=None, notifier=None, source_id=0, zone_engine=None, tracker=None, detect_interval=1, pyramid_rings=None) -> None:
         
         
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
         self.source_key = source_key
         self.source_name = source_name
-        self.fps_feedback = inference_fps
         self.fps = FPS()
         self.stopped = False
-        self.infer_shared_memory = infer_shared_memory
-        self.status_shared_memory = status_shared_memory
+        self.frame_ring = frame_ring
+        # {level: FrameRing} for the pyramid levels the capture builds besides the full frame
+        self.pyramid_rings = pyramid_rings or {}
+        self.status_block = status_block
+        self.inference_ms = 0.0
         self.keep_running = keep_running
-        self.buffer_lock = buffer_lock
-        self.results_queue = results_queue
-        self.imgsz = (640,480)
-
-        if(platform=="darwin"):
-            self.device='mps'
-            self.logger.info('Enabling MPS support for macOS')         
-        else:
-            self.device='0'
-
-        self.model = YOLO('/Users/chris/developer/darkcyan_data/engines/det/yolov11_5.0_large-det.mlpackage', task='detect', verbose=False)
-        
-        self.logger.debug('Warming yolo detection engine for image size: ' + str(self.imgsz))
-        detection_engine_pf = Profile()
-
-        test_img = np.random.randint(low=0, high=255, size=(640, 480, 3), dtype='uint8')
-        with detection_engine_pf:
-            try:
-                results = self.model.predict(source=test_img, imgsz=(640,480), device=self.device, conf=0.4, stream=True, verbose=False)                    
-            except:
-                self.logger.debug (f"Failed first warmup :{detection_engine_pf.dt * 1E3:.1f}ms")
-
-                traceback.print_exc()
-                self.stop()
-        self.logger.debug (f"*First* warmup completed in :{detection_engine_pf.dt * 1E3:.1f}ms")
-        with detection_engine_pf:
-            results = self.model.predict(source=test_img, device=self.device, conf=0.4, iou=0.45)                    
-        self.logger.debug (f"Second warmup completed in :{detection_engine_pf.dt * 1E3:.1f}ms")
-
-        with detection_engine_pf:
-            results = self.model.predict(source=test_img, device=self.device, conf=0.4, iou=0.45)                    
-        self.logger.debug (f"Third warmup completed in :{detection_engine_pf.dt * 1E3:.1f}ms")        
+        # EventRing the detections are published to, may be None
+        self.event_ring = event_ring
+        self.source_id = source_id
+        # ZoneEngine tagging published detections with the zones they are in, may be None
+        self.zone_engine = zone_engine
+        # Tracker giving detections persistent ids and predicting them on frames the detector skips, may be None
+        self.tracker = tracker
+        # with a tracker the detector only needs to run every detect_interval frames
+        self.detect_interval = detect_interval if tracker is not None else 1
+        self.last_detected_frame_id = None
+        # low confidence boxes are what the tracker's second association pass feeds on
+        self.conf = min(0.4, tracker.low_thresh) if tracker is not None else 0.4
+        self.imgsz = imgsz
+        self.motion_gate = motion_gate
+        self.last_detections = EMPTY_DETECTIONS
+        self.stage_recorder = stage_recorder or StageRecorder()
+        self.device = inference_device(self.logger)
+        self.model_path = model_path
+        self.warmup_passes = warmup_passes
+        self.model = None
+        # time-to-first-detection is measured from here, the source process start when run() passes it
+        self.started_at = time.time() if started_at is None else started_at
+        self.first_detection_s = None
+        # wakes the supervisor once a frame (and any results) are published
+        self.notifier = notifier or NullNotifier()
 
         self.image_source_queue = image_source_queue
 
+    def load(self):
+        # runs on the inference thread, so the capture is connecting and reading while the model loads and warms up
+        self.model = load_model(self.logger, self.model_path, self.imgsz, self.device, self.warmup_passes)
+        if self.model is None:
+            return False
+        self.class_names = class_name_lookup(self.model.names)
+        self.status_block.set_class_names(self.model.names)
+        self.logger.info(f"{self.source_name} model ready {time.time() - self.started_at:.2f}s after start")
+        return True
+
     def infer(self):
+        if not self.load():
+            self.stop()
+            return
+
         # keep looping infinitely
         self.fps.start()
         time_since_last_image = time.time()        
@@ -213,99 +361,76 @@ class DarkCyanObjectDetection(object):
             try:
                 
                 ## If we don't get an image on one of the queues for 15 seconds, exit.  This is a weird state / we should always have images from all queues at this point
-                ( original_frame, inference_img ) = self.image_source_queue.get(timeout=15)
+                captured_frame = self.image_source_queue.get(timeout=15)
+                timer = StageTimer(self.stage_recorder, captured_frame.frame_id)
+                self.stage_recorder.record(captured_frame.frame_id, "queue_wait", timer.last - captured_frame.queued_at)
+                ( original_frame, inference_img, capture_ts, letterbox ) = captured_frame[:4]
                 
                 if(time.time() - time_since_last_image > 10):
-                    self.logger.error(f"Inference has not received an image in over 15 seconds.  Exiting")
-                    self.stop()
-                    break
+                    # the capture was restarted, the model stayed loaded so just carry on
+                    self.logger.info(f"Inference for {self.source_name} resumed after {time.time() - time_since_last_image:.1f}s without images")
 
                 time_since_last_image = time.time()
                  
-                orig_h,orig_w,orig_d = original_frame.shape
-                #h,w = image_raw.shape
-
-                results = self.model.predict(source=inference_img, device=self.device, conf=0.4, iou=0.45, stream=True, verbose=False)    
-                                
-                self.fps_feedback.value = self.fps.fps()               
-
-                result_boxes = []
-                result_scores = []
-                result_classid = []
-                result_categories = []
-                
-
-                for result in results:
-
-                    if(not result.boxes.xyxy.nelement()):                        
-                        continue
-                    else:
-                        boxes = result.boxes.xyxy.cpu()
-                        confs = result.boxes.conf.cpu()
-                        cls_ints = result.boxes.cls.cpu()
-                        for box, conf, cls_int in zip(boxes, confs, cls_ints):
-                            x1, y1, x2, y2 = box
-                            cls_int = cls_int.int().item()
-                            
-                            w_ratio = orig_w / inference_img.shape[1]
-                            h_ratio = orig_h / inference_img.shape[0]
-                            xyxy=[0,0,0,0]
-                            xyxy[0] = (x1*w_ratio).int().item()
-                            xyxy[2] = (x2*w_ratio).int().item()
-                            xyxy[1] = (y1*h_ratio).int().item()
-                            xyxy[3] = (y2*h_ratio).int().item()
-                            
-                            result_boxes.append(xyxy)
-
-                            result_scores.append(conf.item())
-                            result_classid.append(cls_int)
-                            if(self.model.names==None):                                
-                                category = f'class{cls_int}'
-                            else:                                        
-                                category = self.model.names[cls_int]
-                                                            
-                            result_categories.append(category)
-
-                            original_frame = cv2.rectangle(original_frame, (xyxy[0], xyxy[1] ), (xyxy[2], xyxy[3]), (0, 255, 0), 1)
-
-                if(len(result_categories))>0:                                                      
-                    status = f'{self.source_name} can see {result_categories}'
+                if(self.tracker is not None):
+                    self.tracker.predict(captured_frame.frame_id)
+                interval_skip = self.last_detected_frame_id is not None and captured_frame.frame_id - self.last_detected_frame_id < self.detect_interval
+
+                if(interval_skip or (self.motion_gate is not None and not self.motion_gate.should_infer(gate_image(captured_frame)))):
+                    # Nothing has moved or it is not a detection frame, the tracks (or last detections) still describe the scene
+                    detections = self.tracker.tracks() if self.tracker is not None else self.last_detections
+                    fresh_detections = False
+                    timer.skip()
                 else:
-                    status = f'{self.source_name} can see nothing'
-
-                self.status_shared_memory.buf[:len(status)] = status.encode('utf-8')
-                self.status_shared_memory.buf[99] = len(status)
+                    timer.skip()
+                    predict_start = timer.last
+                    results = self.model.predict(source=inference_img, device=self.device, conf=self.conf, iou=0.45, verbose=False)
+                    self.inference_ms = (timer.mark("predict") - predict_start) * 1e3
+                    detections = concat_detections(detections_from_result(result, letterbox) for result in results)
+                    if(self.tracker is not None):
+                        detections = self.tracker.update(detections)
+                    self.last_detections = detections
+                    self.last_detected_frame_id = captured_frame.frame_id
+                    fresh_detections = True
+                    if(self.first_detection_s is None):
+                        self.first_detection_s = time.time() - self.started_at
+                        self.status_block.set_first_detection(self.first_detection_s)
+                        self.logger.info(f"{self.source_name} time to first detection: {self.first_detection_s:.2f}s")
+
+                timer.mark("postprocess")
+                draw_detections(original_frame, detections)
+                if(captured_frame.levels):
+                    draw_levels(captured_frame.levels, detections, original_frame.shape)
+                timer.mark("draw")
+
+                self.status_block.publish(captured_frame.frame_id, detections["cls"], self.fps.fps(), self.inference_ms)
 
                 output_frame = original_frame
-                locked = self.buffer_lock.acquire(block=False)
-                if(not locked):
-                    self.logger.debug("[WARN] Buffer lock is held, not writing results to shared memory")
-                else:                                                  
-                    shm_arr = np.ndarray(output_frame.shape, dtype=output_frame.dtype, buffer=self.infer_shared_memory.buf)
-                    shm_arr[:] = output_frame[:]
-                    self.buffer_lock.release()
-
-                if(len(result_categories)>0):
-                        try:
-                            if(self.results_queue.full()):
-                                self.logger.debug("[WARN] Results queue is full, clearing some space")
-                                self.results_queue.get(block=False)
-                            self.results_queue.put(( self.source_key, result_categories, result_boxes ), block=False )
-                            self.logger.debug(f"Added {result_categories} to results queue")
-                        except Full:
-                            self.logger.debug("[WARN] Not able to add to the results queue, continuing.  This is wholly unexpected")
-                                            
+                if(self.frame_ring.write(output_frame, capture_ts) is None):
+                    self.logger.debug(f"[WARN] Frame {output_frame.shape} does not fit the {self.frame_ring.slot_bytes} byte frame ring slots, not writing results to shared memory")
+                if(captured_frame.levels):
+                    # the smaller levels side by side with the full frame, consumers read whichever they need
+                    for level, ring in self.pyramid_rings.items():
+                        if level in captured_frame.levels:
+                            ring.write(captured_frame.levels[level], capture_ts)
+                timer.mark("shm_write")
+                self.stage_recorder.record(captured_frame.frame_id, "end_to_end", time.time() - capture_ts)
+
+                if(fresh_detections and self.event_ring is not None):
+                    # tracked sources publish each object once, when its track is confirmed
+                    events = self.tracker.new_tracks if self.tracker is not None else detections
+                    zones = self.zone_engine.classify(events, original_frame.shape[1], original_frame.shape[0]) if self.zone_engine is not None else None
+                    self.event_ring.publish(self.source_id, captured_frame.frame_id, events, capture_ts, zones)
+                self.notifier.notify()
 
                 self.fps.update()                           
+                self.image_source_queue.task_done()
                 
 
             except Empty:
-                self.logger.debug("[WARN] No more frames to infer from after 15 seconds, exiting")
-                self.stop()
+                # run() restarts a failed capture while we wait here with the model warm
+                self.logger.debug(f"[WARN] No frames to infer from for {self.source_name} in 15 seconds, still waiting")
                 
-            except Full:
-                self.logger.debug("[WARN] Not able to add to the results queue, continuing.  This is wholly unexpected")
-                continue
             except:    
                 traceback.print_exc()
                 self.stop()
@@ -313,6 +438,12 @@ class DarkCyanObjectDetection(object):
         
         self.fps.stop()
         self.logger.debug("[INFO] infer approx. FPS: {:.2f}".format(self.fps.fps()))    
+        if(self.event_ring is not None and self.event_ring.overflow):
+            self.logger.info(f"{self.source_name} event ring overflowed, {self.event_ring.overflow} detection events not published")
+        if(self.motion_gate is not None):
+            self.logger.info(f"{self.source_name} motion gate skipped {self.motion_gate.skipped_ratio():.1%} of frames")
+        if(self.tracker is not None):
+            self.logger.info(f"{self.source_name} tracker confirmed {self.tracker.tracks_confirmed} of {self.tracker.tracks_started} tracks started")
 
 
     def start(self):
@@ -328,28 +459,123 @@ class DarkCyanObjectDetection(object):
         self.stopped = True    
         time.sleep(1)    
 
-def run(logging_queue, source_key, source_name, source_path, buffer_lock, source_fps, inference_fps, infer_shared_memory, status_shared_memory, results_queue, keep_running):
+def run(logging_queue, source_key, source_name, source_path, infer_shared_memory, status_shared_memory, event_shared_memory, keep_running, model_path=DEFAULT_MODEL_PATH, motion_gate=None, capture_backend=None, capture_options=None, stage_recorder=None, drop_frames=True, latency_shared_memory=None, warmup_passes_dir=DEFAULT_WARMUP_PASSES_DIR, max_capture_restarts=None, notify_connection=None, source_id=0, zone_config=None, tracker_config=None, pyramid_shared_memory=None, pyramid_widths=None):
+    """One source, capture and inference.  A capture that fails is restarted with backoff (at most max_capture_restarts
+    times, None for no limit) while the inference thread keeps its model loaded."""
+
+    started_at = time.time()
 
     qh = logging.handlers.QueueHandler(logging_queue)
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
     logger.addHandler(qh)
 
+    if(latency_shared_memory is not None):
+        stage_recorder = combine_recorders(stage_recorder, LatencyHistograms(latency_shared_memory))
+
+    status_block = StatusBlock(status_shared_memory)
     output_image_queue = Queue(5)
-    image_stream = DarkCyanVideoSource(logging_queue, source_name, source_path, source_fps, output_image_queue, (640,480), keep_running)
+    # only the levels there are rings for are built
+    pyramid_rings = {level: FrameRing(shm) for level, shm in (pyramid_shared_memory or {}).items()}
+    pyramid_widths = {level: width for level, width in (pyramid_widths or {}).items() if level in pyramid_rings}
+    image_stream = DarkCyanVideoSource(logging_queue, source_name, source_path, status_block, output_image_queue, DEFAULT_MODEL_IMGSZ, keep_running, capture_backend, capture_options, stage_recorder=stage_recorder, drop_frames=drop_frames, pyramid_widths=pyramid_widths)
 
 
     image_stream.start()    
-    inference_engine = DarkCyanObjectDetection(logging_queue, source_key, source_name, inference_fps, output_image_queue, infer_shared_memory, buffer_lock, status_shared_memory, results_queue, keep_running)
+    frame_ring = FrameRing(infer_shared_memory)
+    event_ring = EventRing(event_shared_memory) if event_shared_memory is not None else None
+    gate = MotionGate.from_config(motion_gate)
+    if(gate is not None):
+        logger.info(f"{source_name} inference gated by {gate}")
+    zone_engine = ZoneEngine.from_config(zone_config)
+    if(zone_engine is not None):
+        logger.info(f"{source_name} detections tagged by {zone_engine}")
+    tracker = Tracker.from_config(tracker_config)
+    detect_interval = tracker_config.get("detect_interval", 1) if tracker is not None else 1
+    if(tracker is not None):
+        logger.info(f"{source_name} detections tracked by {tracker}, detecting every {detect_interval} frames")
+    inference_engine = DarkCyanObjectDetection(logging_queue, source_key, source_name, output_image_queue, frame_ring, status_block, event_ring, keep_running, model_path=model_path, motion_gate=gate, stage_recorder=stage_recorder, warmup_passes=WarmupPasses(warmup_passes_dir) if warmup_passes_dir else None, started_at=started_at, notifier=create_notifier(notify_connection), source_id=source_id, zone_engine=zone_engine, tracker=tracker, detect_interval=detect_interval, pyramid_rings=pyramid_rings)
 
     inference_engine.start()
+    capture_backoff = Backoff()
+    capture_restarts = 0
     try:
-        while( keep_running.value and not image_stream.stopped and not inference_engine.stopped ):
-            time.sleep(1)
+        while( keep_running.value and not inference_engine.stopped ):
+            if(not image_stream.stopped):
+                time.sleep(1)
+                continue
+            if(output_image_queue.unfinished_tasks):
+                # let the inference thread finish what the capture queued before it ended, including the frame it is on
+                time.sleep(0.1)
+                continue
+            if(max_capture_restarts is not None and capture_restarts >= max_capture_restarts):
+                break
+            if(not restart_capture(logger, image_stream, capture_backoff, keep_running, status_block)):
+                break
+            capture_restarts += 1
     except:
         pass
     keep_running.value = False
+    status_block.set_state(STATE_STOPPED)
     image_stream.stop()
     inference_engine.stop()
 
 
+def run_capture(logging_queue, source_key, source_name, source_path, input_shared_memory, capture_shared_memory, status_shared_memory, keep_running, imgsz=DEFAULT_MODEL_IMGSZ, motion_gate=None, capture_backend=None, capture_options=None, latency_shared_memory=None, max_capture_restarts=None):
+    """Capture only half of run(), used when a shared inference server does the detection.
+
+    Capture frames are published to capture_shared_memory and their letterboxed model inputs to
+    input_shared_memory (both FrameRings), the input's slot meta holding the LetterboxMeta followed by
+    the capture frame's id.  The server detects on the input and annotates and publishes the capture
+    frame.  With a motion gate, frames of a static scene are not published at all, so the server
+    neither sees nor annotates them.
+    """
+
+    qh = logging.handlers.QueueHandler(logging_queue)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(qh)
+
+    stage_recorder = LatencyHistograms(latency_shared_memory) if latency_shared_memory is not None else None
+
+    status_block = StatusBlock(status_shared_memory)
+    # a restarted capture process is no longer restarting, the server restarts its time-to-first-detection from here
+    status_block.set_state(STATE_INITIALISING)
+    output_image_queue = Queue(5)
+    image_stream = DarkCyanVideoSource(logging_queue, source_name, source_path, status_block, output_image_queue, imgsz, keep_running, capture_backend, capture_options, stage_recorder=stage_recorder)
+    image_stream.start()
+
+    input_ring = FrameRing(input_shared_memory)
+    capture_ring = FrameRing(capture_shared_memory)
+    gate = MotionGate.from_config(motion_gate)
+    if(gate is not None):
+        logger.info(f"{source_name} inference gated by {gate}")
+    capture_backoff = Backoff()
+    capture_restarts = 0
+    try:
+        while( keep_running.value ):
+            if(image_stream.stopped and output_image_queue.empty()):
+                if(max_capture_restarts is not None and capture_restarts >= max_capture_restarts):
+                    break
+                if(not restart_capture(logger, image_stream, capture_backoff, keep_running, status_block)):
+                    break
+                capture_restarts += 1
+                continue
+            try:
+                captured_frame = output_image_queue.get(timeout=1)
+            except Empty:
+                continue
+            ( original_frame, resized_frame, capture_ts, letterbox ) = captured_frame[:4]
+            # no pyramid is built here, so this gates on the model input
+            if(gate is not None and not gate.should_infer(gate_image(captured_frame))):
+                continue
+            capture_frame_id = capture_ring.write(original_frame, capture_ts)
+            if(capture_frame_id is None):
+                logger.debug(f"[WARN] {source_name} frame {original_frame.shape} does not fit the capture ring")
+                continue
+            if(input_ring.write(resized_frame, capture_ts, (*letterbox, capture_frame_id)) is None):
+                logger.debug(f"[WARN] {source_name} frame {resized_frame.shape} does not fit the inference input ring")
+    except:
+        traceback.print_exc()
+    keep_running.value = False
+    image_stream.stop()
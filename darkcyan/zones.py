@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+
+MAX_ZONES = 32
+
+ANCHORS = ("bottom_center", "center")
+
+
+class ZoneMasks:
+    """A camera's zones rasterised for one frame size.
+
+    bits holds one bit per zone for every mask pixel (zones may overlap), integrals the per-zone
+    integral images used for box overlap fractions.  The masks are at most max_width wide, box
+    coordinates are scaled down to them, which is plenty for zones drawn by hand.
+    """
+
+    def __init__(self, polygons, width, height, max_width=640):
+        self.width = width
+        self.height = height
+        self.scale = min(1.0, max_width / width)
+        self.mask_width = max(1, round(width * self.scale))
+        self.mask_height = max(1, round(height * self.scale))
+
+        self.bits = np.zeros((self.mask_height, self.mask_width), dtype=np.uint32)
+        self.integrals = np.zeros(
+            (len(polygons), self.mask_height + 1, self.mask_width + 1), dtype=np.int32
+        )
+        size = np.array([self.mask_width, self.mask_height], dtype=np.float32)
+        mask = np.zeros((self.mask_height, self.mask_width), dtype=np.uint8)
+        for i, polygon in enumerate(polygons):
+            mask[:] = 0
+            cv2.fillPoly(
+                mask,
+                [
+                    np.round(np.asarray(polygon, dtype=np.float32) * size).astype(
+                        np.int32
+                    )
+                ],
+                1,
+            )
+            self.bits |= mask.astype(np.uint32) << np.uint32(i)
+            cv2.integral(mask, self.integrals[i], sdepth=cv2.CV_32S)
+
+    def _scaled(self, values, limit):
+        return np.clip((values * self.scale).astype(np.int32), 0, limit)
+
+    def anchor_bits(self, detections, anchor="bottom_center"):
+        """Zone bits under each detection's anchor point, one fancy index for the whole frame"""
+
+        x = (detections["x1"] + detections["x2"]) // 2
+        if anchor == "center":
+            y = (detections["y1"] + detections["y2"]) // 2
+        else:
+            # where the object touches the ground, the usual choice for people and vehicles
+            y = detections["y2"] - 1
+        return self.bits[
+            self._scaled(y, self.mask_height - 1), self._scaled(x, self.mask_width - 1)
+        ]
+
+    def overlap_fractions(self, detections):
+        """(N, zones) fraction of each box inside each zone, four integral image lookups per box and zone"""
+
+        x1 = self._scaled(detections["x1"], self.mask_width)
+        y1 = self._scaled(detections["y1"], self.mask_height)
+        x2 = np.maximum(self._scaled(detections["x2"], self.mask_width), x1 + 1)
+        y2 = np.maximum(self._scaled(detections["y2"], self.mask_height), y1 + 1)
+        x2 = np.minimum(x2, self.mask_width)
+        y2 = np.minimum(y2, self.mask_height)
+        inside = (
+            self.integrals[:, y2, x2]
+            - self.integrals[:, y1, x2]
+            - self.integrals[:, y2, x1]
+            + self.integrals[:, y1, x1]
+        )
+        area = np.maximum((x2 - x1) * (y2 - y1), 1)
+        return (inside / area).T
+
+
+class ZoneEngine:
+    """Assigns each detection the bitmask of the camera zones it is in.
+
+    By default a detection is in a zone when its anchor point is.  With min_overlap set it is in
+    every zone covering at least that fraction of its box instead.  Masks are built once per frame
+    size and reused for every frame of that size.
+    """
+
+    def __init__(self, zones, anchor="bottom_center", min_overlap=None, max_width=640):
+        if len(zones) > MAX_ZONES:
+            raise ValueError(f"At most {MAX_ZONES} zones per camera, got {len(zones)}")
+        if anchor not in ANCHORS:
+            raise ValueError(f"Unknown zone anchor {anchor}, expected one of {ANCHORS}")
+        # {name: normalised polygon}, bit i of a detection's zones is the i'th name
+        self.names = list(zones)
+        self.polygons = [zones[name] for name in self.names]
+        self.anchor = anchor
+        self.min_overlap = min_overlap
+        self.max_width = max_width
+        self.masks = {}
+
+    def __repr__(self):
+        mode = (
+            f"overlap >= {self.min_overlap:.0%}"
+            if self.min_overlap is not None
+            else self.anchor
+        )
+        return f"ZoneEngine({self.names}, {mode})"
+
+    @staticmethod
+    def from_config(config):
+        if not config or not config.get("zones"):
+            return None
+        return ZoneEngine(
+            config["zones"],
+            config.get("anchor", "bottom_center"),
+            config.get("min_overlap"),
+            config.get("max_width", 640),
+        )
+
+    def masks_for(self, width, height):
+        key = (width, height)
+        if key not in self.masks:
+            self.masks[key] = ZoneMasks(self.polygons, width, height, self.max_width)
+        return self.masks[key]
+
+    def classify(self, detections, width, height):
+        """uint32 zone bits per detection, boxes in pixels of a width x height frame"""
+
+        if not len(detections):
+            return np.zeros(0, dtype=np.uint32)
+        masks = self.masks_for(width, height)
+        if self.min_overlap is None:
+            return masks.anchor_bits(detections, self.anchor)
+        inside = masks.overlap_fractions(detections) >= self.min_overlap
+        return (
+            inside.astype(np.uint32) << np.arange(len(self.names), dtype=np.uint32)
+        ).sum(axis=1, dtype=np.uint32)
+
+    def zone_names(self, bits):
+        return zone_names(self.names, bits)
+
+
+def zone_names(names, bits):
+    """Names of the zones set in bits, for consumers that only have the engine's names list"""
+
+    return [name for i, name in enumerate(names) if int(bits) >> i & 1]
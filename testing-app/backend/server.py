@@ -1,12 +1,15 @@
 import asyncio
+import math
+import os
 import threading
 import time
 import json
 from collections import deque
 from typing import Optional, Dict, List
-import queue
+import struct
 
 import cv2
+import numpy as np
 from fastapi import FastAPI, WebSocket, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,8 +25,10 @@ YOLO_INPUT_WIDTH = 640      # width YOLO sees
 YOLO_MIN_CONF = 0.3         # optional: filter low-confidence boxes
 
 YOLO_MODEL_PATH = "/Users/chris/Documents/developer/darkcyan_data/engines/det/yolov8_4.15_large-det.mlpackage"
-YOLO_NUM_WORKERS = 2        # try 2 first; can bump to 3–4 if stable
-JPEG_PARAMS = [int(cv2.IMWRITE_JPEG_QUALITY), 85]
+YOLO_NUM_WORKERS = 0        # shared pool size across all sources; 0 = size to the machine
+YOLO_MAX_BATCH = 0          # frames per predict call; 0 = 4 for .pt models, 1 for exports (fixed batch of 1)
+YOLO_SOURCE_WEIGHTS: Dict[str, float] = {}  # DRR quantum per source (frames per round, > 0), default 1
+JPEG_QUALITY = 85           # default tier for /ws_video clients that don't ask for one
 
 
 
@@ -43,7 +48,7 @@ logger.info(f"Using device for YOLO inference: {device}")
 class AppState:
     def __init__(self, source_fps: float = 0.0):
         self.lock = threading.Lock()
-        self.jpeg_bytes: Optional[bytes] = None
+        self.frame: Optional["EncodedFrame"] = None
         self.width = 0
         self.height = 0
         self.last_frame_ts = 0.0
@@ -56,6 +61,13 @@ class AppState:
         self.queue_delay_ms = 0.0
 
         self.detections: List[dict] = []
+        # Sequence of YOLO results (not video frames) and the capture time of the frame it came from.
+        self.yolo_seq = 0
+        self.yolo_frame_ts = 0.0
+        # Producer sequence number of the frame behind the published detections, and how many
+        # results were dropped for finishing after a newer frame's (several pool workers).
+        self.yolo_frame_seq = -1
+        self.stale_results = 0
 
         # NEW: track timestamps of YOLO-completed frames across all workers
         self._yolo_ts = deque(maxlen=60)  # last ~60 events, adjust as needed
@@ -87,18 +99,26 @@ class AppState:
             self.yolo_ms = yolo_ms
             self.queue_delay_ms = queue_delay_ms
 
-    def update_frame(self, jpeg_bytes: bytes, w: int, h: int, ts: float):
+    def update_frame(self, frame: "EncodedFrame", w: int, h: int, ts: float):
         """Latest raw video frame (no YOLO overlay)."""
         with self.lock:
-            self.jpeg_bytes = jpeg_bytes
+            self.frame = frame
             self.width = w
             self.height = h
             self.last_frame_ts = ts
             self.frame_count += 1  # count of video frames
 
-    def update_detections(self, dets: List[dict]):
+    def update_detections(self, dets: List[dict], frame_ts: float = 0.0, frame_seq: int = 0) -> bool:
+        """Publish detections unless a newer frame's are already out. Returns False for stale results."""
         with self.lock:
+            if frame_seq <= self.yolo_frame_seq:
+                self.stale_results += 1
+                return False
             self.detections = dets
+            self.yolo_seq += 1
+            self.yolo_frame_ts = frame_ts
+            self.yolo_frame_seq = frame_seq
+            return True
 
     def snapshot(self):
         with self.lock:
@@ -113,20 +133,239 @@ class AppState:
                 "yolo_ms": self.yolo_ms,
                 "queue_delay_ms": self.queue_delay_ms,
                 "detections": self.detections,
+                "yolo_seq": self.yolo_seq,
+                "yolo_frame_ts": self.yolo_frame_ts,
+                "yolo_frame_seq": self.yolo_frame_seq,
+                "stale_results": self.stale_results,
             }
 
     def get_latest_frame(self):
         with self.lock:
-            return self.jpeg_bytes, self.last_frame_ts
+            return self.frame, self.last_frame_ts
+
+
+# ---------------- Encoding ----------------
+class EncodedFrame:
+    """
+    One decoded frame plus the JPEG tiers encoded from it so far, keyed by
+    (quality, width). Nothing is encoded until a client asks for a tier; each
+    tier is then encoded once and shared by every client that wants it.
+    """
+
+    def __init__(self, seq: int, bgr_frame, ts: float):
+        self.seq = seq
+        self.bgr_frame = bgr_frame
+        self.ts = ts
+        self.lock = threading.Lock()
+        self.tiers: Dict[tuple, Optional[bytes]] = {}
+
+    def jpeg(self, tier: tuple) -> Optional[bytes]:
+        with self.lock:
+            if tier in self.tiers:
+                return self.tiers[tier]
+            quality, width = tier
+            img = self.bgr_frame
+            h, w = img.shape[:2]
+            if width and width < w:
+                img = cv2.resize(img, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+            success, encoded = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            jpeg_bytes = encoded.tobytes() if success else None
+            self.tiers[tier] = jpeg_bytes
+            return jpeg_bytes
+
+
+# ---------------- Broadcast ----------------
+class LatestSlot:
+    """One websocket client's mailbox. Holds only the newest item, a slow client skips what it missed."""
+
+    def __init__(self):
+        self.item = None
+        self.event = asyncio.Event()
+
+    def put(self, item):
+        self.item = item
+        self.event.set()
+
+    async def get(self):
+        await self.event.wait()
+        self.event.clear()
+        item, self.item = self.item, None
+        return item
+
+
+class BroadcastHub:
+    """
+    Fans out one source's stream to its websocket clients.
+
+    Producer threads call publish(); the item is handed to the event loop with
+    call_soon_threadsafe and dropped into every client's LatestSlot there, so
+    clients wait on an asyncio.Event instead of polling AppState.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.clients = set()
+        self.latest = None
+        # Subscribers per tier, read by the producer thread to know what to encode.
+        self.tier_lock = threading.Lock()
+        self.tier_counts: Dict[tuple, int] = {}
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def subscribe(self, tier: Optional[tuple] = None) -> LatestSlot:
+        slot = LatestSlot()
+        slot.tier = tier
+        if tier is not None:
+            with self.tier_lock:
+                self.tier_counts[tier] = self.tier_counts.get(tier, 0) + 1
+        if self.latest is not None:
+            slot.put(self.latest)
+        self.clients.add(slot)
+        return slot
+
+    def unsubscribe(self, slot: LatestSlot):
+        if slot not in self.clients:
+            return
+        self.clients.discard(slot)
+        if slot.tier is not None:
+            with self.tier_lock:
+                self.tier_counts[slot.tier] -= 1
+                if not self.tier_counts[slot.tier]:
+                    del self.tier_counts[slot.tier]
+
+    def active_tiers(self) -> List[tuple]:
+        """Tiers at least one client is subscribed to. Thread-safe."""
+        with self.tier_lock:
+            return list(self.tier_counts)
+
+    def publish(self, item):
+        """Thread-safe. Nobody watching → just remember it, don't wake the loop."""
+        loop = self.loop
+        if not self.clients or loop is None or loop.is_closed():
+            self.latest = item
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, item)
+        except RuntimeError:
+            # loop closed between the check and the call (shutdown)
+            self.latest = item
+
+    def _deliver(self, item):
+        self.latest = item
+        for slot in self.clients:
+            slot.put(item)
+
+    def close(self):
+        """Wake every client with None so its handler returns. Call on the event loop."""
+        for slot in self.clients:
+            slot.put(None)
 
 
 app_states: Dict[str, AppState] = {}
-frame_queues: Dict[str, "queue.Queue"] = {}
+video_hubs: Dict[str, BroadcastHub] = {}
+yolo_hubs: Dict[str, BroadcastHub] = {}
 # Keep handles so we can join during shutdown and exit cleanly.
 worker_threads: List[threading.Thread] = []
 
 stop_event = threading.Event()
 
+
+# ---------------- Inference scheduling ----------------
+class DrrScheduler:
+    """
+    Hands frames from every source to the shared YOLO pool in batches.
+
+    Each source keeps only its newest ceil(weight) frames, so a visit has as
+    many frames ready as its quantum lets it take. Sources are visited
+    deficit-round-robin: a visit adds the source's quantum (weight, in frames)
+    to its deficit and takes frames while the deficit covers them, so a busy
+    source can't starve the others and weights hold over time for sources
+    that keep up. A source with nothing ready loses its deficit, as in
+    classic DRR. A fractional weight gets a frame every few rounds.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(weights or {})
+        for sid, weight in self.weights.items():
+            if not weight > 0:
+                raise ValueError(f"DRR weight for {sid} must be > 0, got {weight}")
+        self.cond = threading.Condition()
+        self.pending: Dict[str, deque] = {}
+        self.deficit: Dict[str, float] = {}
+        self.order: List[str] = []
+        self.next_idx = 0
+        self.fresh_visit = True
+        self.closed = False
+
+    def add_source(self, source_id: str):
+        with self.cond:
+            depth = max(1, math.ceil(self.weights.get(source_id, 1.0)))
+            self.pending[source_id] = deque(maxlen=depth)
+            self.deficit[source_id] = 0.0
+            self.order.append(source_id)
+
+    def submit(self, source_id: str, item):
+        """Producer side: newest frame replaces the oldest when the source is full."""
+        with self.cond:
+            self.pending[source_id].append(item)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            for q in self.pending.values():
+                q.clear()
+            self.cond.notify_all()
+
+    def next_batch(self, max_batch: int, timeout: float = 0.1):
+        """[(source_id, item), ...] — empty on timeout, None once closed."""
+        with self.cond:
+            if not self.closed and not any(self.pending.values()):
+                self.cond.wait(timeout)
+            if self.closed:
+                return None
+
+            batch = []
+            while len(batch) < max_batch and any(self.pending.values()):
+                sid = self.order[self.next_idx]
+                q = self.pending[sid]
+                if q and self.fresh_visit:
+                    self.deficit[sid] += self.weights.get(sid, 1.0)
+                    self.fresh_visit = False
+                while q and self.deficit[sid] >= 1.0 and len(batch) < max_batch:
+                    batch.append((sid, q.popleft()))
+                    self.deficit[sid] -= 1.0
+                if not q:
+                    self.deficit[sid] = 0.0
+                elif self.deficit[sid] >= 1.0:
+                    # Batch is full mid-turn: this source resumes its turn in the next batch.
+                    break
+                self.next_idx = (self.next_idx + 1) % len(self.order)
+                self.fresh_visit = True
+            return batch
+
+
+def yolo_max_batch(model_path: str) -> int:
+    if YOLO_MAX_BATCH > 0:
+        return YOLO_MAX_BATCH
+    # CoreML/ONNX/TensorRT exports are usually built for a single image.
+    return 4 if model_path.endswith(".pt") else 1
+
+
+def yolo_pool_size() -> int:
+    if YOLO_NUM_WORKERS > 0:
+        return YOLO_NUM_WORKERS
+    if device != "cpu":
+        # One accelerator: a second worker keeps it fed while the other pre/post-processes.
+        return 2
+    # torch already spreads one inference over several cores.
+    return max(1, min(4, (os.cpu_count() or 4) // 4))
+
+
+scheduler = DrrScheduler(YOLO_SOURCE_WEIGHTS)
+
 # ---------------- Video sources ----------------
 VIDEO_SOURCES: Dict[str, object] = {
     "cam1": "/Users/chris/Documents/developer/darkcyan_data/test_data/video/Reolink4kFront-20230910-191600.mp4",
@@ -145,9 +384,10 @@ def is_camera_source(source) -> bool:
 def frame_producer(
     source_id: str,
     source: str,
-    frame_queue: "queue.Queue",
+    scheduler: DrrScheduler,
     state: AppState,
     stop_event: threading.Event,
+    video_hub: BroadcastHub,
     max_width: int = 1024,
 ):
     """
@@ -156,13 +396,12 @@ def frame_producer(
     - Decodes video using ffmpeg (PyAV).
     - Scales frames to max_width using ffmpeg filter graph.
     - Converts frames to yuvj420p for JPEG compatibility.
-    - Encodes JPEG using PyAV MJPEG encoder (no OpenCV).
+    - Encodes JPEG via OpenCV, lazily, only for the tiers /ws_video clients request.
     - Extracts NV12 frames for YOLO workers.
     """
 
     import av
     import time
-    import queue
     import cv2
     from collections import deque
 
@@ -218,6 +457,7 @@ def frame_producer(
     ts_deque = deque(maxlen=60)
     # Track schedule for pacing so we match the file FPS without cumulative drift.
     next_frame_time = time.time()
+    seq = 0
 
     logger.info(f"[{source_id}] Frame producer (PyAV + OpenCV JPEG) started")
 
@@ -257,32 +497,26 @@ def frame_producer(
                         scale_x = w / new_w
                         scale_y = h / new_h
 
-                    # Encode JPEG via OpenCV (quality tuned for throughput).
-                    success, encoded = cv2.imencode(".jpg", bgr_frame, JPEG_PARAMS)
-                    if success:
-                        state.update_frame(encoded.tobytes(), w, h, ts)
-
-                        ts_deque.append(ts)
-                        if len(ts_deque) >= 2:
-                            elapsed = ts_deque[-1] - ts_deque[0]
-                            if elapsed > 0:
-                                state.update_video_fps((len(ts_deque)-1)/elapsed)
+                    # Encode JPEG only for the tiers someone is watching, once per tier.
+                    # With no /ws_video clients the frame is never encoded at all.
+                    seq += 1
+                    frame = EncodedFrame(seq, bgr_frame, ts)
+                    for tier in video_hub.active_tiers():
+                        frame.jpeg(tier)
+                    state.update_frame(frame, w, h, ts)
+                    video_hub.publish(frame)
+
+                    ts_deque.append(ts)
+                    if len(ts_deque) >= 2:
+                        elapsed = ts_deque[-1] - ts_deque[0]
+                        if elapsed > 0:
+                            state.update_video_fps((len(ts_deque)-1)/elapsed)
 
                     # -------------------------
                     # Provide YOLO-ready frame to YOLO worker
                     # -------------------------
-                    try:
-                        frame_queue.put((yolo_frame, w, h, scale_x, scale_y, ts), block=False)
-                    except queue.Full:
-                        # Drop oldest
-                        try:
-                            frame_queue.get_nowait()
-                        except queue.Empty:
-                            pass
-                        try:
-                            frame_queue.put((yolo_frame, w, h, scale_x, scale_y, ts), block=False)
-                        except queue.Full:
-                            pass
+                    # Drops the oldest pending frame if the pool hasn't taken it yet.
+                    scheduler.submit(source_id, (yolo_frame, w, h, scale_x, scale_y, ts, seq))
 
                     # -------------------------
                     # Pace based on source FPS
@@ -316,85 +550,172 @@ def frame_producer(
 
 
 
+def extract_detections(r, scale_x: float, scale_y: float) -> List[dict]:
+    """Detections of one result, boxes scaled back to the producer's frame size."""
+    dets: List[dict] = []
+    if hasattr(r, "boxes") and r.boxes is not None:
+        for box in r.boxes:
+            try:
+                xyxy = box.xyxy[0].tolist()
+                cls_id = int(box.cls[0])
+                conf = float(box.conf[0])
+                if conf < YOLO_MIN_CONF:
+                    continue
+
+                x1, y1, x2, y2 = xyxy
+                x1 *= scale_x
+                x2 *= scale_x
+                y1 *= scale_y
+                y2 *= scale_y
+
+                dets.append({"cls": cls_id, "conf": conf, "xyxy": [x1, y1, x2, y2]})
+            except Exception:
+                continue
+    return dets
+
+
 def yolo_worker(
-    source_id: str,
-    frame_queue: "queue.Queue",
-    state: AppState,
+    scheduler: DrrScheduler,
     stop_event: threading.Event,
     model_path: str,
     worker_idx: int,
 ):
-    """YOLO worker: consumes pre-sized frames and runs YOLO inference."""
-    logger.info(f"[{source_id}][yolo{worker_idx}] Initializing YOLO model on {device}")
+    """YOLO pool worker: batches pre-sized frames from all sources into one predict call."""
+    logger.info(f"[yolo{worker_idx}] Initializing YOLO model on {device}")
     local_model = YOLO(model_path, task='detect')
+    max_batch = yolo_max_batch(model_path)
 
-    logger.info(f"[{source_id}][yolo{worker_idx}] YOLO worker started")
+    logger.info(f"[yolo{worker_idx}] YOLO worker started, batch <= {max_batch}")
 
     while not stop_event.is_set():
-        try:
-            item = frame_queue.get(timeout=0.1)
-        except queue.Empty:
-            continue
-
-        if item is None:
+        batch = scheduler.next_batch(max_batch, timeout=0.1)
+        if batch is None:
             break
+        if not batch:
+            continue
 
-        yolo_frame, _orig_w, _orig_h, scale_x, scale_y, ts_in = item
-
-        queue_delay_ms = (time.time() - ts_in) * 1000.0
-
-        # YOLO inference (input already resized on producer thread)
+        # YOLO inference (inputs already resized on producer threads)
+        frames = [item[0] for _sid, item in batch]
         start = time.time()
-        results = local_model(yolo_frame, device=device, verbose=False)
-        yolo_ms = (time.time() - start) * 1000.0
-
-        # Extract detections, scale boxes back to original size
-        dets: List[dict] = []
-        r = results[0]
-        if hasattr(r, "boxes") and r.boxes is not None:
-            for box in r.boxes:
+        try:
+            results = None
+            if len(frames) > 1:
                 try:
-                    xyxy = box.xyxy[0].tolist()
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    if conf < YOLO_MIN_CONF:
-                        continue
-
-                    x1, y1, x2, y2 = xyxy
-                    x1 *= scale_x
-                    x2 *= scale_x
-                    y1 *= scale_y
-                    y2 *= scale_y
-
-                    dets.append({"cls": cls_id, "conf": conf, "xyxy": [x1, y1, x2, y2]})
-                except Exception:
-                    continue
+                    results = local_model(frames, device=device, verbose=False)
+                except Exception as e:
+                    logger.error(f"[yolo{worker_idx}] Batch of {len(frames)} failed ({e}), predicting frame by frame from now on")
+                if results is not None and len(results) != len(frames):
+                    logger.error(f"[yolo{worker_idx}] Model returned {len(results)} results for a batch of {len(frames)}, predicting frame by frame from now on")
+                    results = None
+                if results is None:
+                    max_batch = 1
+            if results is None:
+                results = [local_model(frame, device=device, verbose=False)[0] for frame in frames]
+        except Exception as e:
+            logger.error(f"[yolo{worker_idx}] Inference failed for batch of {len(batch)}: {e}")
+            continue
+        done = time.time()
+        # Per-frame cost of the batch, comparable with the old one-frame-per-call numbers.
+        yolo_ms = (done - start) * 1000.0 / len(batch)
+
+        for (source_id, item), r in zip(batch, results, strict=True):
+            _yolo_frame, _orig_w, _orig_h, scale_x, scale_y, ts_in, frame_seq = item
+            queue_delay_ms = (start - ts_in) * 1000.0
+            dets = extract_detections(r, scale_x, scale_y)
+
+            # Update shared state
+            state = app_states[source_id]
+            # Workers finish out of order; an older frame's result never replaces a newer one,
+            # and a dropped result doesn't count toward the FPS or latency metrics either.
+            if not state.update_detections(dets, ts_in, frame_seq):
+                continue
+            state.update_metrics(yolo_ms, queue_delay_ms)
+            state.record_yolo_frame(done)
+
+            # Always published so hub.latest stays current for the next subscriber. Serialized
+            # here, once per format in use (none with no clients), not once per connected client.
+            yolo_hub = yolo_hubs[source_id]
+            result = YoloResult(source_id, state.snapshot())
+            for fmt in yolo_hub.active_tiers():
+                result.encode(fmt)
+            yolo_hub.publish(result)
+
+    logger.info(f"[yolo{worker_idx}] YOLO worker stopped")
+
+
+# ---------------- ws_yolo binary protocol ----------------
+# Opt in with /ws_yolo/{source_id}?format=binary. Every message starts with
+#   magic b"DY", version u8, type u8
+# little-endian, followed by:
+#   DETECTIONS: seq u32, frame_count u32, frame_ts f64, count u32,
+#               then count rows of float32 (x1, y1, x2, y2, conf, cls)
+#   METRICS:    fps_video, fps_yolo, source_fps, yolo_ms, queue_delay_ms as float32
+# DETECTIONS is only sent when the YOLO result sequence advances; METRICS on
+# connect and then every BINARY_METRICS_INTERVAL_S, whether or not YOLO results arrive.
+BINARY_VERSION = 1
+MSG_DETECTIONS = 1
+MSG_METRICS = 2
+BINARY_METRICS_INTERVAL_S = 1.0
+DETECTIONS_HEADER = struct.Struct("<2sBBIIdI")
+METRICS_PACKET = struct.Struct("<2sBB5f")
+
+
+class YoloResult:
+    """One YOLO result as published on the hub, with its JSON / binary encodings cached."""
+
+    def __init__(self, source_id: str, snap: dict):
+        self.source_id = source_id
+        self.snap = snap
+        self.seq = snap["yolo_seq"]
+        self.encoded: Dict[str, bytes] = {}
+
+    def encode(self, fmt: str):
+        if fmt not in self.encoded:
+            self.encoded[fmt] = self._binary() if fmt == "binary" else self._json()
+        return self.encoded[fmt]
+
+    def _json(self) -> str:
+        snap = self.snap
+        return json.dumps(
+            {
+                "source_id": self.source_id,
+                "frame_count": snap["frame_count"],
+                "yolo_seq": self.seq,
+                "fps_video": snap["fps_video"],
+                "fps_yolo": snap["fps"],
+                "source_fps": snap["source_fps"],
+                "yolo_ms": snap["yolo_ms"],
+                "queue_delay_ms": snap["queue_delay_ms"],
+                "frame_seq": snap["yolo_frame_seq"],
+                "stale_results": snap["stale_results"],
+                "detections": snap["detections"],
+            }
+        )
 
-        # Update shared state
-        state.update_detections(dets)
-        state.update_metrics(yolo_ms, queue_delay_ms)
-        state.record_yolo_frame(time.time())
+    def _binary(self) -> bytes:
+        dets = self.snap["detections"]
+        rows = np.array(
+            [d["xyxy"] + [d["conf"], d["cls"]] for d in dets], dtype="<f4"
+        ).reshape(len(dets), 6)
+        header = DETECTIONS_HEADER.pack(
+            b"DY", BINARY_VERSION, MSG_DETECTIONS,
+            self.seq & 0xFFFFFFFF, self.snap["frame_count"] & 0xFFFFFFFF,
+            self.snap["yolo_frame_ts"], len(dets),
+        )
+        return header + rows.tobytes()
 
-    logger.info(f"[{source_id}][yolo{worker_idx}] YOLO worker stopped")
 
+def metrics_packet(snap: dict) -> bytes:
+    return METRICS_PACKET.pack(
+        b"DY", BINARY_VERSION, MSG_METRICS,
+        snap["fps_video"], snap["fps"], snap["source_fps"],
+        snap["yolo_ms"], snap["queue_delay_ms"],
+    )
 
-def _signal_worker_shutdown():
-    """Ensure YOLO workers unblock by flushing queues and pushing sentinels sequentially."""
-    for sid, q in frame_queues.items():
-        # Drop any pending frames – we don't need to finish processing them.
-        while True:
-            try:
-                q.get_nowait()
-            except queue.Empty:
-                break
 
-        for worker_idx in range(YOLO_NUM_WORKERS):
-            try:
-                q.put(None, timeout=2.0)
-            except queue.Full:
-                logger.warning(
-                    f"[{sid}] Timeout inserting shutdown sentinel for YOLO worker {worker_idx}"
-                )
+def _signal_worker_shutdown():
+    """Drop pending frames and wake every YOLO worker waiting for a batch."""
+    scheduler.close()
 
 
 def startup():
@@ -403,9 +724,8 @@ def startup():
     for sid, src in VIDEO_SOURCES.items():
         state = AppState()
         app_states[sid] = state
-
-        q: "queue.Queue" = queue.Queue(maxsize=1)
-        frame_queues[sid] = q
+        video_hub = video_hubs[sid]
+        scheduler.add_source(sid)
 
         # FPS probe
         if is_camera_source(src):
@@ -426,36 +746,47 @@ def startup():
         # frame producer
         producer_thread = threading.Thread(
             target=frame_producer,
-            args=(sid, src, q, state, stop_event),
+            args=(sid, src, scheduler, state, stop_event, video_hub),
             daemon=True,
         )
         producer_thread.start()
         worker_threads.append(producer_thread)
+        logger.info(f"[{sid}] Producer started")
+
+    # One YOLO pool shared by every source: model memory doesn't grow with sources.
+    pool_size = yolo_pool_size()
+    for worker_idx in range(pool_size):
+        worker_thread = threading.Thread(
+            target=yolo_worker,
+            args=(scheduler, stop_event, YOLO_MODEL_PATH, worker_idx),
+            daemon=True,
+        )
+        worker_thread.start()
+        worker_threads.append(worker_thread)
 
-        # multiple YOLO workers
-        for worker_idx in range(YOLO_NUM_WORKERS):
-            worker_thread = threading.Thread(
-                target=yolo_worker,
-                args=(sid, q, state, stop_event, YOLO_MODEL_PATH, worker_idx),
-                daemon=True,
-            )
-            worker_thread.start()
-            worker_threads.append(worker_thread)
-
-        logger.info(f"[{sid}] Producer + {YOLO_NUM_WORKERS} YOLO workers started")
+    logger.info(f"YOLO pool: {pool_size} workers, batch <= {yolo_max_batch(YOLO_MODEL_PATH)}, {len(VIDEO_SOURCES)} sources")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
+    # Hubs exist before the producer threads so they can publish from their first frame.
+    loop = asyncio.get_running_loop()
+    for sid in VIDEO_SOURCES:
+        video_hubs[sid] = BroadcastHub(f"{sid}/video")
+        yolo_hubs[sid] = BroadcastHub(f"{sid}/yolo")
+        video_hubs[sid].bind(loop)
+        yolo_hubs[sid].bind(loop)
+
     # Run blocking startup logic without blocking event loop
-    loop = asyncio.get_event_loop()
     await loop.run_in_executor(None, startup)
 
     yield  # <-- execution yields to the running server
 
     # Shutdown logic
     stop_event.set()
+    for hub in list(video_hubs.values()) + list(yolo_hubs.values()):
+        hub.close()
     logger.info("Shutdown: stop_event set")
 
     def _join_threads():
@@ -502,6 +833,7 @@ def health():
             "frame_count": snap["frame_count"],
             "yolo_ms": snap["yolo_ms"],
             "queue_delay_ms": snap["queue_delay_ms"],
+            "stale_results": snap["stale_results"],
         }
     return JSONResponse(data)
 
@@ -523,62 +855,82 @@ def list_sources():
 
 # ---------------- WebSockets ----------------
 
+# Both endpoints wait on the source's BroadcastHub; nothing polls AppState per client.
+
 # 1) Video stream: raw JPEG frames at capture rate (no YOLO overlay)
+#    ?quality=1-100 and ?width=<px> pick the tier; clients asking for the same one share its encode.
 @app.websocket("/ws_video/{source_id}")
-async def ws_video(ws: WebSocket, source_id: str):
-    if source_id not in app_states:
+async def ws_video(ws: WebSocket, source_id: str, quality: int = JPEG_QUALITY, width: int = 0):
+    if source_id not in video_hubs:
         await ws.close(code=1008)
         return
 
-    state = app_states[source_id]
+    hub = video_hubs[source_id]
     await ws.accept()
-    last_ts = 0.0
-    logger.info(f"[{source_id}] Video WebSocket connected")
+    tier = (min(max(quality, 1), 100), max(width, 0))
+    slot = hub.subscribe(tier)
+    logger.info(f"[{source_id}] Video WebSocket connected, tier {tier} ({len(hub.clients)} clients)")
 
     try:
         while True:
-            jpeg, ts = state.get_latest_frame()
-            if jpeg is not None and ts != last_ts:
-                await ws.send_bytes(jpeg)
-                last_ts = ts
-            else:
-                await asyncio.sleep(0.005)
+            frame = await slot.get()
+            if frame is None:
+                break
+            jpeg = frame.tiers.get(tier)
+            if jpeg is None:
+                # Tier subscribed after the producer encoded this frame (or its first client): encode
+                # it off the event loop; the result is cached on the frame for the other clients.
+                jpeg = await asyncio.to_thread(frame.jpeg, tier)
+                if jpeg is None:
+                    continue
+            await ws.send_bytes(jpeg)
     except Exception as e:
         logger.info(f"[{source_id}] Video WebSocket disconnected: {e}")
+    finally:
+        hub.unsubscribe(slot)
 
 
-# 2) YOLO detections: JSON metadata at YOLO rate
+# 2) YOLO detections at YOLO rate: JSON by default, ?format=binary for the packed protocol above
 @app.websocket("/ws_yolo/{source_id}")
-async def ws_yolo(ws: WebSocket, source_id: str):
-    if source_id not in app_states:
+async def ws_yolo(ws: WebSocket, source_id: str, format: str = "json"):
+    if source_id not in yolo_hubs:
         await ws.close(code=1008)
         return
 
+    hub = yolo_hubs[source_id]
     state = app_states[source_id]
     await ws.accept()
-    last_frame_count = -1
-    logger.info(f"[{source_id}] YOLO WebSocket connected")
+    fmt = "binary" if format == "binary" else "json"
+    slot = hub.subscribe(fmt)
+    last_seq = -1
+    next_metrics = 0.0
+    logger.info(f"[{source_id}] YOLO WebSocket connected, {fmt} ({len(hub.clients)} clients)")
 
     try:
         while True:
-            snap = state.snapshot()
-            fc = snap["frame_count"]
-            if fc != last_frame_count:
-                payload = json.dumps(
-                    {
-                        "source_id": source_id,
-                        "frame_count": fc,
-                        "fps_video": snap["fps_video"],
-                        "fps_yolo": snap["fps"],
-                        "source_fps": snap["source_fps"],
-                        "yolo_ms": snap["yolo_ms"],
-                        "queue_delay_ms": snap["queue_delay_ms"],
-                        "detections": snap["detections"],
-                    }
-                )
-                await ws.send_text(payload)
-                last_frame_count = fc
+            if fmt == "binary":
+                # Metrics run off a timer so a stalled source still reports its (falling) rates.
+                now = time.time()
+                if now >= next_metrics:
+                    await ws.send_bytes(metrics_packet(state.snapshot()))
+                    next_metrics = now + BINARY_METRICS_INTERVAL_S
+                try:
+                    result = await asyncio.wait_for(slot.get(), timeout=max(next_metrics - now, 0.0))
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                result = await slot.get()
+            if result is None:
+                break
+            # Two workers can publish out of order; never send an older (or the same) result.
+            if result.seq <= last_seq:
+                continue
+            last_seq = result.seq
+            if fmt == "binary":
+                await ws.send_bytes(result.encode(fmt))
             else:
-                await asyncio.sleep(0.05)
+                await ws.send_text(result.encode(fmt))
     except Exception as e:
         logger.info(f"[{source_id}] YOLO WebSocket disconnected: {e}")
+    finally:
+        hub.unsubscribe(slot)